@@ -14,6 +14,7 @@
 #    under the License.
 
 from midonet.neutron.client import base
+from midonet.neutron.client import executor
 from midonet.neutron.common import config  # noqa
 from midonetclient import client
 
@@ -21,78 +22,151 @@ from oslo_config import cfg
 
 
 class MidonetApiClient(base.MidonetClientBase):
+    """Client making the MidoNet API calls in the postcommit hooks.
+
+    With MIDONET.api_async_workers set, the calls are queued to a pool of
+    threads instead, ordered for each resource and its parents, and the
+    API requests return once the Neutron DB is committed.  The failed
+    calls are reported to the handler set by the plugin, which rolls back
+    the resources created.  The deletes are ordered with the calls on the
+    parents of the resources, whose IDs the plugin gives.
+    """
 
     def __init__(self):
         conf = cfg.CONF.MIDONET
         self.api_cli = client.MidonetClient(conf.midonet_uri, conf.username,
                                             conf.password,
                                             project_id=conf.project_id)
+        self._executor = None
+        if conf.api_async_workers > 0:
+            self._executor = executor.OrderedExecutor(
+                conf.api_async_workers, conf.api_async_queue_size)
+
+    def set_postcommit_failure_handler(self, handler):
+        if self._executor is not None:
+            self._executor.failure_handler = handler
+
+    def _call(self, keys, name, func, *args):
+        if self._executor is None:
+            func(*args)
+        else:
+            self._executor.submit(keys, name, func, *args)
 
     def create_network_postcommit(self, network):
-        self.api_cli.create_network(network)
+        self._call([network['id']], 'create_network_postcommit',
+                   self.api_cli.create_network, network)
 
     def update_network_postcommit(self, network_id, network):
-        self.api_cli.update_network(network_id, network)
+        self._call([network_id], 'update_network_postcommit',
+                   self.api_cli.update_network, network_id, network)
 
     def delete_network_postcommit(self, network_id):
-        self.api_cli.delete_network(network_id)
+        self._call([network_id], 'delete_network_postcommit',
+                   self.api_cli.delete_network, network_id)
 
     def create_subnet_postcommit(self, subnet):
-        self.api_cli.create_subnet(subnet)
+        self._call([subnet['id'], subnet['network_id']],
+                   'create_subnet_postcommit', self.api_cli.create_subnet,
+                   subnet)
 
     def update_subnet_postcommit(self, subnet_id, subnet):
-        self.api_cli.update_subnet(subnet_id, subnet)
+        self._call([subnet_id, subnet['network_id']],
+                   'update_subnet_postcommit', self.api_cli.update_subnet,
+                   subnet_id, subnet)
 
-    def delete_subnet_postcommit(self, subnet_id):
-        self.api_cli.delete_subnet(subnet_id)
+    def delete_subnet_postcommit(self, subnet_id, network_id=None):
+        self._call([subnet_id, network_id], 'delete_subnet_postcommit',
+                   self.api_cli.delete_subnet, subnet_id)
 
     def create_port_postcommit(self, port):
-        self.api_cli.create_port(port)
+        self._call([port['id'], port['network_id']],
+                   'create_port_postcommit', self.api_cli.create_port, port)
 
     def update_port_postcommit(self, port_id, port):
-        self.api_cli.update_port(port_id, port)
+        self._call([port_id, port['network_id']], 'update_port_postcommit',
+                   self.api_cli.update_port, port_id, port)
 
-    def delete_port_postcommit(self, port_id):
-        self.api_cli.delete_port(port_id)
+    def delete_port_postcommit(self, port_id, network_id=None):
+        self._call([port_id, network_id], 'delete_port_postcommit',
+                   self.api_cli.delete_port, port_id)
 
     def create_router_postcommit(self, router):
-        self.api_cli.create_router(router)
+        gw = router.get('external_gateway_info') or {}
+        self._call([router['id'], gw.get('network_id')],
+                   'create_router_postcommit', self.api_cli.create_router,
+                   router)
 
     def update_router_postcommit(self, router_id, router):
-        self.api_cli.update_router(router_id, router)
+        gw = router.get('external_gateway_info') or {}
+        self._call([router_id, gw.get('network_id')],
+                   'update_router_postcommit', self.api_cli.update_router,
+                   router_id, router)
 
     def delete_router_postcommit(self, router_id):
-        self.api_cli.delete_router(router_id)
+        self._call([router_id], 'delete_router_postcommit',
+                   self.api_cli.delete_router, router_id)
 
     def add_router_interface_postcommit(self, router_id, interface_info):
-        self.api_cli.add_router_interface(router_id, interface_info)
+        self._call([router_id, interface_info.get('port_id'),
+                    interface_info.get('subnet_id')],
+                   'add_router_interface_postcommit',
+                   self.api_cli.add_router_interface, router_id,
+                   interface_info)
 
     def remove_router_interface_postcommit(self, router_id, interface_info):
-        self.api_cli.remove_router_interface(router_id, interface_info)
+        self._call([router_id, interface_info.get('port_id'),
+                    interface_info.get('subnet_id')],
+                   'remove_router_interface_postcommit',
+                   self.api_cli.remove_router_interface, router_id,
+                   interface_info)
 
     def create_floatingip_postcommit(self, floatingip):
-        self.api_cli.create_floating_ip(floatingip)
+        self._call([floatingip['id'], floatingip.get('router_id'),
+                    floatingip.get('port_id')],
+                   'create_floatingip_postcommit',
+                   self.api_cli.create_floating_ip, floatingip)
 
     def update_floatingip_postcommit(self, floatingip_id, floatingip):
-        self.api_cli.update_floating_ip(floatingip_id, floatingip)
+        self._call([floatingip_id, floatingip.get('router_id'),
+                    floatingip.get('port_id')],
+                   'update_floatingip_postcommit',
+                   self.api_cli.update_floating_ip, floatingip_id,
+                   floatingip)
 
     def delete_floatingip_postcommit(self, floatingip_id):
-        self.api_cli.delete_floating_ip(floatingip_id)
+        self._call([floatingip_id], 'delete_floatingip_postcommit',
+                   self.api_cli.delete_floating_ip, floatingip_id)
 
     def create_security_group_postcommit(self, security_group):
-        self.api_cli.create_security_group(security_group)
+        self._call([security_group['id']],
+                   'create_security_group_postcommit',
+                   self.api_cli.create_security_group, security_group)
 
     def delete_security_group_postcommit(self, security_group_id):
-        self.api_cli.delete_security_group(security_group_id)
+        self._call([security_group_id], 'delete_security_group_postcommit',
+                   self.api_cli.delete_security_group, security_group_id)
 
     def create_security_group_rule_postcommit(self, security_group_rule):
-        self.api_cli.create_security_group_rule(security_group_rule)
+        sg_id = security_group_rule['security_group_id']
+        self._call([security_group_rule['id'], sg_id],
+                   'create_security_group_rule_postcommit',
+                   self.api_cli.create_security_group_rule,
+                   security_group_rule)
 
     def create_security_group_rule_bulk_postcommit(self, security_group_rules):
-        self.api_cli.create_security_group_rule_bulk(security_group_rules)
-
-    def delete_security_group_rule_postcommit(self, security_group_rule_id):
-        self.api_cli.delete_security_group_rule(security_group_rule_id)
+        keys = set()
+        for rule in security_group_rules:
+            keys.update((rule['id'], rule['security_group_id']))
+        self._call(keys, 'create_security_group_rule_bulk_postcommit',
+                   self.api_cli.create_security_group_rule_bulk,
+                   security_group_rules)
+
+    def delete_security_group_rule_postcommit(self, security_group_rule_id,
+                                              security_group_id=None):
+        self._call([security_group_rule_id, security_group_id],
+                   'delete_security_group_rule_postcommit',
+                   self.api_cli.delete_security_group_rule,
+                   security_group_rule_id)
 
     def create_vip(self, context, vip):
         self.api_cli.create_vip(vip)
@@ -29,12 +29,29 @@ class MidonetClientBase(object):
     def initialize(self):
         pass
 
+    def set_postcommit_failure_handler(self, handler):
+        """Sets the function called when a deferred postcommit fails.
+
+        It is called with the name of the postcommit method, its arguments
+        and the exception, by the clients which run the postcommit hooks
+        after they return.
+        """
+        pass
+
     def create_network_precommit(self, context, network):
         pass
 
     def create_network_postcommit(self, network):
         pass
 
+    def create_network_bulk_precommit(self, context, networks):
+        for network in networks:
+            self.create_network_precommit(context, network)
+
+    def create_network_bulk_postcommit(self, networks):
+        for network in networks:
+            self.create_network_postcommit(network)
+
     def update_network_precommit(self, context, network_id, network):
         pass
 
@@ -53,6 +70,14 @@ class MidonetClientBase(object):
     def create_subnet_postcommit(self, subnet):
         pass
 
+    def create_subnet_bulk_precommit(self, context, subnets):
+        for subnet in subnets:
+            self.create_subnet_precommit(context, subnet)
+
+    def create_subnet_bulk_postcommit(self, subnets):
+        for subnet in subnets:
+            self.create_subnet_postcommit(subnet)
+
     def update_subnet_precommit(self, context, subnet_id, subnet):
         pass
 
@@ -62,7 +87,13 @@ class MidonetClientBase(object):
     def delete_subnet_precommit(self, context, subnet_id):
         pass
 
-    def delete_subnet_postcommit(self, subnet_id):
+    def delete_subnet_postcommit(self, subnet_id, network_id=None):
+        """Deletes a subnet from MidoNet.
+
+        :param network_id: ID of the network of the subnet, given by the
+            plugin so that the delete can be ordered with the ones of the
+            network.
+        """
         pass
 
     def create_port_precommit(self, context, port):
@@ -71,6 +102,14 @@ class MidonetClientBase(object):
     def create_port_postcommit(self, port):
         pass
 
+    def create_port_bulk_precommit(self, context, ports):
+        for port in ports:
+            self.create_port_precommit(context, port)
+
+    def create_port_bulk_postcommit(self, ports):
+        for port in ports:
+            self.create_port_postcommit(port)
+
     def update_port_precommit(self, context, port_id, port):
         pass
 
@@ -80,7 +119,11 @@ class MidonetClientBase(object):
     def delete_port_precommit(self, context, port_id):
         pass
 
-    def delete_port_postcommit(self, port_id):
+    def delete_port_postcommit(self, port_id, network_id=None):
+        """Deletes a port from MidoNet.
+
+        :param network_id: ID of the network of the port.
+        """
         pass
 
     def create_router_precommit(self, context, router):
@@ -139,6 +182,14 @@ class MidonetClientBase(object):
     def create_security_group_postcommit(self, security_group):
         pass
 
+    def create_security_group_bulk_precommit(self, context, security_groups):
+        for security_group in security_groups:
+            self.create_security_group_precommit(context, security_group)
+
+    def create_security_group_bulk_postcommit(self, security_groups):
+        for security_group in security_groups:
+            self.create_security_group_postcommit(security_group)
+
     def update_security_group_precommit(self, context, security_group_id,
                                         security_group):
         pass
@@ -171,7 +222,12 @@ class MidonetClientBase(object):
                                              security_group_rule_id):
         pass
 
-    def delete_security_group_rule_postcommit(self, security_group_rule_id):
+    def delete_security_group_rule_postcommit(self, security_group_rule_id,
+                                              security_group_id=None):
+        """Deletes a security group rule from MidoNet.
+
+        :param security_group_id: ID of the security group of the rule.
+        """
         pass
 
     # Agent membership extension
@@ -16,18 +16,65 @@
 from midonet.neutron.client import base
 from midonet.neutron.common import config  # noqa
 from midonet.neutron.db import task_db as task
+from midonet.neutron.db import task_metrics
 from midonet.neutron.rpc import topology_client as top
 
 import neutron.db.api as db
+from neutron import i18n
+from neutron.openstack.common import loopingcall
 
 from oslo_config import cfg
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+_LE = i18n._LE
+_LI = i18n._LI
 
 
 class MidonetClusterClient(base.MidonetClientBase):
 
     def initialize(self):
+        task.check_task_config()
         task.create_config_task(db.get_session(), dict(cfg.CONF.MIDONET))
 
+        conf = cfg.CONF.MIDONET
+        if conf.task_gc_interval > 0:
+            self._task_gc = loopingcall.FixedIntervalLoopingCall(
+                self._collect_tasks)
+            self._task_gc.start(interval=conf.task_gc_interval,
+                                initial_delay=conf.task_gc_interval)
+        if conf.task_metrics_interval > 0:
+            self._task_metrics = task_metrics.TaskMetricsCollector()
+            self._task_metrics_call = loopingcall.FixedIntervalLoopingCall(
+                self._publish_task_metrics)
+            self._task_metrics_call.start(
+                interval=conf.task_metrics_interval,
+                initial_delay=conf.task_metrics_interval)
+
+    def _collect_tasks(self):
+        conf = cfg.CONF.MIDONET
+        try:
+            deleted = task.task_gc(db.get_session(), conf.task_gc_retention,
+                                   conf.task_gc_chunk_size,
+                                   archive=conf.task_gc_archive)
+        except Exception:
+            # Keep the looping call running
+            LOG.exception(_LE("Failed to delete the processed tasks"))
+            return
+        if deleted and conf.task_gc_archive:
+            LOG.info(_LI("Archived %(count)d processed tasks"),
+                     {'count': deleted})
+        elif deleted:
+            LOG.info(_LI("Deleted %(count)d processed tasks"),
+                     {'count': deleted})
+
+    def _publish_task_metrics(self):
+        try:
+            self._task_metrics.collect(db.get_session())
+        except Exception:
+            # Keep the looping call running
+            LOG.exception(_LE("Failed to publish the task pipeline metrics"))
+
     def create_network_precommit(self, context, network):
         task.create_task(context, task.CREATE, data_type=task.NETWORK,
                          resource_id=network['id'], data=network)
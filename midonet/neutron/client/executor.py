@@ -0,0 +1,147 @@
+# Copyright (C) 2015 Midokura SARL.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+from neutron import i18n
+from oslo_log import log as logging
+from six.moves import queue
+
+LOG = logging.getLogger(__name__)
+_LE = i18n._LE
+
+
+class _Operation(object):
+
+    def __init__(self, keys, name, func, args):
+        self.keys = keys
+        self.name = name
+        self.func = func
+        self.args = args
+        # Number of earlier operations this one waits for
+        self.waiting = 0
+        self.dependents = []
+        self.slot = False
+
+
+class OrderedExecutor(object):
+    """Runs operations in a pool of threads, in order for each key.
+
+    Each operation is submitted with the keys of the resources it touches,
+    e.g. the IDs of a port and of its network.  An operation only starts
+    once all the operations submitted before it with a common key are done,
+    so that the operations of a resource, and of a resource and its parents,
+    run in the order they were submitted.  Operations without common keys
+    run concurrently.
+
+    At most 'max_pending' operations are queued or running: submit blocks
+    until one of them is done, which pushes back on the callers.  The
+    operations submitted by the failure handler are not bounded, so that
+    the workers cannot wait on themselves.
+
+    :param failure_handler: function called with the name and the arguments
+        of an operation which raised, and the exception.
+    """
+
+    def __init__(self, workers, max_pending, failure_handler=None):
+        self.failure_handler = failure_handler
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._pending = 0
+        self._last = {}
+        self._ready = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._worker = threading.local()
+        self._threads = []
+        for _i in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, keys, name, func, *args):
+        """Queues func(*args) after the earlier operations on 'keys'."""
+        op = _Operation(set(k for k in keys if k is not None), name, func,
+                        args)
+        if not getattr(self._worker, 'active', False):
+            self._slots.acquire()
+            op.slot = True
+        with self._lock:
+            self._pending += 1
+            for prev in set(self._last.get(k) for k in op.keys):
+                if prev is not None:
+                    prev.dependents.append(op)
+                    op.waiting += 1
+            for key in op.keys:
+                self._last[key] = op
+            ready = op.waiting == 0
+        if ready:
+            self._ready.put(op)
+
+    def shutdown(self):
+        """Waits for the operations submitted and stops the workers.
+
+        The operations submitted by the failure handler meanwhile are waited
+        for too.  No operation can be submitted afterwards.
+        """
+        with self._lock:
+            while self._pending:
+                self._idle.wait()
+        for _thread in self._threads:
+            self._ready.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self):
+        self._worker.active = True
+        while True:
+            op = self._ready.get()
+            if op is None:
+                return
+            try:
+                op.func(*op.args)
+            except Exception as ex:
+                LOG.exception(_LE("MidoNet operation %s failed"), op.name)
+                self._handle_failure(op, ex)
+            finally:
+                self._done(op)
+
+    def _handle_failure(self, op, ex):
+        if self.failure_handler is None:
+            return
+        try:
+            self.failure_handler(op.name, op.args, ex)
+        except Exception:
+            LOG.exception(_LE("Failed to handle the failure of MidoNet "
+                              "operation %s"), op.name)
+
+    def _done(self, op):
+        with self._lock:
+            for key in op.keys:
+                if self._last.get(key) is op:
+                    del self._last[key]
+            ready = []
+            for dependent in op.dependents:
+                dependent.waiting -= 1
+                if dependent.waiting == 0:
+                    ready.append(dependent)
+            self._pending -= 1
+            if not self._pending:
+                self._idle.notify_all()
+        for dependent in ready:
+            self._ready.put(dependent)
+        if op.slot:
+            self._slots.release()
@@ -26,6 +26,84 @@ mido_opts = [
                help=_('Port that the cluster service can be reached on')),
     cfg.StrOpt('client', default='midonet.neutron.client.api.MidonetApiClient',
                help=_('MidoNet client used to access MidoNet data storage.')),
+    cfg.StrOpt('task_serializer', default='json',
+               help=_('Serializer of the data of the tasks: "json", '
+                      '"compact" for JSON without whitespaces, "fast" for '
+                      'compact JSON written with a reused encoder, or '
+                      '"msgpack" to store it in binary.')),
+    cfg.StrOpt('task_codec',
+               help=_('Codec used to encode the data of the tasks, e.g. '
+                      '"zlib" to store it compressed.  Plain JSON is stored '
+                      'if not set.')),
+    cfg.BoolOpt('task_update_delta', default=False,
+                help=_('Write UPDATE tasks as UPDATE_DELTA tasks carrying '
+                       'only the attributes changed since the previous task '
+                       'of the resource.')),
+    cfg.IntOpt('task_delta_snapshot_interval', default=10,
+               help=_('When task_update_delta is set, write the full data of '
+                      'a resource every this many updates.')),
+    cfg.IntOpt('task_gc_interval', default=0,
+               help=_('Interval in seconds between the deletions of the '
+                      'processed tasks from the tasks table.  0 disables '
+                      'the periodic deletion.')),
+    cfg.IntOpt('task_gc_retention', default=3600,
+               help=_('Number of seconds the processed tasks are kept for '
+                      'before being deleted.')),
+    cfg.IntOpt('task_gc_chunk_size', default=1000,
+               help=_('Maximum number of task IDs deleted in a single '
+                      'transaction.')),
+    cfg.BoolOpt('task_gc_archive', default=False,
+                help=_('Move the processed tasks to the tasks archive table '
+                       'instead of deleting them.')),
+    cfg.StrOpt('task_notifier',
+               help=_('Class notified of the highest task ID written by each '
+                      'committed transaction, e.g. UnixSocketTaskNotifier '
+                      'or WatermarkTaskNotifier from '
+                      'midonet.neutron.db.task_notifier.  No notification is '
+                      'sent if not set.')),
+    cfg.StrOpt('task_notifier_socket',
+               default='/var/run/neutron/midonet_tasks.sock',
+               help=_('Path of the UNIX datagram socket the task IDs are sent '
+                      'to by UnixSocketTaskNotifier.')),
+    cfg.IntOpt('task_metrics_interval', default=0,
+               help=_('Interval in seconds between the publications of the '
+                      'metrics of the task pipeline.  0 disables them.')),
+    cfg.StrOpt('task_metrics_sink',
+               default='midonet.neutron.db.task_metrics.LogTaskMetricsSink',
+               help=_('Class publishing the metrics of the task pipeline, '
+                      'e.g. LogTaskMetricsSink, '
+                      'PrometheusFileTaskMetricsSink or '
+                      'StatsdTaskMetricsSink from '
+                      'midonet.neutron.db.task_metrics.')),
+    cfg.StrOpt('task_metrics_file',
+               default='/var/lib/neutron/midonet_tasks.prom',
+               help=_('File the metrics are written to by '
+                      'PrometheusFileTaskMetricsSink.')),
+    cfg.StrOpt('task_metrics_statsd_host', default='127.0.0.1',
+               help=_('Host the metrics are sent to by '
+                      'StatsdTaskMetricsSink.')),
+    cfg.IntOpt('task_metrics_statsd_port', default=8125,
+               help=_('UDP port the metrics are sent to by '
+                      'StatsdTaskMetricsSink.')),
+    cfg.StrOpt('task_metrics_prefix', default='midonet.tasks',
+               help=_('Prefix of the names of the metrics sent by '
+                      'StatsdTaskMetricsSink.')),
+    cfg.IntOpt('api_async_workers', default=0,
+               help=_('Number of threads making the MidoNet API calls of '
+                      'MidonetApiClient after the API requests return, in '
+                      'order for each resource.  0 makes the calls in the '
+                      'API requests.')),
+    cfg.IntOpt('api_async_queue_size', default=1000,
+               help=_('Number of pending asynchronous MidoNet API calls '
+                      'above which the API requests wait.')),
+    cfg.IntOpt('readonly_cache_ttl', default=2,
+               help=_('Number of seconds the read-only mode of the data is '
+                      'cached for by the API workers, which refresh it in '
+                      'the background.  0 reads it on every write.')),
+    cfg.IntOpt('default_security_group_cache_ttl', default=30,
+               help=_('Number of seconds the ID of the default security '
+                      'group of a tenant is cached for by each API worker.  '
+                      '0 looks it up on every create.')),
 ]
 
 cfg.CONF.register_opts(mido_opts, "MIDONET")
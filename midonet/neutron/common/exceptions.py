@@ -30,3 +30,11 @@ class InvalidMidonetDataState(exc.NeutronException):
     i.e. missing some table that should always be present
     """
     pass
+
+
+class MidonetDataSyncError(exc.NeutronException):
+    message = _("Cannot sync the MidoNet data: %(reason)s")
+
+
+class MidonetDataReadOnly(exc.ServiceUnavailable):
+    message = _("The MidoNet data is read-only")
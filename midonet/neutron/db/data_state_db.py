@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import time
+
 from midonet.neutron.common import exceptions as exc
 from neutron.db import model_base
 import sqlalchemy as sa
@@ -20,6 +22,9 @@ import sqlalchemy as sa
 
 DATA_STATE_TABLE = 'midonet_data_state'
 
+# Process-local copy of the readonly flag, checked on every API write
+_readonly_cache = {'readonly': False, 'expires_at': 0}
+
 
 class DataState(model_base.BASEV2):
     __tablename__ = DATA_STATE_TABLE
@@ -42,9 +47,28 @@ def get_data_state(session):
         raise exc.InvalidMidonetDataState(issue)
 
 
+def refresh_readonly(session, ttl):
+    """Reads the readonly flag into the cache for 'ttl' seconds.
+
+    A missing data state means that the data is writable.
+    """
+    readonly = session.query(DataState.readonly).scalar()
+    _readonly_cache.update({'readonly': bool(readonly),
+                            'expires_at': time.time() + ttl})
+    return _readonly_cache['readonly']
+
+
+def is_readonly(session, ttl=0):
+    """Returns whether the data is read-only, as cached for 'ttl' seconds."""
+    if ttl > 0 and time.time() < _readonly_cache['expires_at']:
+        return _readonly_cache['readonly']
+    return refresh_readonly(session, ttl)
+
+
 def set_data_state_readonly(session, val):
     session.query(DataState).update({'readonly': val})
     session.commit()
+    _readonly_cache['expires_at'] = 0
 
 
 def set_readonly(session):
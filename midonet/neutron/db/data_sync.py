@@ -0,0 +1,507 @@
+# Copyright (C) 2015 Midokura SARL.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Import of the Neutron data into MidoNet through the tasks table.
+
+See specs/kilo/data_sync.rst for the flow of a data version sync.
+"""
+
+import datetime
+import multiprocessing
+import uuid
+
+from midonet.neutron.common import exceptions as exc
+from midonet.neutron.db import agent_membership_db as am_db
+import midonet.neutron.db.data_state_db as ds_db
+import midonet.neutron.db.data_version_db as dv_db
+from midonet.neutron.db import port_binding_db as pb_db
+from midonet.neutron.db import task_db
+from midonet.neutron import plugin
+from neutron.db import l3_db
+from neutron.db import models_v2
+from neutron.db import securitygroups_db as sg_db
+from neutron import i18n
+from oslo_log import log as logging
+import sqlalchemy as sa
+from sqlalchemy import orm
+
+try:
+    from neutron_lbaas.db.loadbalancer import loadbalancer_db as lb_db
+except ImportError:
+    lb_db = None
+
+LOG = logging.getLogger(__name__)
+_LI = i18n._LI
+
+# The types of the resources which MidoNet only creates and deletes
+_NO_UPDATE_TYPES = (task_db.SECURITY_GROUP, task_db.SECURITY_GROUP_RULE,
+                    task_db.PORT_BINDING, task_db.AGENT_MEMBERSHIP)
+
+
+class _SyncPlugin(plugin.MidonetMixin):
+    """MidonetMixin used for its resource dict makers only.
+
+    Building the dicts with the plugin ensures that the imported resources
+    look like the ones written by the API, with all their extensions.
+    """
+
+    def __init__(self):
+        # Skip the RPC and client setup of the plugin
+        self.base_binding_dict = self._get_base_binding_dict()
+
+    def _extend_port_dict_binding(self, port_res, port_db):
+        # The inherited hook looks up the plugin loaded by the server
+        binding = port_db.portbinding
+        self._extend_port_dict_binding_host(port_res,
+                                            binding.host if binding else None)
+
+
+def _make_port_binding_dict(info):
+    return {'id': info.port_id,
+            'host_id': info.binding.host,
+            'interface_name': info.interface_name,
+            'port_id': info.port_id}
+
+
+def _get_resource_types(rules=False):
+    """Returns the types of the resources to import in dependency order.
+
+    Each type is a (data_type, model, key column, dict maker) tuple.  The
+    security groups are imported with their rules, as they are when created
+    through the API.
+
+    :param rules: also return the security group rules, which are compared
+        as resources of their own, as they are changed through the API.
+    """
+    p = _SyncPlugin()
+    types = [
+        (task_db.NETWORK, models_v2.Network, models_v2.Network.id,
+         p._make_network_dict),
+        (task_db.SUBNET, models_v2.Subnet, models_v2.Subnet.id,
+         p._make_subnet_dict),
+        (task_db.SECURITY_GROUP, sg_db.SecurityGroup, sg_db.SecurityGroup.id,
+         p._make_security_group_dict),
+    ]
+    if rules:
+        types.append((task_db.SECURITY_GROUP_RULE, sg_db.SecurityGroupRule,
+                      sg_db.SecurityGroupRule.id,
+                      p._make_security_group_rule_dict))
+    types += [
+        (task_db.ROUTER, l3_db.Router, l3_db.Router.id,
+         p._make_router_dict),
+        (task_db.PORT, models_v2.Port, models_v2.Port.id,
+         p._make_port_dict),
+        (task_db.FLOATING_IP, l3_db.FloatingIP, l3_db.FloatingIP.id,
+         p._make_floatingip_dict),
+        (task_db.PORT_BINDING, pb_db.PortBindingInfo,
+         pb_db.PortBindingInfo.port_id, _make_port_binding_dict),
+        (task_db.AGENT_MEMBERSHIP, am_db.AgentMembership,
+         am_db.AgentMembership.id, p._make_agent_membership_dict),
+    ]
+    if lb_db is not None:
+        lb = lb_db.LoadBalancerPluginDb()
+        types += [
+            (task_db.POOL, lb_db.Pool, lb_db.Pool.id, lb._make_pool_dict),
+            (task_db.HEALTH_MONITOR, lb_db.HealthMonitor,
+             lb_db.HealthMonitor.id, lb._make_health_monitor_dict),
+            (task_db.MEMBER, lb_db.Member, lb_db.Member.id,
+             lb._make_member_dict),
+            (task_db.VIP, lb_db.Vip, lb_db.Vip.id, lb._make_vip_dict),
+        ]
+    return types
+
+
+def iter_resource_pages(session, model, key, make_dict, batch_size,
+                        after=None):
+    """Yields the resources of a model a page at a time.
+
+    The pages are read by ranges of the key rather than with yield_per, as
+    the models eagerly load collections, which yield_per cannot do.  The
+    objects of each page are expunged once the page is consumed so that
+    memory stays bounded.
+
+    :param after: key of the resource to start after.
+    :returns: an iterator over lists of (resource_id, tenant_id, data).
+    """
+    while True:
+        query = session.query(model)
+        if after is not None:
+            query = query.filter(key > after)
+        objs = query.order_by(key).limit(batch_size).all()
+        if not objs:
+            return
+        after = getattr(objs[-1], key.key)
+        yield [(getattr(obj, key.key), getattr(obj, 'tenant_id', None),
+                make_dict(obj)) for obj in objs]
+        session.expunge_all()
+
+
+def _insert_version_task(session, type, version_id):
+    task_db.insert_tasks(session, [{
+        'type': type,
+        'data_type': None,
+        'resource_id': str(version_id),
+        'data': '{}',
+        'transaction_id': 'data-version-%s' % version_id}])
+
+
+def _check_readonly(session):
+    if not ds_db.get_data_state(session).readonly:
+        raise exc.MidonetDataSyncError(
+            reason=_("the data is not read-only"))
+
+
+def _truncate_tasks(session):
+    session.query(ds_db.DataState).update(
+        {'last_processed_task_id': None,
+         'updated_at': datetime.datetime.utcnow()})
+    session.query(task_db.Task).delete()
+    session.query(task_db.ResourceSnapshot).delete()
+
+
+def _start_data_version(session):
+    last = dv_db.get_last_version(session)
+    if last is not None and last.sync_tasks_status == dv_db.STARTED:
+        raise exc.MidonetDataSyncError(
+            reason=_("data version %s is being synced") % last.id)
+    lp_id = ds_db.get_data_state(session).last_processed_task_id
+    max_id = session.query(sa.func.max(task_db.Task.id)).scalar()
+    if max_id is not None and max_id != lp_id:
+        raise exc.MidonetDataSyncError(
+            reason=_("there are unprocessed tasks"))
+    _truncate_tasks(session)
+    version = dv_db.create_data_version(session)
+    version.sync_status = dv_db.STARTED
+    session.flush()
+    _insert_version_task(session, task_db.DATA_VERSION_SYNC, version.id)
+    return version
+
+
+def _get_resumable_version(session):
+    """Returns the data version to resume the sync of.
+
+    A sync can be resumed if it was interrupted without activating another
+    version, i.e. its process died, or it failed while no version was
+    active.
+    """
+    last = dv_db.get_last_version(session)
+    if last is None or last.sync_tasks_status == dv_db.COMPLETED:
+        raise exc.MidonetDataSyncError(reason=_("there is no sync to resume"))
+    last_task = session.query(task_db.Task).order_by(
+        task_db.Task.id.desc()).first()
+    if last_task is None or last_task.type == task_db.DATA_VERSION_ACTIVATE:
+        raise exc.MidonetDataSyncError(
+            reason=_("data version %s was rolled back") % last.id)
+    last.update({'sync_tasks_status': dv_db.STARTED,
+                 'sync_finished_at': None})
+    return last
+
+
+def sync_data_version(session, batch_size=1000, progress=None,
+                      resume=False):
+    """Imports all the Neutron resources as a new data version.
+
+    The tasks table is truncated and filled with a DATA_VERSION_SYNC task,
+    a CREATE task for each resource, and a DATA_VERSION_ACTIVATE task.  The
+    resources are inserted 'batch_size' at a time, each batch in its own
+    transaction, so 'session' is expected to be in autocommit mode.
+
+    Each batch records in the data version the type and key of the last
+    resource it imported, so that an interrupted sync can be resumed from
+    there with 'resume'.
+
+    If the import fails or is interrupted, the data version is marked as
+    ERROR or ABORTED and the active version is activated again.
+
+    :param progress: function called with the data type and the number of
+        resources after each batch.
+    :param resume: resume the last sync instead of starting a new one.
+    :returns: the data version.
+    """
+    with session.begin():
+        _check_readonly(session)
+        if resume:
+            version = _get_resumable_version(session)
+        else:
+            version = _start_data_version(session)
+        version_id = version.id
+        data_type, after = dv_db.get_sync_checkpoint(version)
+
+    try:
+        transaction_id = 'data-version-%s' % version_id
+        types = _get_resource_types()
+        if data_type is not None:
+            # Skip the types already imported
+            types = types[[t[0] for t in types].index(data_type):]
+        for data_type, model, key, make_dict in types:
+            for page in iter_resource_pages(session, model, key, make_dict,
+                                            batch_size, after=after):
+                with session.begin():
+                    task_db.insert_resource_tasks(session, task_db.CREATE,
+                                                  data_type, page,
+                                                  transaction_id)
+                    dv_db.set_sync_checkpoint(session, version_id, data_type,
+                                              page[-1][0])
+                if progress:
+                    progress(data_type, len(page))
+            after = None
+    except BaseException as e:
+        status = (dv_db.ABORTED if isinstance(e, KeyboardInterrupt)
+                  else dv_db.ERROR)
+        with session.begin():
+            dv_db.update_version_status(session, version_id, status)
+            active_id = ds_db.get_data_state(session).active_version
+            if active_id is not None:
+                _insert_version_task(session, task_db.DATA_VERSION_ACTIVATE,
+                                     active_id)
+        raise
+
+    with session.begin():
+        _insert_version_task(session, task_db.DATA_VERSION_ACTIVATE,
+                             version_id)
+        dv_db.update_version_status(session, version_id, dv_db.COMPLETED)
+    return version_id
+
+
+def activate_data_version(session, version_id):
+    """Activates a data version synced in the current read-only session."""
+    with session.begin():
+        _check_readonly(session)
+        version = dv_db.get_version(session, version_id)
+        if version is None or version.stale:
+            raise exc.MidonetDataSyncError(
+                reason=_("data version %s cannot be activated") % version_id)
+        if version.sync_tasks_status != dv_db.COMPLETED:
+            raise exc.MidonetDataSyncError(
+                reason=_("data version %s was not fully synced") % version_id)
+        version.update({'sync_status': dv_db.STARTED,
+                        'sync_tasks_status': dv_db.STARTED})
+        _insert_version_task(session, task_db.DATA_VERSION_ACTIVATE,
+                             version_id)
+        version.update({'sync_tasks_status': dv_db.COMPLETED})
+
+
+def _get_snapshot_hashes(session, data_type, after, last):
+    """Returns the snapshots of a type in the key range (after, last].
+
+    The hashes of the snapshots written by the API, which has no hash, are
+    computed from their data.
+
+    :param last: upper bound of the range, None for no bound.
+    :returns: a dict of resource_id to (tenant_id, data_hash).
+    """
+    snapshot = task_db.ResourceSnapshot
+    query = session.query(snapshot.resource_id, snapshot.tenant_id,
+                          snapshot.data_hash, snapshot.data,
+                          snapshot.codec).filter(
+        snapshot.data_type == data_type)
+    if after is not None:
+        query = query.filter(snapshot.resource_id > after)
+    if last is not None:
+        query = query.filter(snapshot.resource_id <= last)
+    hashes = {}
+    for r in query:
+        data_hash = r.data_hash
+        if data_hash is None:
+            data_hash = task_db.hash_resource(
+                task_db.load_task_data(r.data, r.codec), data_type)
+        hashes[r.resource_id] = (r.tenant_id, data_hash)
+    return hashes
+
+
+def diff_resource_type(session, data_type, model, key, make_dict,
+                       batch_size):
+    """Compares the resources of a type with their snapshots.
+
+    The resources and the snapshots are walked together a key range at a
+    time, so that neither side is loaded at once.
+
+    :returns: the (creates, updates, deletes) lists of (resource_id,
+        tenant_id, data) for the resources which differ from their
+        snapshots.  The data of the deleted resources is None.
+    """
+    creates, updates, deletes = [], [], []
+    after = None
+    for page in iter_resource_pages(session, model, key, make_dict,
+                                    batch_size):
+        last = page[-1][0]
+        hashes = _get_snapshot_hashes(session, data_type, after, last)
+        for resource_id, tenant_id, data in page:
+            snapshot = hashes.pop(resource_id, None)
+            if snapshot is None:
+                creates.append((resource_id, tenant_id, data))
+            elif snapshot[1] != task_db.hash_resource(data, data_type):
+                updates.append((resource_id, tenant_id, data))
+        deletes += [(r, t, None) for r, (t, _h) in hashes.items()]
+        after = last
+    hashes = _get_snapshot_hashes(session, data_type, after, None)
+    deletes += [(r, t, None) for r, (t, _h) in hashes.items()]
+    return creates, updates, deletes
+
+
+def _diff_resource_type(args):
+    # Entry point of the pool workers, which cannot share the connections
+    # of the parent process
+    url, index, batch_size = args
+    engine = sa.create_engine(url)
+    session = orm.Session(bind=engine)
+    try:
+        data_type, model, key, make_dict = _get_resource_types(
+            rules=True)[index]
+        return diff_resource_type(session, data_type, model, key, make_dict,
+                                  batch_size)
+    finally:
+        session.close()
+        engine.dispose()
+
+
+def _insert_resource_tasks(session, type, data_type, resources, batch_size,
+                           transaction_id):
+    for i in range(0, len(resources), batch_size):
+        with session.begin():
+            task_db.insert_resource_tasks(session, type, data_type,
+                                          resources[i:i + batch_size],
+                                          transaction_id)
+
+
+def _write_resource_snapshots(session, data_type, resources, batch_size):
+    for i in range(0, len(resources), batch_size):
+        with session.begin():
+            task_db.write_resource_snapshots(session, data_type,
+                                             resources[i:i + batch_size])
+
+
+def _get_orphan_rules(session, deletes, batch_size):
+    """Returns the IDs of the deleted rules whose group is deleted too.
+
+    The rules of a security group are deleted along with it, without a task
+    of their own.
+    """
+    orphans = set()
+    for i in range(0, len(deletes), batch_size):
+        group_ids = dict(
+            (s.resource_id,
+             task_db.load_task_data(s.data, s.codec)['security_group_id'])
+            for s in task_db.get_resource_snapshots(
+                session, data_types=[task_db.SECURITY_GROUP_RULE],
+                resource_ids=[r[0] for r in deletes[i:i + batch_size]]))
+        if not group_ids:
+            continue
+        groups = set(r[0] for r in session.query(
+            sg_db.SecurityGroup.id).filter(
+            sg_db.SecurityGroup.id.in_(set(group_ids.values()))))
+        orphans.update(r for r, g in group_ids.items() if g not in groups)
+    return orphans
+
+
+def _filter_rule_diff(session, diffs, batch_size):
+    """Leaves out the changes of the rules made along with their group.
+
+    :param diffs: dict of data type to its (creates, updates, deletes).
+    :returns: the (resource_id, tenant_id, None) tuples of the rules deleted
+        along with their group, whose snapshots are to be deleted without a
+        task.
+    """
+    sg_creates = diffs[task_db.SECURITY_GROUP][0]
+    creates, updates, deletes = diffs[task_db.SECURITY_GROUP_RULE]
+    created = set(rule['id'] for _r, _t, data in sg_creates
+                  for rule in data.get('security_group_rules') or [])
+    orphans = _get_orphan_rules(session, deletes, batch_size)
+    diffs[task_db.SECURITY_GROUP_RULE] = (
+        [r for r in creates if r[0] not in created], updates,
+        [r for r in deletes if r[0] not in orphans])
+    return [r for r in deletes if r[0] in orphans]
+
+
+def sync_data_incremental(session, batch_size=1000, workers=1,
+                          progress=None):
+    """Imports the Neutron resources which changed since the last import.
+
+    Instead of truncating the tasks table, the hashes of the Neutron
+    resources are compared with the ones of the resource snapshots, and
+    only the tasks for the differences are written: CREATE and UPDATE
+    tasks in dependency order, then DELETE tasks in reverse order.  No
+    data version is created, as the tasks apply on top of the active one.
+
+    The security group rules are compared on their own, as their changes
+    through the API are.  The resources which MidoNet does not update only
+    get their snapshots updated, as do the rules deleted along with their
+    group.
+
+    The resource types are compared in parallel by 'workers' processes,
+    each with its own connection to the database.  The tasks are written
+    'batch_size' at a time, each batch in its own transaction, so
+    'session' is expected to be in autocommit mode.
+
+    :param progress: function called with the data type and the number of
+        resources created, updated and deleted once a type is compared.
+    :returns: the number of tasks written.
+    """
+    with session.begin():
+        _check_readonly(session)
+        last = dv_db.get_last_version(session)
+        if last is not None and last.sync_tasks_status == dv_db.STARTED:
+            raise exc.MidonetDataSyncError(
+                reason=_("data version %s is being synced") % last.id)
+
+    types = _get_resource_types(rules=True)
+    if workers > 1:
+        url = session.get_bind().url
+        pool = multiprocessing.Pool(workers)
+        try:
+            diffs = pool.map(_diff_resource_type,
+                             [(url, i, batch_size)
+                              for i in range(len(types))])
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        diffs = [diff_resource_type(session, data_type, model, key,
+                                    make_dict, batch_size)
+                 for data_type, model, key, make_dict in types]
+        session.expunge_all()
+    data_types = [t[0] for t in types]
+    diffs = dict(zip(data_types, diffs))
+
+    orphans = _filter_rule_diff(session, diffs, batch_size)
+    _write_resource_snapshots(session, task_db.SECURITY_GROUP_RULE, orphans,
+                              batch_size)
+    for data_type in _NO_UPDATE_TYPES:
+        creates, updates, deletes = diffs.get(data_type, ([], [], []))
+        if updates:
+            LOG.info(_LI("%(count)d %(type)s resources changed, which "
+                         "MidoNet does not update"),
+                     {'count': len(updates), 'type': data_type})
+            _write_resource_snapshots(session, data_type, updates,
+                                      batch_size)
+            diffs[data_type] = (creates, [], deletes)
+
+    transaction_id = str(uuid.uuid4())
+    count = 0
+    for data_type in data_types:
+        creates, updates, deletes = diffs[data_type]
+        _insert_resource_tasks(session, task_db.CREATE, data_type, creates,
+                               batch_size, transaction_id)
+        _insert_resource_tasks(session, task_db.UPDATE, data_type, updates,
+                               batch_size, transaction_id)
+        count += len(creates) + len(updates)
+        if progress:
+            progress(data_type, len(creates), len(updates), len(deletes))
+    for data_type in reversed(data_types):
+        deletes = diffs[data_type][2]
+        _insert_resource_tasks(session, task_db.DELETE, data_type, deletes,
+                               batch_size, transaction_id)
+        count += len(deletes)
+    return count
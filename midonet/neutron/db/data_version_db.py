@@ -15,6 +15,7 @@
 
 import datetime
 from neutron.db import model_base
+from oslo_serialization import jsonutils
 import sqlalchemy as sa
 
 
@@ -34,6 +35,29 @@ class DataVersion(model_base.BASEV2):
     sync_status = sa.Column(sa.String(length=50))
     sync_tasks_status = sa.Column(sa.String(length=50))
     stale = sa.Column(sa.Boolean())
+    sync_checkpoint = sa.Column(sa.Text())
+
+
+def get_version(session, version_id):
+    return session.query(DataVersion).filter(
+        DataVersion.id == version_id).first()
+
+
+def set_sync_checkpoint(session, version_id, data_type, key):
+    """Records that the resources of 'data_type' up to 'key', and those of
+    the types imported before it, have been imported.
+    """
+    checkpoint = jsonutils.dumps({'data_type': data_type, 'key': key})
+    session.query(DataVersion).filter(DataVersion.id == version_id).update(
+        {'sync_checkpoint': checkpoint})
+
+
+def get_sync_checkpoint(data_version):
+    """Returns the (data_type, key) of the checkpoint, or (None, None)."""
+    if not data_version.sync_checkpoint:
+        return None, None
+    checkpoint = jsonutils.loads(data_version.sync_checkpoint)
+    return checkpoint['data_type'], checkpoint['key']
 
 
 def get_last_version(session):
@@ -41,9 +65,21 @@ def get_last_version(session):
     return data_versions.order_by(DataVersion.id.desc()).first()
 
 
+def _get_status_update(status):
+    values = {'sync_tasks_status': status}
+    if status == COMPLETED:
+        values['sync_finished_at'] = datetime.datetime.utcnow()
+    return values
+
+
+def update_version_status(session, version_id, status):
+    """Sets the sync status of a version, and when it finished syncing."""
+    get_version(session, version_id).update(_get_status_update(status))
+
+
 def update_last_version_status(session, status):
     dv = get_last_version(session)
-    dv.update({'sync_tasks_status': status})
+    dv.update(_get_status_update(status))
 
 
 def complete_last_version(session):
@@ -84,3 +120,4 @@ def create_data_version(session):
                                sync_tasks_status=STARTED,
                                stale=False)
     session.add(data_version)
+    return data_version
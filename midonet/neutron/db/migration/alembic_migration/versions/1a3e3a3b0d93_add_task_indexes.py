@@ -0,0 +1,37 @@
+# Copyright 2015 Midokura SARL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""add task indexes
+
+Revision ID: 1a3e3a3b0d93
+Revises: 4105f6d52b82
+Create Date: 2015-05-20 08:31:02.117254
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1a3e3a3b0d93'
+down_revision = '4105f6d52b82'
+
+from alembic import op
+
+
+def upgrade():
+
+    op.create_index('ix_midonet_tasks_resource', 'midonet_tasks',
+                    ['data_type', 'resource_id', 'id'])
+    op.create_index('ix_midonet_tasks_transaction_id', 'midonet_tasks',
+                    ['transaction_id'])
+    op.create_index('ix_midonet_tasks_created_at', 'midonet_tasks',
+                    ['created_at'])
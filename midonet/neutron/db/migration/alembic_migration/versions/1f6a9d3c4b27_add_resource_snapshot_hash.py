@@ -0,0 +1,34 @@
+# Copyright 2015 Midokura SARL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""add resource snapshot hash
+
+Revision ID: 1f6a9d3c4b27
+Revises: 52f3e8c1a6d7
+Create Date: 2015-06-04 02:41:19.580132
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1f6a9d3c4b27'
+down_revision = '52f3e8c1a6d7'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.add_column('midonet_resource_snapshot',
+                  sa.Column('data_hash', sa.String(length=40)))
@@ -0,0 +1,47 @@
+# Copyright 2015 Midokura SARL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""add task archive
+
+Revision ID: 2b0e5e3c7f41
+Revises: 1a3e3a3b0d93
+Create Date: 2015-05-22 02:47:15.380112
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '2b0e5e3c7f41'
+down_revision = '1a3e3a3b0d93'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.create_table(
+        'midonet_tasks_archive',
+        sa.Column('id', sa.Integer(), primary_key=True, autoincrement=False),
+        sa.Column('type', sa.String(length=36)),
+        sa.Column('data_type', sa.String(length=36)),
+        sa.Column('data', sa.Text(length=2 ** 24)),
+        sa.Column('resource_id', sa.String(length=36)),
+        sa.Column('tenant_id', sa.String(length=255)),
+        sa.Column('transaction_id', sa.String(length=40), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('codec', sa.String(length=16)))
+
+    op.create_index('ix_midonet_tasks_archive_resource',
+                    'midonet_tasks_archive',
+                    ['data_type', 'resource_id', 'id'])
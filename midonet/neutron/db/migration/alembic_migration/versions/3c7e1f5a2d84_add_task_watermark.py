@@ -0,0 +1,40 @@
+# Copyright 2015 Midokura SARL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""add task watermark
+
+Revision ID: 3c7e1f5a2d84
+Revises: 2b0e5e3c7f41
+Create Date: 2015-05-25 06:12:40.731652
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3c7e1f5a2d84'
+down_revision = '2b0e5e3c7f41'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.create_table(
+        'midonet_task_watermark',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('task_id', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime()))
+
+    op.execute("INSERT INTO midonet_task_watermark (id, task_id) "
+               "SELECT 1, COALESCE(MAX(id), 0) FROM midonet_tasks")
@@ -0,0 +1,34 @@
+# Copyright 2015 Midokura SARL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""add task codec
+
+Revision ID: 4105f6d52b82
+Revises: 421564f630b1
+Create Date: 2015-05-18 10:12:43.521870
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4105f6d52b82'
+down_revision = '421564f630b1'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.add_column('midonet_tasks',
+                  sa.Column('codec', sa.String(length=16)))
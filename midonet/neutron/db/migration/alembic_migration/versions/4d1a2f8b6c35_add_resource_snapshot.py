@@ -0,0 +1,44 @@
+# Copyright 2015 Midokura SARL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""add resource snapshot
+
+The table is left empty.  Run 'midonet-db-manage task-resource-rebuild' to
+fill it from the existing tasks.
+
+Revision ID: 4d1a2f8b6c35
+Revises: 3c7e1f5a2d84
+Create Date: 2015-05-27 03:41:09.562018
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4d1a2f8b6c35'
+down_revision = '3c7e1f5a2d84'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.create_table(
+        'midonet_resource_snapshot',
+        sa.Column('data_type', sa.String(length=36), nullable=False),
+        sa.Column('resource_id', sa.String(length=36), nullable=False),
+        sa.Column('tenant_id', sa.String(length=255)),
+        sa.Column('data', sa.Text(length=2 ** 24)),
+        sa.Column('codec', sa.String(length=16)),
+        sa.Column('updated_at', sa.DateTime()),
+        sa.PrimaryKeyConstraint('data_type', 'resource_id'))
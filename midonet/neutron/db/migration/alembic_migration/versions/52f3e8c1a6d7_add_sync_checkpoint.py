@@ -0,0 +1,34 @@
+# Copyright 2015 Midokura SARL
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""add sync checkpoint
+
+Revision ID: 52f3e8c1a6d7
+Revises: 4d1a2f8b6c35
+Create Date: 2015-06-01 07:18:53.204617
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '52f3e8c1a6d7'
+down_revision = '4d1a2f8b6c35'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+
+    op.add_column('midonet_data_versions',
+                  sa.Column('sync_checkpoint', sa.Text()))
@@ -12,10 +12,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import itertools
+import multiprocessing
 import os
+import time
 
 from alembic import config as alembic_config
 import midonet.neutron.db.data_state_db as ds_db
+from midonet.neutron.db import data_sync
 import midonet.neutron.db.data_version_db as dv_db
 from midonet.neutron.db import task_db
 from neutron.db.migration import cli as n_cli
@@ -28,34 +33,69 @@ from sqlalchemy.orm import sessionmaker
 CONF = n_cli.CONF
 
 
-def get_session(config):
+def get_session(config, autocommit=False):
     connection = config.neutron_config.database.connection
     engine = create_engine(connection)
-    Session = sessionmaker(bind=engine)
+    Session = sessionmaker(bind=engine, autocommit=autocommit)
     return Session()
 
 
+def _task_json(task):
+    return jsonutils.dumps({'id': task.id,
+                            'type': task.type,
+                            'data_type': task.data_type,
+                            'resource_id': task.resource_id,
+                            'tenant_id': task.tenant_id,
+                            'transaction_id': task.transaction_id,
+                            'created_at': task.created_at,
+                            'data': task_db.load_task_data(task.data,
+                                                           task.codec)})
+
+
 def task_list(config, cmd):
     """
-    Lists all of the tasks in the task table. Optionally filters tasks
-    to show unprocessed tasks.
+    Lists the tasks in the task table in the order of their IDs. Optionally
+    filters tasks to show unprocessed tasks, the tasks after a given ID, or
+    the latest tasks, and keeps printing the new tasks as they are written
+    with --follow.  The tasks are streamed from the database, so the first
+    ones are printed right away whatever the size of the table.
 
     :param config: contains neutron configuration, like database connection.
     :param cmd: unused, but needed in the function signature by the command
         parser.
     """
-    session = get_session(config)
+    # Each query runs in its own transaction so that the new tasks are seen
+    # when following.
+    session = get_session(config, autocommit=True)
     printer = config.print_stdout
+    command = config.neutron_config.command
+    json_format = command.format == 'json'
     line = "%-7s%-11s%-20s%-40s%-20s"
-    printer(line, "id", "type", "data type", "resource id", "time")
-    printer(line, "--", "----", "---------", "-----------", "----")
+    if not json_format:
+        printer(line, "id", "type", "data type", "resource id", "time")
+        printer(line, "--", "----", "---------", "-----------", "----")
 
     def print_task(task):
-        printer(line, task.id, task.type, task.data_type, task.resource_id,
-                task.created_at)
-    show_unprocessed = config.neutron_config.command.u
-    tasks = task_db.get_task_list(session, show_unprocessed)
-    [print_task(task) for task in tasks]
+        if json_format:
+            printer(_task_json(task))
+        else:
+            printer(line, task.id, task.type, task.data_type,
+                    task.resource_id, task.created_at)
+
+    last_id = command.since_id
+    tasks = task_db.get_task_list(session, command.u, since_id=last_id,
+                                  limit=command.limit, tail=command.tail,
+                                  with_data=json_format)
+    while True:
+        for task in tasks:
+            print_task(task)
+            last_id = task.id
+        if not command.follow:
+            break
+        config.stdout.flush()
+        time.sleep(command.interval)
+        tasks = task_db.get_task_list(session, command.u, since_id=last_id,
+                                      with_data=json_format)
 
 
 def task_clean(config, cmd):
@@ -71,11 +111,142 @@ def task_clean(config, cmd):
     task_db.task_clean(session)
 
 
+def task_archive(config, cmd):
+    """
+    Moves the processed tasks to the tasks archive table.  The tasks are
+    moved in chunks, each in its own transaction, so the command can be
+    interrupted and run again to resume.
+
+    :param config: contains neutron configuration, like database connection.
+    :param cmd: unused, but needed in the function signature by the command
+        parser.
+    """
+    session = get_session(config, autocommit=True)
+    chunk_size = config.neutron_config.command.chunk_size
+    count = task_db.task_gc(session, 0, chunk_size, archive=True)
+    config.print_stdout("Archived %d tasks", count)
+
+
+def _export_line(row):
+    data_type, resource_id, tenant_id, data, codec = row
+    return jsonutils.dumps({'data_type': data_type,
+                            'resource_id': resource_id,
+                            'tenant_id': tenant_id,
+                            'data': task_db.load_task_data(data, codec)},
+                           sort_keys=True) + '\n'
+
+
+def _export_lines(rows):
+    """Returns the data type and the NDJSON lines of the snapshot rows."""
+    return rows[0][0], [_export_line(row) for row in rows]
+
+
+def _export_batches(snapshots, batch_size):
+    """Groups the snapshots in batches of rows of the same data type."""
+    rows = ((s.data_type, s.resource_id, s.tenant_id, s.data, s.codec)
+            for s in snapshots)
+    for _data_type, group in itertools.groupby(rows, key=lambda r: r[0]):
+        while True:
+            batch = list(itertools.islice(group, batch_size))
+            if not batch:
+                break
+            yield batch
+
+
+def _imap_bounded(pool, func, iterable, limit):
+    """Like pool.imap, but only reads 'limit' items of 'iterable' ahead.
+
+    pool.imap consumes its iterable as fast as it can, which would load all
+    the snapshots streamed from the database.
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= limit:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def _task_resource_export(config, snapshots):
+    command = config.neutron_config.command
+    batches = _export_batches(snapshots, command.batch_size)
+    pool = None
+    if command.workers > 1:
+        pool = multiprocessing.Pool(command.workers)
+        lines = _imap_bounded(pool, _export_lines, batches,
+                              2 * command.workers)
+    else:
+        lines = (_export_lines(batch) for batch in batches)
+
+    out = config.stdout if command.output_dir is None else None
+    last_type = None
+    try:
+        for data_type, batch in lines:
+            if command.output_dir is not None and data_type != last_type:
+                last_type = data_type
+                if out is not None:
+                    out.close()
+                out = open(os.path.join(command.output_dir,
+                                        data_type.lower() + '.ndjson'), 'w')
+            out.writelines(batch)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if command.output_dir is not None and out is not None:
+            out.close()
+
+
 def task_resource(config, cmd):
     """
     Lists all of the resources represented in the contents of the task table.
-    This will only show the most updated information, and it will not
-    consider resources that have been removed from the task table.
+    This will only show the most updated information, as kept in the
+    resource snapshot table.  With --format ndjson, a JSON object is written
+    per resource, optionally to a file per data type in --output-dir, and
+    the data is decoded and encoded by --workers processes.
+
+    :param config: contains neutron configuration, like database connection.
+    :param cmd: unused, but needed in the function signature by the command
+        parser.
+    """
+    session = get_session(config)
+    command = config.neutron_config.command
+    snapshots = task_db.get_resource_snapshots(
+        session, data_types=command.type, tenant_ids=command.tenant,
+        resource_ids=command.resource, batch_size=command.batch_size)
+    if command.format == 'ndjson':
+        _task_resource_export(config, snapshots)
+        return
+
+    printer = config.print_stdout
+    data_type = None
+    for snapshot in snapshots:
+        if snapshot.data_type != data_type:
+            data_type = snapshot.data_type
+            printer(data_type + "S: \n")
+        data = task_db.load_task_data(snapshot.data, snapshot.codec)
+        printer(jsonutils.dumps(data, indent=4, sort_keys=True))
+
+
+def task_resource_rebuild(config, cmd):
+    """
+    Rebuilds the resource snapshot table from the contents of the task table.
+
+    :param config: contains neutron configuration, like database connection.
+    :param cmd: unused, but needed in the function signature by the command
+        parser.
+    """
+    session = get_session(config, autocommit=True)
+    count = task_db.rebuild_resource_snapshots(session)
+    config.print_stdout("Rebuilt the snapshots of %d resources", count)
+
+
+def task_stats(config, cmd):
+    """
+    Shows the statistics of the task pipeline: the backlog of unprocessed
+    tasks, and the number and size per data type of the tasks inserted over
+    the --window, along with the number inserted and processed per minute.
 
     :param config: contains neutron configuration, like database connection.
     :param cmd: unused, but needed in the function signature by the command
@@ -83,12 +254,28 @@ def task_resource(config, cmd):
     """
     session = get_session(config)
     printer = config.print_stdout
-    data = task_db.get_current_task_data(session)
-    for data_type in data:
-        printer(data_type + "S: \n")
-        for res in data[data_type]:
-            data_json = jsonutils.loads(data[data_type][res])
-            printer(jsonutils.dumps(data_json, indent=4, sort_keys=True))
+    window = config.neutron_config.command.window
+    stats = task_db.get_task_stats(session, window=window)
+    line = "%-25s : %s"
+    printer(line, "max task id", stats['max_id'])
+    printer(line, "last processed task id", stats['last_processed_task_id'])
+    printer(line, "unprocessed tasks", stats['unprocessed'])
+    printer(line, "oldest unprocessed (s)",
+            "%.1f" % stats['oldest_unprocessed_age'])
+    printer(line, "tasks in window", stats['total'])
+    printer("")
+    line = "%-20s%-12s%-12s"
+    printer(line, "data type", "tasks", "bytes")
+    printer(line, "---------", "-----", "-----")
+    for data_type, count, size in stats['by_type']:
+        printer(line, data_type, count, size)
+    printer("")
+    line = "%-22s%-12s%-12s"
+    printer(line, "minute", "inserted", "processed")
+    printer(line, "------", "--------", "---------")
+    for start, inserted, processed in stats['buckets']:
+        printer(line, start.strftime("%Y-%m-%d %H:%M:%S"), inserted,
+                processed)
 
 
 def data_show(config, cmd):
@@ -153,22 +340,115 @@ def data_version_list(config, cmd):
 
 
 def data_version_sync(config, cmd):
-    pass
+    """
+    Imports all the Neutron resources into MidoNet as a new data version,
+    by truncating the task table and filling it with the tasks creating all
+    the resources.  The data must be read-only.  With --resume, an
+    interrupted sync is continued from its last checkpoint.  With
+    --incremental, only the tasks for the resources which differ from the
+    resource snapshots are written, on top of the active data version.
+
+    :param config: contains neutron configuration, like database connection.
+    :param cmd: unused, but needed in the function signature by the command
+        parser.
+    """
+    session = get_session(config, autocommit=True)
+    printer = config.print_stdout
+    counts = collections.OrderedDict()
+
+    def progress(data_type, count):
+        counts[data_type] = counts.get(data_type, 0) + count
+
+    command = config.neutron_config.command
+    if command.incremental:
+        _data_version_sync_incremental(session, printer, command)
+        return
+    version_id = data_sync.sync_data_version(
+        session, batch_size=command.batch_size, progress=progress,
+        resume=command.resume)
+    for data_type, count in counts.items():
+        printer("Imported %d %s tasks", count, data_type)
+    printer("Synced data version %s", version_id)
+
+
+def _data_version_sync_incremental(session, printer, command):
+
+    def progress(data_type, created, updated, deleted):
+        printer("%s: %d created, %d updated, %d deleted", data_type, created,
+                updated, deleted)
+
+    count = data_sync.sync_data_incremental(
+        session, batch_size=command.batch_size, workers=command.workers,
+        progress=progress)
+    printer("Imported %d tasks", count)
 
 
 def data_version_activate(config, cmd):
-    pass
+    """
+    Activates a data version synced in the current read-only session, e.g.
+    to roll back to it.
+
+    :param config: contains neutron configuration, like database connection.
+    :param cmd: unused, but needed in the function signature by the command
+        parser.
+    """
+    session = get_session(config, autocommit=True)
+    version_id = config.neutron_config.command.version_id
+    data_sync.activate_data_version(session, version_id)
+    config.print_stdout("Activated data version %s", version_id)
 
 
 def add_command_parsers(subparsers):
     n_cli.add_command_parsers(subparsers)
     parser = subparsers.add_parser('task-list')
-    parser.add_argument('-u', action='store_true')
+    parser.add_argument('-u', action='store_true',
+                        help='show the unprocessed tasks only')
+    parser.add_argument('--since-id', type=int,
+                        help='show the tasks after this ID only')
+    parser.add_argument('--limit', type=int,
+                        help='maximum number of tasks to show')
+    parser.add_argument('--tail', type=int,
+                        help='show this many of the latest tasks only')
+    parser.add_argument('--follow', action='store_true',
+                        help='keep showing the new tasks as they are written')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between the polls for new tasks')
+    parser.add_argument('--format', choices=['table', 'json'],
+                        default='table',
+                        help='print a table or a JSON object per line')
     parser.set_defaults(func=task_list)
     parser = subparsers.add_parser('task-clean')
     parser.set_defaults(func=task_clean)
+    parser = subparsers.add_parser('task-archive')
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.set_defaults(func=task_archive)
     parser = subparsers.add_parser('task-resource')
+    parser.add_argument('--type', action='append',
+                        help='show the resources of this data type only, '
+                             'e.g. PORT')
+    parser.add_argument('--tenant', action='append',
+                        help='show the resources of this tenant only')
+    parser.add_argument('--resource', action='append',
+                        help='show the resource of this ID only')
+    parser.add_argument('--format', choices=['pretty', 'ndjson'],
+                        default='pretty',
+                        help='print indented JSON or a JSON object per line')
+    parser.add_argument('--output-dir',
+                        help='with ndjson, write a file per data type in '
+                             'this directory instead of printing')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='with ndjson, number of processes decoding and '
+                             'encoding the data')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='number of resources fetched and handed to a '
+                             'worker at a time')
     parser.set_defaults(func=task_resource)
+    parser = subparsers.add_parser('task-resource-rebuild')
+    parser.set_defaults(func=task_resource_rebuild)
+    parser = subparsers.add_parser('task-stats')
+    parser.add_argument('--window', type=int, default=600,
+                        help='seconds over which the rates are shown')
+    parser.set_defaults(func=task_stats)
     parser = subparsers.add_parser('data-show')
     parser.set_defaults(func=data_show)
     parser = subparsers.add_parser('data-readonly')
@@ -178,8 +458,21 @@ def add_command_parsers(subparsers):
     parser = subparsers.add_parser('data-version-list')
     parser.set_defaults(func=data_version_list)
     parser = subparsers.add_parser('data-version-sync')
+    parser.add_argument('--batch-size', type=int, default=1000,
+                        help='number of resources read and written per '
+                             'transaction')
+    parser.add_argument('--resume', action='store_true',
+                        help='resume the interrupted sync from its last '
+                             'checkpoint')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only import the resources which changed since '
+                             'the last import')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of processes comparing the resources '
+                             'with --incremental')
     parser.set_defaults(func=data_version_sync)
     parser = subparsers.add_parser('data-version-activate')
+    parser.add_argument('version_id', type=int)
     parser.set_defaults(func=data_version_activate)
 
 
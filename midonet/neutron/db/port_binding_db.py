@@ -14,6 +14,7 @@
 
 from neutron.api.v2 import attributes
 from neutron.common import exceptions as n_exc
+from neutron.db import db_base_plugin_v2
 from neutron.db import model_base
 from neutron.db import portbindings_db
 from neutron.extensions import portbindings
@@ -44,6 +45,18 @@ class MidonetPortBindingMixin(object):
         else:
             port_res[portbindings.PROFILE] = None
 
+    def _extend_port_dict_mido_binding(self, port_res, port_db):
+        # The binding info is eagerly loaded along with the port binding,
+        # itself joined to the ports, so that listing ports issues no query
+        # per port
+        binding = port_db.portbinding
+        info = binding.port_binding_info if binding else None
+        self._extend_mido_portbinding(port_res,
+                                      info.interface_name if info else None)
+
+    db_base_plugin_v2.NeutronDbPluginV2.register_dict_extend_funcs(
+        attributes.PORTS, ['_extend_port_dict_mido_binding'])
+
     def _process_mido_portbindings_create_and_update(self, context, port_data,
                                                      port):
 
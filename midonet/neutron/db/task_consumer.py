@@ -0,0 +1,205 @@
+# Copyright (C) 2015 Midokura SARL.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Reference consumer of the tasks table.
+
+Stands in for the MidoNet cluster to exercise the task pipeline end to end:
+it tails the tasks in the order of their IDs, applies them to an in-memory
+model of the resources, advances the last processed task ID of the data
+state like the cluster does, and measures the latency from the creation of
+each task to its processing.
+
+    midonet-task-consumer --config-file /etc/neutron/neutron.conf
+"""
+
+import collections
+import datetime
+import errno
+import os
+import socket
+import sys
+import time
+
+import midonet.neutron.db.data_state_db as ds_db
+from midonet.neutron.db import task_db
+from neutron.common import config as n_config  # noqa
+from neutron.db import api as db_api
+from oslo_config import cfg
+
+
+consumer_opts = [
+    cfg.IntOpt('batch-size', default=1000,
+               help='Maximum number of tasks processed per transaction'),
+    cfg.FloatOpt('poll-interval', default=1.0,
+                 help='Seconds to wait for new tasks when drained'),
+    cfg.StrOpt('notification-socket',
+               help='Path of a UNIX datagram socket to bind and wait on for '
+                    'the notifications of UnixSocketTaskNotifier instead of '
+                    'sleeping between polls'),
+    cfg.FloatOpt('report-interval', default=10.0,
+                 help='Seconds between the reports of the consumer'),
+    cfg.BoolOpt('exit-when-drained', default=False,
+                help='Exit once all the tasks have been processed'),
+]
+
+
+def _percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0
+    index = int(round(percent / 100.0 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+class TaskConsumer(object):
+    """Applies the unprocessed tasks to an in-memory model.
+
+    The model is a dict of data types to dicts of resource IDs to the data of
+    the resources, only covering the tasks processed by this consumer.  The
+    control tasks, which carry the configuration and the data versions, are
+    kept apart from the model.
+    """
+
+    def __init__(self, session, batch_size=1000):
+        self.session = session
+        self.batch_size = batch_size
+        self.model = collections.defaultdict(dict)
+        self.config = None
+        self.synced_version = None
+        self.active_version = None
+        self.processed = 0
+        self.latencies = []
+
+    def _apply_control(self, task):
+        if task.type == task_db.FLUSH:
+            self.model.clear()
+        elif task.type == task_db.DATA_VERSION_SYNC:
+            self.synced_version = task.resource_id
+        elif task.type == task_db.DATA_VERSION_ACTIVATE:
+            self.active_version = task.resource_id
+            self.synced_version = None
+        elif task.data_type == task_db.CONFIG and task.data is not None:
+            self.config = task_db.load_task_data(task.data, task.codec)
+
+    def apply(self, task):
+        if (task.type in (task_db.FLUSH, task_db.DATA_VERSION_SYNC,
+                          task_db.DATA_VERSION_ACTIVATE) or
+                task.data_type in (None, task_db.CONFIG)):
+            self._apply_control(task)
+            return
+        resources = self.model[task.data_type]
+        if task.type == task_db.DELETE:
+            resources.pop(task.resource_id, None)
+        elif task.type == task_db.UPDATE_DELTA:
+            current = resources.get(task.resource_id)
+            if current is not None:
+                resources[task.resource_id] = task_db.apply_delta(
+                    current, task_db.load_task_data(task.data, task.codec))
+        elif task.data is not None:
+            resources[task.resource_id] = task_db.load_task_data(task.data,
+                                                                 task.codec)
+
+    def consume(self):
+        """Processes a batch of tasks.
+
+        :returns: the number of tasks processed.
+        """
+        with self.session.begin(subtransactions=True):
+            tasks = list(task_db.get_task_list(
+                self.session, show_unprocessed=True, limit=self.batch_size,
+                with_data=True))
+            if not tasks:
+                return 0
+            for task in tasks:
+                self.apply(task)
+            now = datetime.datetime.utcnow()
+            self.session.query(ds_db.DataState).update(
+                {'last_processed_task_id': tasks[-1].id, 'updated_at': now})
+        self.latencies.extend((now - task.created_at).total_seconds()
+                              for task in tasks)
+        self.processed += len(tasks)
+        return len(tasks)
+
+    def report(self):
+        """Returns the statistics since the previous report."""
+        latencies = sorted(self.latencies)
+        stats = {'processed': self.processed,
+                 'resources': sum(len(r) for r in self.model.values()),
+                 'latency_p50': _percentile(latencies, 50),
+                 'latency_p99': _percentile(latencies, 99)}
+        self.processed = 0
+        self.latencies = []
+        return stats
+
+
+def _wait(sock, timeout):
+    if sock is None:
+        time.sleep(timeout)
+        return
+    sock.settimeout(timeout)
+    try:
+        sock.recv(64)
+    except socket.timeout:
+        pass
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+
+
+def _run(conf, sock):
+    consumer = TaskConsumer(db_api.get_session(autocommit=True),
+                            conf.batch_size)
+    start = last_report = time.time()
+    while True:
+        count = consumer.consume()
+        now = time.time()
+        if now - last_report >= conf.report_interval or (
+                not count and conf.exit_when_drained):
+            stats = consumer.report()
+            rate = stats['processed'] / max(now - last_report, 0.001)
+            sys.stdout.write("%.1fs: processed %d tasks (%.1f/s), "
+                             "%d resources, latency p50 %.3fs p99 %.3fs\n" %
+                             (now - start, stats['processed'], rate,
+                              stats['resources'], stats['latency_p50'],
+                              stats['latency_p99']))
+            sys.stdout.flush()
+            last_report = now
+        if not count:
+            if conf.exit_when_drained:
+                break
+            _wait(sock, conf.poll_interval)
+
+
+def main():
+    cfg.CONF.register_cli_opts(consumer_opts)
+    cfg.CONF(project='neutron')
+    conf = cfg.CONF
+
+    sock = None
+    if conf.notification_socket:
+        # Left behind by a consumer which did not exit cleanly
+        _unlink(conf.notification_socket)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(conf.notification_socket)
+    try:
+        _run(conf, sock)
+    finally:
+        if sock is not None:
+            sock.close()
+            _unlink(conf.notification_socket)
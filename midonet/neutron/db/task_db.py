@@ -12,21 +12,35 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import base64
+import collections
 import datetime
+import hashlib
+import itertools
+import json
+from midonet.neutron.common import config  # noqa
 import midonet.neutron.db.data_state_db as ds_db
 from neutron.db import model_base
 from neutron import i18n
+from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_serialization import jsonutils
+from oslo_utils import importutils
 import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy import orm
 import uuid
+import zlib
 
 CONF_ID = '00000000-0000-0000-0000-000000000001'
 
 CREATE = "CREATE"
 DELETE = "DELETE"
 UPDATE = "UPDATE"
+UPDATE_DELTA = "UPDATE_DELTA"
 FLUSH = "FLUSH"
+DATA_VERSION_SYNC = "DATA_VERSION_SYNC"
+DATA_VERSION_ACTIVATE = "DATA_VERSION_ACTIVATE"
 
 NETWORK = "NETWORK"
 SUBNET = "SUBNET"
@@ -50,14 +64,19 @@ OP_FLUSH = 'FLUSH'
 
 TASK_STATE_TABLE = 'midonet_task_state'
 
+# Key of the per-session queue of tasks not yet written to the tasks table
+PENDING_TASKS_KEY = 'midonet_pending_tasks'
+
+# Key of the highest task ID written by the transaction of a session, to be
+# notified once it commits
+TASK_WATERMARK_KEY = 'midonet_task_watermark'
+
 LOG = logging.getLogger(__name__)
 _LI = i18n._LI
+_LW = i18n._LW
 
 
-class Task(model_base.BASEV2):
-    __tablename__ = 'midonet_tasks'
-
-    id = sa.Column(sa.Integer(), primary_key=True)
+class TaskMixin(object):
     type = sa.Column(sa.String(length=36))
     tenant_id = sa.Column(sa.String(255))
     data_type = sa.Column(sa.String(length=36))
@@ -65,63 +84,1061 @@ class Task(model_base.BASEV2):
     resource_id = sa.Column(sa.String(36))
     transaction_id = sa.Column(sa.String(40))
     created_at = sa.Column(sa.DateTime(), default=datetime.datetime.utcnow)
+    codec = sa.Column(sa.String(length=16))
 
 
-def get_current_task_data(session):
-    data = dict()
-    for task in session.query(Task):
-        if task.data_type not in data:
-            data[task.data_type] = dict()
-        if task.type == DELETE:
-            data[task.data_type].pop(task.resource_id, None)
-        else:
-            data[task.data_type][task.resource_id] = task.data
+class Task(TaskMixin, model_base.BASEV2):
+    __tablename__ = 'midonet_tasks'
+    __table_args__ = (
+        sa.Index('ix_midonet_tasks_resource', 'data_type', 'resource_id',
+                 'id'),
+        sa.Index('ix_midonet_tasks_transaction_id', 'transaction_id'),
+        sa.Index('ix_midonet_tasks_created_at', 'created_at'),
+        model_base.BASEV2.__table_args__
+    )
+
+    id = sa.Column(sa.Integer(), primary_key=True)
+
+
+class TaskArchive(TaskMixin, model_base.BASEV2):
+    """Processed tasks moved out of the tasks table."""
+    __tablename__ = 'midonet_tasks_archive'
+    __table_args__ = (
+        sa.Index('ix_midonet_tasks_archive_resource', 'data_type',
+                 'resource_id', 'id'),
+        model_base.BASEV2.__table_args__
+    )
+
+    id = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+
+
+class ResourceSnapshot(model_base.BASEV2):
+    """Latest data of each resource written to the tasks table."""
+    __tablename__ = 'midonet_resource_snapshot'
+
+    data_type = sa.Column(sa.String(length=36), primary_key=True)
+    resource_id = sa.Column(sa.String(36), primary_key=True)
+    tenant_id = sa.Column(sa.String(255))
+    data = sa.Column(sa.Text(length=2 ** 24))
+    codec = sa.Column(sa.String(length=16))
+    # Set by the imports only, the API leaves it to be computed from the data
+    data_hash = sa.Column(sa.String(length=40))
+    updated_at = sa.Column(sa.DateTime())
+
+
+class TaskWatermark(model_base.BASEV2):
+    """Single row holding the highest task ID notified as committed."""
+    __tablename__ = 'midonet_task_watermark'
+
+    id = sa.Column(sa.Integer(), primary_key=True)
+    task_id = sa.Column(sa.Integer(), nullable=False, default=0)
+    updated_at = sa.Column(sa.DateTime())
+
+
+def _compact_dumps(data):
+    return jsonutils.dumps(data, separators=(',', ':'))
+
+
+# Encoder reused across calls, skipping the check for circular references
+# that the resource dicts never have.  Objects that are not JSON native types
+# still fall back on to_primitive.
+_fast_encoder = json.JSONEncoder(separators=(',', ':'), check_circular=False,
+                                 default=jsonutils.to_primitive)
+
+
+def _fast_dumps(data):
+    return _fast_encoder.encode(data)
+
+
+# Serializers of the task data, as (dumps, loads, binary) tuples.  The JSON
+# serializers all produce data that is readable as plain JSON.  The name of
+# a binary serializer is stored as the first codec of the tasks.
+_SERIALIZERS = {
+    'json': (jsonutils.dumps, jsonutils.loads, False),
+    'compact': (_compact_dumps, jsonutils.loads, False),
+    'fast': (_fast_dumps, jsonutils.loads, False),
+}
+
+try:
+    from oslo_serialization import msgpackutils
+    _SERIALIZERS['msgpack'] = (msgpackutils.dumps, msgpackutils.loads, True)
+except ImportError:
+    pass
+
+# Codecs that can be applied to the serialized task data, as (encoder,
+# decoder) tuples of functions from bytes to bytes.  The names of the codecs
+# are stored in the 'codec' column of each task joined with '+', in the order
+# they are applied when encoding, and the encoded data is stored as base64.
+# NULL means that the data is stored as plain JSON.
+_CODECS = {
+    'zlib': (zlib.compress, zlib.decompress),
+}
+
+
+def register_serializer(name, dumps, loads, binary=False):
+    """Register a serializer of the task data.
+
+    :param name: name of the serializer, as set in 'task_serializer'.
+    :param dumps: function serializing the data to text, or bytes if
+        'binary' is set.
+    :param loads: function reversing dumps.
+    :param binary: whether the serializer produces data other than JSON.
+    """
+    _SERIALIZERS[name] = (dumps, loads, binary)
+
+
+def register_codec(name, encoder, decoder):
+    """Register a codec to encode the task data with.
+
+    :param name: name of the codec, stored in the 'codec' column.
+    :param encoder: function taking the serialized data as bytes and
+        returning the encoded bytes.
+    :param decoder: function reversing the encoder.
+    """
+    _CODECS[name] = (encoder, decoder)
+
+
+def get_serializer(name):
+    try:
+        return _SERIALIZERS[name]
+    except KeyError:
+        raise ValueError(_("Unknown task serializer: %s") % name)
+
+
+def get_codec(name):
+    try:
+        return _CODECS[name]
+    except KeyError:
+        raise ValueError(_("Unknown task codec: %s") % name)
+
+
+def _get_codecs(codec):
+    names = codec.split('+')
+    if names[0] in _SERIALIZERS:
+        names = names[1:]
+    return [get_codec(name) for name in names]
+
+
+def check_task_config():
+    """Checks that the configured serializer and codecs are known.
+
+    :raises ValueError: if 'task_serializer' or any of the codecs of
+        'task_codec' is not registered.
+    """
+    conf = cfg.CONF.MIDONET
+    get_serializer(conf.task_serializer)
+    if conf.task_codec:
+        for name in conf.task_codec.split('+'):
+            get_codec(name)
+
+
+def serialize_task_data(data, serializer=None):
+    """Serializes the task data.
+
+    :returns: the serialized data and the codec to record, which is the name
+        of the serializer if it is binary, None otherwise.
+    """
+    name = serializer or cfg.CONF.MIDONET.task_serializer
+    dumps, _loads, binary = get_serializer(name)
+    return dumps(data), name if binary else None
+
+
+def encode_task_data(data, codec=None):
+    """Applies the codecs to the serialized data.
+
+    :param codec: codecs to apply, the first of which can be the name of
+        the binary serializer that was used.
+    """
+    if data is None or not codec:
+        return data
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    for encoder, _decoder in _get_codecs(codec):
+        data = encoder(data)
+    return base64.b64encode(data).decode('ascii')
+
+
+def load_task_data(data, codec=None):
+    """Returns the data of a task, reversing its codecs and serializer."""
+    if data is None:
+        return None
+    if not codec:
+        return jsonutils.loads(data)
+    data = base64.b64decode(data)
+    for _encoder, decoder in reversed(_get_codecs(codec)):
+        data = decoder(data)
+    name = codec.split('+')[0]
+    if name in _SERIALIZERS:
+        return _SERIALIZERS[name][1](data)
+    return jsonutils.loads(data.decode('utf-8'))
+
+
+# Attributes of the resources whose lists have no meaningful order, and are
+# not read back in the order they were written
+_UNORDERED_ATTRIBUTES = frozenset(['allocation_pools', 'extra_dhcp_opts',
+                                   'fixed_ips', 'routes', 'security_groups',
+                                   'security_group_rules', 'subnets'])
+
+
+def _canonical_json(data):
+    return jsonutils.dumps(data, sort_keys=True, separators=(',', ':'))
+
+
+def _normalize_resource(data):
+    if isinstance(data, dict):
+        normalized = {}
+        for k, v in data.items():
+            if v is None:
+                continue
+            v = _normalize_resource(v)
+            if k in _UNORDERED_ATTRIBUTES and isinstance(v, list):
+                v = sorted(v, key=_canonical_json)
+            normalized[k] = v
+        return normalized
+    if isinstance(data, (list, tuple)):
+        return [_normalize_resource(v) for v in data]
     return data
 
 
-def get_task_list(session, show_unprocessed):
-    tasks = session.query(Task)
+# Attributes of the resources which are tracked as resources of their own
+_CHILD_ATTRIBUTES = {
+    SECURITY_GROUP: ('security_group_rules',),
+}
+
+
+def hash_resource(data, data_type=None):
+    """Returns the hash of the content of a resource dict.
+
+    The hash does not depend on the serializer, the order of the keys, the
+    attributes set to None, or the order of the lists which have none, so
+    that the resources can be compared across writers.  It is computed when
+    the resources are compared, rather than on each task written by the API.
+
+    :param data_type: type of the resource, whose child resources, such as
+        the rules of a security group, are left out of the hash.
+    """
+    children = _CHILD_ATTRIBUTES.get(data_type)
+    if children:
+        data = dict((k, v) for k, v in data.items() if k not in children)
+    data = _canonical_json(_normalize_resource(data))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def make_delta(old, new):
+    """Returns the delta to apply to the 'old' resource dict to get 'new'."""
+    return {'set': dict((k, v) for k, v in new.items()
+                        if k not in old or old[k] != v),
+            'unset': [k for k in old if k not in new]}
+
+
+def apply_delta(data, delta):
+    data = dict(data)
+    data.update(delta['set'])
+    for k in delta['unset']:
+        data.pop(k, None)
+    return data
+
+
+def _load_task_data(task):
+    return load_task_data(task.data, task.codec)
+
+
+def get_last_task_state(session, data_type, resource_id, limit):
+    """Rebuilds the state of a resource from its latest tasks.
+
+    Returns the resource dict along with the number of UPDATE_DELTA tasks
+    applied on top of the last task carrying the full data, or (None, 0) if
+    the resource is deleted or cannot be rebuilt from its 'limit' latest
+    tasks.
+    """
+    tasks = session.query(Task).filter(
+        Task.data_type == data_type, Task.resource_id == resource_id).order_by(
+        Task.id.desc()).limit(limit)
+    deltas = []
+    for task in tasks:
+        if task.type == UPDATE_DELTA:
+            deltas.append(_load_task_data(task))
+            continue
+        if task.type == DELETE or task.data is None:
+            break
+        data = _load_task_data(task)
+        for delta in reversed(deltas):
+            data = apply_delta(data, delta)
+        return data, len(deltas)
+    return None, 0
+
+
+def _get_latest_task_ids(session, after=None):
+    """Query of the (data_type, resource_id, id) of the latest task of each
+    resource, ordered by type and resource ID, after the given pair if any.
+
+    The tasks without a data type, such as the data version tasks whose
+    resource ID is the ID of the version, are not about a resource.
+    """
+    query = session.query(Task.data_type, Task.resource_id,
+                          sa.func.max(Task.id)).filter(
+        Task.data_type.isnot(None), Task.resource_id.isnot(None))
+    if after is not None:
+        query = query.filter(sa.or_(
+            Task.data_type > after[0],
+            sa.and_(Task.data_type == after[0],
+                    Task.resource_id > after[1])))
+    return query.group_by(Task.data_type, Task.resource_id).order_by(
+        Task.data_type, Task.resource_id)
+
+
+def _get_latest_task_pages(session, batch_size):
+    """Yields the latest tasks of the resources, a page at a time.
+
+    The IDs of the latest tasks are read with a GROUP BY over the resource
+    index, in pages of 'batch_size' resources ordered by type and ID, and the
+    resource tasks other than DELETE are then fetched by their IDs.  Each
+    page is fully fetched so that more queries can be run while iterating.
+    """
+    last = None
+    while True:
+        keys = _get_latest_task_ids(session, last).limit(batch_size).all()
+        if not keys:
+            return
+        last = keys[-1][:2]
+        tasks = dict((t.id, t) for t in session.query(Task).filter(
+            Task.id.in_([k[2] for k in keys]),
+            Task.type.in_([CREATE, UPDATE, UPDATE_DELTA])))
+        yield [tasks[k[2]] for k in keys if k[2] in tasks]
+
+
+def iter_current_task_data(session, batch_size=1000):
+    """Yields the latest data of the resources in the tasks table.
+
+    The data is computed in the database from the latest task of each
+    resource, so memory is bounded by 'batch_size' regardless of the length
+    of the history.  Only the resources whose latest task is an UPDATE_DELTA
+    need their previous tasks to be read.
+
+    :returns: an iterator over (data_type, resource_id, data) tuples, ordered
+        by data type and resource ID, of the resources not deleted.
+    """
+    for page in _get_latest_task_pages(session, batch_size):
+        for task in page:
+            if task.type == UPDATE_DELTA:
+                data, _count = get_last_task_state(session, task.data_type,
+                                                   task.resource_id, None)
+            else:
+                data = _load_task_data(task)
+            if data is not None:
+                yield task.data_type, task.resource_id, data
+
+
+def get_current_task_data(session, batch_size=1000):
+    """Returns the latest data of the resources grouped by type.
+
+    :returns: an iterator over (data_type, resources) pairs, where resources
+        is an iterator over the (resource_id, data) pairs of the type, to be
+        consumed before moving on to the next type.
+    """
+    rows = iter_current_task_data(session, batch_size)
+    for data_type, group in itertools.groupby(rows, key=lambda r: r[0]):
+        yield data_type, ((r[1], r[2]) for r in group)
+
+
+def get_resource_snapshots(session, data_types=None, tenant_ids=None,
+                           resource_ids=None, batch_size=1000):
+    """Returns an iterator over the resource snapshots by type and ID.
+
+    The data of the snapshots is returned as stored, to be read with
+    load_task_data.
+
+    :param data_types: only return the snapshots of these data types.
+    :param tenant_ids: only return the snapshots of these tenants.
+    :param resource_ids: only return the snapshots of these resources.
+    """
+    query = session.query(ResourceSnapshot)
+    if data_types:
+        query = query.filter(ResourceSnapshot.data_type.in_(data_types))
+    if tenant_ids:
+        query = query.filter(ResourceSnapshot.tenant_id.in_(tenant_ids))
+    if resource_ids:
+        query = query.filter(ResourceSnapshot.resource_id.in_(resource_ids))
+    query = query.order_by(ResourceSnapshot.data_type,
+                           ResourceSnapshot.resource_id)
+    return query.yield_per(batch_size).execution_options(stream_results=True)
+
+
+def rebuild_resource_snapshots(session):
+    """Rebuilds the resource snapshot table from the tasks table.
+
+    :returns: the number of resource snapshots written.
+    """
+    codec = cfg.CONF.MIDONET.task_codec or None
+    now = datetime.datetime.utcnow()
+    # The rules with tasks of their own, which supersede the ones embedded
+    # in the data of their group
+    rule_ids = set(r[0] for r in session.query(Task.resource_id).filter(
+        Task.data_type == SECURITY_GROUP_RULE).distinct())
+    rows = []
+    for data_type, resources in get_current_task_data(session):
+        for resource_id, data in resources:
+            row = {'data_type': data_type,
+                   'resource_id': resource_id,
+                   'tenant_id': data.get('tenant_id'),
+                   'data_hash': hash_resource(data, data_type),
+                   'updated_at': now}
+            row['data'], row['codec'] = serialize_task_data(data)
+            rows.append(row)
+            if data_type == SECURITY_GROUP:
+                rows += [_make_rule_snapshot(rule, now)
+                         for rule in data.get('security_group_rules') or []
+                         if rule['id'] not in rule_ids]
+    for row in rows:
+        _encode_row(row, codec)
+    with session.begin(subtransactions=True):
+        session.query(ResourceSnapshot).delete()
+        if rows:
+            session.execute(ResourceSnapshot.__table__.insert(), rows)
+    return len(rows)
+
+
+def get_task_watermark(session):
+    """Returns the highest task ID notified by WatermarkTaskNotifier."""
+    return session.query(TaskWatermark.task_id).scalar() or 0
+
+
+def get_task_list(session, show_unprocessed=False, since_id=None,
+                  limit=None, tail=None, with_data=False, batch_size=1000):
+    """Returns an iterator over the tasks in the order of their IDs.
+
+    The rows are fetched 'batch_size' at a time through a server-side cursor
+    where the database driver supports it, so that the first tasks are
+    available right away and memory stays bounded regardless of the size of
+    the table.
+
+    :param show_unprocessed: only return the tasks not processed yet.
+    :param since_id: only return the tasks with an ID greater than this.
+    :param limit: maximum number of tasks to return.
+    :param tail: only return this many of the latest tasks.
+    :param with_data: also load the data of the tasks.
+    """
     if show_unprocessed:
-        task_state = session.query(ds_db.DataState).one()
-        lp_id = task_state.last_processed_id
+        lp_id = ds_db.get_data_state(session).last_processed_task_id
         if lp_id is not None:
-            tasks = tasks.filter(Task.id > lp_id)
-    return tasks
+            since_id = lp_id if since_id is None else max(since_id, lp_id)
+    if tail:
+        # Find the ID the tail starts after by walking the primary key
+        tail_ids = session.query(Task.id).order_by(Task.id.desc())
+        if since_id is not None:
+            tail_ids = tail_ids.filter(Task.id > since_id)
+        first_id = tail_ids.offset(tail - 1).limit(1).scalar()
+        if first_id is not None:
+            since_id = first_id - 1
+
+    tasks = session.query(Task)
+    if not with_data:
+        tasks = tasks.options(orm.defer(Task.data))
+    if since_id is not None:
+        tasks = tasks.filter(Task.id > since_id)
+    tasks = tasks.order_by(Task.id)
+    if limit:
+        tasks = tasks.limit(limit)
+    return tasks.yield_per(batch_size).execution_options(stream_results=True)
+
+
+def get_task_lag(session):
+    """Returns how far behind the processing of the tasks is.
+
+    Only looks up the primary key of the tasks table, so that it is cheap
+    enough to be called periodically.
+
+    :returns: a dict with the max and last processed task IDs, the number
+        of unprocessed tasks and the age in seconds of the oldest one.
+    """
+    lp_id = ds_db.get_data_state(session).last_processed_task_id
+    max_id = session.query(sa.func.max(Task.id)).scalar()
+    unprocessed = session.query(Task.id)
+    oldest = session.query(Task.created_at).order_by(Task.id)
+    if lp_id is not None:
+        unprocessed = unprocessed.filter(Task.id > lp_id)
+        oldest = oldest.filter(Task.id > lp_id)
+    oldest = oldest.limit(1).scalar()
+    age = 0
+    if oldest is not None:
+        age = (datetime.datetime.utcnow() - oldest).total_seconds()
+    return {'max_id': max_id,
+            'last_processed_task_id': lp_id,
+            'unprocessed': unprocessed.count(),
+            'oldest_unprocessed_age': age}
+
+
+def get_task_stats(session, window=600, bucket=60):
+    """Returns the statistics of the task pipeline.
+
+    All the figures are computed with aggregate queries.  The tasks inserted
+    within the last 'window' seconds are counted per data type and per
+    'bucket' seconds, along with how many of them have been processed.  Only
+    the tasks of the window are aggregated, through the index on created_at,
+    so that the cost does not grow with the size of the table.
+
+    :returns: a dict with the unprocessed task count, the max and last
+        processed task IDs, the age in seconds of the oldest unprocessed
+        task, the count of the tasks of the window, their (tasks, bytes) per
+        data type and the (start, inserted, processed) counts of the
+        buckets, oldest first.
+    """
+    stats = get_task_lag(session)
+    lp_id = stats['last_processed_task_id']
+    now = datetime.datetime.utcnow()
+    starts = [now - datetime.timedelta(seconds=window - i)
+              for i in range(0, window, bucket)]
+    in_window = sa.and_(Task.created_at >= starts[0], Task.created_at < now)
+
+    by_type = session.query(
+        Task.data_type, sa.func.count(Task.id),
+        sa.func.coalesce(sa.func.sum(sa.func.length(Task.data)), 0)).filter(
+        in_window).group_by(Task.data_type).order_by(Task.data_type).all()
+
+    processed = Task.id <= lp_id if lp_id is not None else sa.false()
+    index = _get_bucket_index(session, Task.created_at, starts[0],
+                              bucket).label('bucket_index')
+    counts = session.query(
+        index, sa.func.count(Task.id),
+        sa.func.sum(sa.case([(processed, 1)], else_=0))).filter(
+        in_window).group_by(sa.literal_column('bucket_index')).all()
+    counts = dict((int(i), (c, int(p or 0))) for i, c, p in counts)
+
+    stats['by_type'] = [(t, c, int(b)) for t, c, b in by_type]
+    stats['total'] = sum(c for _t, c, _b in stats['by_type'])
+    stats['buckets'] = [(start,) + counts.get(i, (0, 0))
+                        for i, start in enumerate(starts)]
+    return stats
+
+
+def _get_bucket_index(session, column, start, bucket):
+    """Returns the index of the 'bucket' seconds long bucket of a time.
+
+    The buckets are counted from 'start', so that the rows can be counted
+    per bucket with a GROUP BY instead of a column per bucket.
+    """
+    dialect = session.get_bind().dialect.name
+    if dialect == 'mysql':
+        seconds = sa.func.timestampdiff(sa.literal_column('SECOND'), start,
+                                        column)
+    elif dialect == 'sqlite':
+        seconds = (sa.func.julianday(column) -
+                   sa.func.julianday(start)) * 86400
+        return sa.cast(seconds / bucket, sa.Integer)
+    else:
+        seconds = sa.extract('epoch', column - start)
+    return sa.func.floor(seconds / bucket)
 
 
 def task_clean(session):
     task_state = session.query(ds_db.DataState).one()
-    lp_id = task_state.last_processed_id
-    task_state.update({'last_processed_id': None,
+    lp_id = task_state.last_processed_task_id
+    task_state.update({'last_processed_task_id': None,
                        'updated_at': datetime.datetime.utcnow()})
     session.query(Task).filter(Task.id <= lp_id).delete()
     session.commit()
 
 
+def task_gc(session, retention, chunk_size, archive=False):
+    """Deletes the processed tasks older than the retention period.
+
+    The tasks are deleted in chunks of at most 'chunk_size' consecutive IDs,
+    each in its own transaction, so that the table is never locked for long.
+    The last processed task itself is kept as it is referenced by the data
+    state.  'session' is expected to be in autocommit mode.
+
+    As each chunk is committed on its own, an interrupted run can simply be
+    started again to resume from the remaining tasks.  Each chunk locks the
+    data state row, so that the runs of the workers of all the servers move
+    each task once, the later runs finding the chunk already gone.
+
+    :param retention: number of seconds processed tasks are kept for.
+    :param archive: if True, the tasks are moved to the archive table
+        instead of being deleted.
+    :returns: the number of tasks deleted.
+    """
+    lp_id = ds_db.get_data_state(session).last_processed_task_id
+    if lp_id is None:
+        return 0
+
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+        seconds=retention)
+    max_id = session.query(sa.func.max(Task.id)).filter(
+        Task.id < lp_id, Task.created_at < cutoff).scalar()
+    if max_id is None:
+        return 0
+
+    tasks = Task.__table__
+    deleted = 0
+    low_id = session.query(sa.func.min(Task.id)).scalar()
+    while low_id <= max_id:
+        high_id = min(low_id + chunk_size - 1, max_id)
+        in_range = sa.and_(tasks.c.id >= low_id, tasks.c.id <= high_id)
+        with session.begin(subtransactions=True):
+            session.query(ds_db.DataState).with_lockmode('update').first()
+            if archive:
+                session.execute(TaskArchive.__table__.insert().from_select(
+                    [c.name for c in tasks.c],
+                    sa.select(list(tasks.c)).where(in_range)))
+            deleted += session.execute(
+                tasks.delete().where(in_range)).rowcount
+        low_id = high_id + 1
+    return deleted
+
+
+class _PendingTasks(object):
+    """Tasks queued on a session and not yet written to the tasks table.
+
+    Tasks are kept in the order they were queued, and the latest task of each
+    (data_type, resource_id) is indexed so that a later task for the same
+    resource can be merged into it instead of producing another row:
+
+        CREATE + UPDATE -> CREATE
+        UPDATE + UPDATE -> UPDATE
+        CREATE + DELETE -> (nothing)
+        UPDATE + DELETE -> DELETE
+
+    Tasks are only merged when they were queued in the same transaction
+    scope, i.e. the same root transaction or SAVEPOINT, so that rolling back
+    a SAVEPOINT can simply drop the tasks queued within it.
+    """
+
+    def __init__(self):
+        self._seq = itertools.count()
+        self._queue = collections.OrderedDict()
+        self._latest = dict()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def add(self, scope, task):
+        key = (task['data_type'], task['resource_id'])
+        if task['type'] not in (CREATE, UPDATE, DELETE):
+            key = None
+
+        seq = self._latest.get(key) if key else None
+        prev = self._queue.get(seq) if seq is not None else None
+        if prev is not None and prev[0] is scope:
+            prev_task = prev[1]
+            if prev_task['type'] in (CREATE, UPDATE):
+                if task['type'] == UPDATE:
+                    # Keep the position of the first task so that the tasks
+                    # queued in between, which may depend on it, still come
+                    # after it.
+                    task['type'] = prev_task['type']
+                    task['id'] = prev_task['id']
+                    self._queue[seq] = (scope, task)
+                    return
+                del self._queue[seq]
+                del self._latest[key]
+                if task['type'] == DELETE and prev_task['type'] == CREATE:
+                    return
+
+        seq = next(self._seq)
+        self._queue[seq] = (scope, task)
+        if key:
+            self._latest[key] = seq
+
+    def discard(self, scope):
+        """Drop the tasks queued in the given transaction or its children."""
+        for seq, (task_scope, task) in list(self._queue.items()):
+            txn = task_scope
+            while txn is not None and txn is not scope:
+                txn = txn.parent
+            if txn is scope:
+                del self._queue[seq]
+        self._latest = dict((k, v) for k, v in self._latest.items()
+                            if v in self._queue)
+
+    def pop_all(self):
+        tasks = [task for _scope, task in self._queue.values()]
+        self._queue.clear()
+        self._latest.clear()
+        return tasks
+
+
+def _get_scope(session):
+    txn = session.transaction
+    while txn is not None and not txn.nested and txn.parent is not None:
+        txn = txn.parent
+    return txn
+
+
+def _queue_task(session, task):
+    pending = session.info.get(PENDING_TASKS_KEY)
+    if pending is None:
+        pending = session.info[PENDING_TASKS_KEY] = _PendingTasks()
+    pending.add(_get_scope(session), task)
+
+
+# Columns of the tasks table, as the queued tasks also carry the hash of
+# their data for the resource snapshots
+_TASK_COLUMNS = frozenset(c.name for c in Task.__table__.c)
+
+
+def insert_tasks(session, tasks, return_id=False):
+    """Insert the task rows with as few statements as possible.
+
+    Rows are inserted in the given order with one executemany per run of
+    rows with the same columns set, so that the auto-incremented IDs follow
+    the order of the list.
+
+    :param return_id: whether to return the highest ID of the tasks, in
+        which case the last task is inserted on its own to read its ID back,
+        as executemany does not return the IDs.
+    :returns: the highest ID of the tasks if 'return_id' is set.
+    """
+    rows = [dict((k, v) for k, v in task.items()
+                 if k in _TASK_COLUMNS and (k != 'id' or v is not None))
+            for task in tasks]
+    last = rows.pop() if return_id and rows else None
+    for _keys, run in itertools.groupby(rows, key=lambda r: sorted(r)):
+        session.execute(Task.__table__.insert(), list(run))
+    if last is None:
+        return None
+    result = session.execute(Task.__table__.insert(), last)
+    ids = [r['id'] for r in rows if 'id' in r]
+    return max(ids + [result.inserted_primary_key[0]])
+
+
+def _encode_deltas(session, tasks):
+    """Turns the UPDATE tasks into UPDATE_DELTA tasks where possible.
+
+    An UPDATE task only carries the keys changed since the previous task of
+    the resource, unless 'task_delta_snapshot_interval' - 1 deltas have
+    already been written since the last full data, in which case the full
+    data is written so that the resource can always be rebuilt from a
+    bounded number of tasks.
+    """
+    interval = cfg.CONF.MIDONET.task_delta_snapshot_interval
+    states = dict()
+    for task in tasks:
+        key = (task['data_type'], task['resource_id'])
+        if task['data'] is None:
+            states[key] = (None, 0)
+            continue
+        codec = task['codec']
+        data = get_serializer(codec or 'json')[1](task['data'])
+        if task['type'] == UPDATE:
+            if key in states:
+                prev, count = states[key]
+            else:
+                prev, count = get_last_task_state(session, task['data_type'],
+                                                  task['resource_id'],
+                                                  interval)
+            if prev is not None and count + 1 < interval:
+                task['type'] = UPDATE_DELTA
+                task['data'], task['codec'] = serialize_task_data(
+                    make_delta(prev, data), codec)
+                states[key] = (data, count + 1)
+                continue
+        states[key] = (data, 0)
+
+
+def _get_snapshots(tasks):
+    """Returns the latest data of each resource the tasks are about.
+
+    The snapshots are returned as (type, row) tuples, where type is CREATE
+    for the resources created by the tasks, UPDATE for the other resources
+    updated, and DELETE, with a None row, for the resources deleted.  The
+    resources both created and deleted by the tasks have no snapshot.  The
+    rules embedded in a security group created by the tasks get snapshots of
+    their own, as their later changes are written as rule tasks.
+    """
+    now = datetime.datetime.utcnow()
+    snapshots = dict()
+    for task in tasks:
+        if (task['type'] not in (CREATE, UPDATE, DELETE) or
+                task['resource_id'] is None):
+            continue
+        key = (task['data_type'], task['resource_id'])
+        prev_op = snapshots[key][0] if key in snapshots else None
+        if task['type'] == DELETE or task['data'] is None:
+            if prev_op == CREATE:
+                # Created and deleted by the same tasks
+                del snapshots[key]
+            else:
+                snapshots[key] = (DELETE, None)
+            continue
+        if prev_op == CREATE or (task['type'] == CREATE and
+                                 prev_op is None):
+            op = CREATE
+        else:
+            op = UPDATE
+        snapshots[key] = (op, {'data_type': task['data_type'],
+                               'resource_id': task['resource_id'],
+                               'tenant_id': task['tenant_id'],
+                               'data': task['data'],
+                               'codec': task['codec'],
+                               'data_hash': task.get('data_hash'),
+                               'updated_at': now})
+        if task['type'] == CREATE and task['data_type'] == SECURITY_GROUP:
+            # The rules created along with a group have no task of their own
+            for rule in _get_embedded_rules(task):
+                snapshots[(SECURITY_GROUP_RULE, rule['id'])] = (
+                    CREATE, _make_rule_snapshot(rule, now))
+    return snapshots
+
+
+def _get_embedded_rules(task):
+    codec = task['codec']
+    if codec:
+        data = get_serializer(codec)[1](task['data'])
+    else:
+        data = jsonutils.loads(task['data'])
+    return data.get('security_group_rules') or []
+
+
+def _make_rule_snapshot(rule, now):
+    row = {'data_type': SECURITY_GROUP_RULE,
+           'resource_id': rule['id'],
+           'tenant_id': rule.get('tenant_id'),
+           'data_hash': None,
+           'updated_at': now}
+    row['data'], row['codec'] = serialize_task_data(rule)
+    return row
+
+
+def _write_snapshots(session, snapshots):
+    """Writes the resource snapshots returned by _get_snapshots.
+
+    The rows of the resources created or updated are upserted, as the key
+    can already have a snapshot, e.g. the configuration written on each
+    start, or get one from another transaction meanwhile.  Only the rows of
+    the resources deleted are deleted: deleting keys that do not exist would
+    take gap locks on InnoDB, on which the concurrent inserts of nearby keys
+    deadlock.
+    """
+    table = ResourceSnapshot.__table__
+    rows = []
+    deletes = []
+    for key, (op, row) in sorted(snapshots.items()):
+        if op == DELETE:
+            deletes.append(key)
+        else:
+            rows.append(row)
+    for data_type, group in itertools.groupby(deletes, key=lambda k: k[0]):
+        session.execute(table.delete().where(sa.and_(
+            table.c.data_type == data_type,
+            table.c.resource_id.in_([k[1] for k in group]))))
+    if rows:
+        _upsert_snapshots(session, rows)
+
+
+# Columns of the snapshots set when a snapshot is upserted
+_SNAPSHOT_VALUE_COLUMNS = ('tenant_id', 'data', 'codec', 'data_hash',
+                           'updated_at')
+
+
+def _upsert_snapshots(session, rows):
+    table = ResourceSnapshot.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect in ('mysql', 'postgresql'):
+        columns = [c.name for c in table.c]
+        sql = 'INSERT INTO %s (%s) VALUES (%s) ' % (
+            table.name, ', '.join(columns),
+            ', '.join(':%s' % c for c in columns))
+        if dialect == 'mysql':
+            sql += 'ON DUPLICATE KEY UPDATE %s' % ', '.join(
+                '%s = VALUES(%s)' % (c, c) for c in _SNAPSHOT_VALUE_COLUMNS)
+        else:
+            sql += 'ON CONFLICT (data_type, resource_id) DO UPDATE SET %s' % (
+                ', '.join('%s = EXCLUDED.%s' % (c, c)
+                          for c in _SNAPSHOT_VALUE_COLUMNS))
+        session.execute(sa.text(sql), rows)
+        return
+
+    # Without an upsert statement, update the rows which have a snapshot
+    # and insert the others.  These dialects do not serve concurrent
+    # writers.
+    existing = set()
+    for data_type, group in itertools.groupby(
+            rows, key=lambda r: r['data_type']):
+        existing.update(session.query(
+            ResourceSnapshot.data_type, ResourceSnapshot.resource_id).filter(
+            ResourceSnapshot.data_type == data_type,
+            ResourceSnapshot.resource_id.in_(
+                [r['resource_id'] for r in group])))
+    inserts = []
+    for row in rows:
+        if (row['data_type'], row['resource_id']) in existing:
+            session.execute(table.update().where(sa.and_(
+                table.c.data_type == row['data_type'],
+                table.c.resource_id == row['resource_id'])).values(
+                dict((c, row[c]) for c in _SNAPSHOT_VALUE_COLUMNS)))
+        else:
+            inserts.append(row)
+    if inserts:
+        session.execute(table.insert(), inserts)
+
+
+def _encode_row(row, codec):
+    if row['data'] is None:
+        return
+    codecs = [c for c in (row['codec'], codec) if c]
+    row['codec'] = '+'.join(codecs) or None
+    row['data'] = encode_task_data(row['data'], row['codec'])
+
+
+def _make_resource_tasks(type, data_type, resources, transaction_id):
+    tasks = []
+    for resource_id, tenant_id, data in resources:
+        task = {'type': type,
+                'tenant_id': tenant_id,
+                'data_type': data_type,
+                'resource_id': resource_id,
+                'transaction_id': transaction_id,
+                'data': None,
+                'codec': None}
+        if data is not None:
+            task['data'], task['codec'] = serialize_task_data(data)
+            task['data_hash'] = hash_resource(data, data_type)
+        tasks.append(task)
+    return tasks
+
+
+def _encode_rows(tasks, snapshots):
+    codec = cfg.CONF.MIDONET.task_codec or None
+    snapshot_rows = (row for _op, row in snapshots.values())
+    for row in itertools.chain(tasks, snapshot_rows):
+        if row is not None:
+            _encode_row(row, codec)
+
+
+def insert_resource_tasks(session, type, data_type, resources,
+                          transaction_id):
+    """Writes the tasks of many resources straight to the tasks table.
+
+    Meant for bulk imports: the tasks bypass the queue of the session and
+    are inserted with a single executemany, along with the snapshots of the
+    resources.
+
+    :param resources: list of (resource_id, tenant_id, data) tuples.
+    """
+    tasks = _make_resource_tasks(type, data_type, resources, transaction_id)
+    snapshots = _get_snapshots(tasks)
+    _encode_rows(tasks, snapshots)
+    insert_tasks(session, tasks)
+    _write_snapshots(session, snapshots)
+
+
+def write_resource_snapshots(session, data_type, resources):
+    """Writes the snapshots of resources without writing their tasks.
+
+    Meant for the changes which have no task, such as the updates of the
+    resources which cannot be updated in MidoNet.
+
+    :param resources: list of (resource_id, tenant_id, data) tuples, the
+        snapshots of the resources whose data is None being deleted.
+    """
+    tasks = _make_resource_tasks(UPDATE, data_type, resources, None)
+    snapshots = _get_snapshots(tasks)
+    _encode_rows([], snapshots)
+    _write_snapshots(session, snapshots)
+
+
+def _write_pending_tasks(session):
+    pending = session.info.get(PENDING_TASKS_KEY)
+    if not pending:
+        return
+    tasks = pending.pop_all()
+    # Taken before the UPDATE tasks are turned into deltas
+    snapshots = _get_snapshots(tasks)
+    if cfg.CONF.MIDONET.task_update_delta:
+        _encode_deltas(session, tasks)
+    _encode_rows(tasks, snapshots)
+    notify = bool(cfg.CONF.MIDONET.task_notifier)
+    max_id = insert_tasks(session, tasks, return_id=notify)
+    _write_snapshots(session, snapshots)
+    if max_id is not None:
+        session.info[TASK_WATERMARK_KEY] = max(
+            session.info.get(TASK_WATERMARK_KEY, 0), max_id)
+
+
+_notifier = (None, None)
+
+
+def get_task_notifier():
+    """Returns the notifier set by 'task_notifier', or None if not set."""
+    global _notifier
+    name = cfg.CONF.MIDONET.task_notifier
+    if _notifier[0] != name:
+        _notifier = (name, importutils.import_object(name) if name else None)
+    return _notifier[1]
+
+
+# The pending tasks are written right before the transaction (or SAVEPOINT)
+# commits rather than on flush, as flush is skipped when no ORM object is
+# dirty and a transaction may consist of nothing but tasks.
+@event.listens_for(orm.Session, 'before_commit')
+def _before_commit(session):
+    _write_pending_tasks(session)
+
+
+# after_commit is also dispatched when a SAVEPOINT is released, in which case
+# the tasks are not visible to the consumers yet.
+@event.listens_for(orm.Session, 'after_commit')
+def _after_commit(session):
+    txn = session.transaction
+    if txn is not None and txn.parent is not None:
+        return
+    task_id = session.info.pop(TASK_WATERMARK_KEY, None)
+    if task_id is None:
+        return
+    notifier = get_task_notifier()
+    if notifier is None:
+        return
+    try:
+        notifier.notify(session, task_id)
+    except Exception:
+        LOG.warning(_LW("Failed to notify the tasks up to %d"), task_id,
+                    exc_info=True)
+
+
+@event.listens_for(orm.Session, 'after_soft_rollback')
+def _after_soft_rollback(session, previous_transaction):
+    if previous_transaction.parent is None:
+        session.info.pop(TASK_WATERMARK_KEY, None)
+    pending = session.info.get(PENDING_TASKS_KEY)
+    if not pending:
+        return
+    if previous_transaction.nested:
+        pending.discard(previous_transaction)
+    elif previous_transaction.parent is None:
+        pending.pop_all()
+
+
 def create_task(context, type, task_id=None, data_type=None,
                 resource_id=None, data=None):
 
+    codec = None
+    if data is not None:
+        data, codec = serialize_task_data(data)
     with context.session.begin(subtransactions=True):
-        db = Task(id=task_id,
-                  type=type,
-                  tenant_id=context.tenant,
-                  data_type=data_type,
-                  data=None if data is None else jsonutils.dumps(data),
-                  resource_id=resource_id,
-                  transaction_id=context.request_id)
-        context.session.add(db)
+        _queue_task(context.session,
+                    {'id': task_id,
+                     'type': type,
+                     'tenant_id': context.tenant,
+                     'data_type': data_type,
+                     'data': data,
+                     'codec': codec,
+                     'resource_id': resource_id,
+                     'transaction_id': context.request_id})
 
 
 def create_config_task(session, data):
     data['id'] = CONF_ID
+    serialized, codec = serialize_task_data(data)
     with session.begin(subtransactions=True):
-        db = Task(type=CREATE,
-                  tenant_id=None,
-                  data_type=CONFIG,
-                  data=jsonutils.dumps(data),
-                  resource_id=data['id'],
-                  transaction_id=str(uuid.uuid4()))
-        session.add(db)
+        _queue_task(session,
+                    {'id': None,
+                     'type': CREATE,
+                     'tenant_id': None,
+                     'data_type': CONFIG,
+                     'data': serialized,
+                     'codec': codec,
+                     'resource_id': data['id'],
+                     'transaction_id': str(uuid.uuid4())})
 
 
 def create_port_binding_task(context, port_id, interface_name, host):
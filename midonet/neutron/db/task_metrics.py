@@ -0,0 +1,123 @@
+# Copyright (C) 2015 Midokura SARL.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import abc
+import os
+import socket
+import time
+
+from midonet.neutron.db import task_db
+from neutron import i18n
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import importutils
+import six
+
+LOG = logging.getLogger(__name__)
+_LI = i18n._LI
+
+
+@six.add_metaclass(abc.ABCMeta)
+class TaskMetricsSinkBase(object):
+    """Task pipeline metrics sink base class.
+
+    A sink publishes the metrics of the task pipeline collected periodically
+    by TaskMetricsCollector.  The sink to use is set by the
+    'task_metrics_sink' option.
+    """
+
+    @abc.abstractmethod
+    def publish(self, metrics):
+        """Publish the metrics, a dict of metric names to numbers."""
+
+
+class LogTaskMetricsSink(TaskMetricsSinkBase):
+    """Logs the metrics in a single line."""
+
+    def publish(self, metrics):
+        LOG.info(_LI("Task pipeline: %s"),
+                 ' '.join('%s=%s' % (k, metrics[k]) for k in sorted(metrics)))
+
+
+class PrometheusFileTaskMetricsSink(TaskMetricsSinkBase):
+    """Writes the metrics to a file in the Prometheus text format.
+
+    The file is meant to be collected by the textfile collector of the node
+    exporter.  It is replaced atomically so that it is never read partially
+    written.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or cfg.CONF.MIDONET.task_metrics_file
+
+    def publish(self, metrics):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for name in sorted(metrics):
+                f.write('# TYPE midonet_tasks_%s gauge\n' % name)
+                f.write('midonet_tasks_%s %s\n' % (name, metrics[name]))
+        os.rename(tmp_path, self.path)
+
+
+class StatsdTaskMetricsSink(TaskMetricsSinkBase):
+    """Sends the metrics as statsd gauges over UDP."""
+
+    def __init__(self, host=None, port=None, prefix=None):
+        conf = cfg.CONF.MIDONET
+        self.address = (host or conf.task_metrics_statsd_host,
+                        port or conf.task_metrics_statsd_port)
+        self.prefix = prefix or conf.task_metrics_prefix
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def publish(self, metrics):
+        lines = ['%s.%s:%s|g' % (self.prefix, name, metrics[name])
+                 for name in sorted(metrics)]
+        self._sock.sendto('\n'.join(lines).encode('ascii'), self.address)
+
+
+class TaskMetricsCollector(object):
+    """Collects the metrics of the task pipeline and publishes them.
+
+    The metrics are the ones of task_db.get_task_lag, plus the rates per
+    second at which tasks were inserted and processed since the previous
+    collection.
+    """
+
+    def __init__(self, sink=None):
+        self.sink = sink or importutils.import_object(
+            cfg.CONF.MIDONET.task_metrics_sink)
+        self._last = None
+
+    def collect(self, session):
+        lag = task_db.get_task_lag(session)
+        now = time.time()
+        max_id = lag['max_id'] or 0
+        lp_id = lag['last_processed_task_id'] or 0
+        metrics = {'max_task_id': max_id,
+                   'last_processed_task_id': lp_id,
+                   'lag_tasks': lag['unprocessed'],
+                   'oldest_unprocessed_age_seconds': round(
+                       lag['oldest_unprocessed_age'], 3)}
+        if self._last is not None:
+            last_time, last_max_id, last_lp_id = self._last
+            elapsed = now - last_time
+            if elapsed > 0:
+                metrics['insert_rate'] = round(
+                    max(max_id - last_max_id, 0) / elapsed, 3)
+                metrics['process_rate'] = round(
+                    max(lp_id - last_lp_id, 0) / elapsed, 3)
+        self._last = (now, max_id, lp_id)
+        self.sink.publish(metrics)
+        return metrics
@@ -0,0 +1,82 @@
+# Copyright (C) 2015 Midokura SARL.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import abc
+import datetime
+import errno
+from midonet.neutron.db import task_db
+from oslo_config import cfg
+import six
+import socket
+
+
+@six.add_metaclass(abc.ABCMeta)
+class TaskNotifierBase(object):
+    """Task arrival notifier base class.
+
+    A notifier is told the highest task ID written by each transaction right
+    after the transaction commits, so that the consumers of the tasks table
+    can wait for a notification instead of polling the table.  The ID is only
+    a hint: the consumers should still read all the tasks following the last
+    one they processed.  The notifier to use is set by the 'task_notifier'
+    option.
+    """
+
+    @abc.abstractmethod
+    def notify(self, session, task_id):
+        """Notify that the tasks up to 'task_id' have been committed.
+
+        Called after the commit of the transaction of 'session', which
+        cannot be used to run queries any more.
+        """
+
+
+class UnixSocketTaskNotifier(TaskNotifierBase):
+    """Sends the task ID as a datagram to a UNIX socket.
+
+    The datagram is dropped if nothing is listening on the socket or its
+    buffer is full, as the next notification supersedes it anyway.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or cfg.CONF.MIDONET.task_notifier_socket
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.setblocking(False)
+
+    def notify(self, session, task_id):
+        try:
+            self._sock.sendto(str(task_id).encode('ascii'), self.path)
+        except socket.error as e:
+            if e.errno not in (errno.ENOENT, errno.ECONNREFUSED,
+                               errno.EAGAIN):
+                raise
+
+
+class WatermarkTaskNotifier(TaskNotifierBase):
+    """Raises the task ID stored in the task watermark table.
+
+    The row is updated in its own short transaction so that the transactions
+    writing tasks are not serialized on its lock.  The stored ID never goes
+    backwards even if the notifications of concurrent transactions are
+    received out of order.
+    """
+
+    def notify(self, session, task_id):
+        watermark = task_db.TaskWatermark.__table__
+        with session.get_bind().begin() as conn:
+            conn.execute(watermark.update().where(
+                watermark.c.task_id < task_id).values(
+                task_id=task_id, updated_at=datetime.datetime.utcnow()))
+
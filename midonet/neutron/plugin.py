@@ -13,8 +13,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import functools
+import time
+
 from midonet.neutron.common import config  # noqa
+from midonet.neutron.common import exceptions as mido_exc
 from midonet.neutron.db import agent_membership_db as am_db
+import midonet.neutron.db.data_state_db as ds_db
 from midonet.neutron.db import port_binding_db as pb_db
 from midonet.neutron import extensions
 from neutron.api import extensions as neutron_extensions
@@ -23,8 +28,10 @@ from neutron.common import constants as n_const
 from neutron.common import exceptions as n_exc
 from neutron.common import rpc as n_rpc
 from neutron.common import topics
+from neutron import context as n_context
 from neutron.db import agents_db
 from neutron.db import agentschedulers_db
+from neutron.db import api as db_api
 from neutron.db import db_base_plugin_v2
 from neutron.db import external_net_db
 from neutron.db import extradhcpopt_db
@@ -32,10 +39,12 @@ from neutron.db import extraroute_db
 from neutron.db import l3_gwmode_db
 from neutron.db import portbindings_db
 from neutron.db import securitygroups_db
+from neutron.extensions import external_net
 from neutron.extensions import extra_dhcp_opt as edo_ext
 from neutron.extensions import portbindings
 from neutron.extensions import securitygroup as ext_sg
 from neutron import i18n
+from neutron.openstack.common import loopingcall
 from oslo_config import cfg
 from oslo_log import log as logging
 from oslo_utils import excutils
@@ -46,6 +55,25 @@ LOG = logging.getLogger(__name__)
 _LE = i18n._LE
 
 
+def _check_writable(context):
+    if ds_db.is_readonly(context.session,
+                         cfg.CONF.MIDONET.readonly_cache_ttl):
+        raise mido_exc.MidonetDataReadOnly()
+
+
+def check_writable(f):
+    """Rejects the calls of a plugin method while the data is read-only.
+
+    The readonly flag is cached for MIDONET.readonly_cache_ttl seconds, so
+    that most writes do not read it from the DB.
+    """
+    @functools.wraps(f)
+    def wrapper(self, context, *args, **kwargs):
+        _check_writable(context)
+        return f(self, context, *args, **kwargs)
+    return wrapper
+
+
 class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
                    am_db.AgentMembershipDbMixin,
                    db_base_plugin_v2.NeutronDbPluginV2,
@@ -64,23 +92,48 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
     def __init__(self):
         super(MidonetMixin, self).__init__()
 
+        # Neutron looks the flag up under the private name of the class of
+        # the plugin loaded, which is a subclass of this one.
+        setattr(self, '_%s__native_bulk_support' % self.__class__.__name__,
+                True)
+
         neutron_extensions.append_api_extensions_path(extensions.__path__)
         self.setup_rpc()
 
         # Instantiate MidoNet client and initialize
         self._load_client()
+        self.client.set_postcommit_failure_handler(self._postcommit_failed)
         self.client.initialize()
 
-        self.base_binding_dict = {
+        self.base_binding_dict = self._get_base_binding_dict()
+        self._default_sg_ids = {}
+        self.network_scheduler = importutils.import_object(
+            cfg.CONF.network_scheduler_driver
+        )
+
+        ttl = cfg.CONF.MIDONET.readonly_cache_ttl
+        if ttl > 0:
+            # Refresh the cached readonly flag before it expires
+            self._readonly_refresh = loopingcall.FixedIntervalLoopingCall(
+                self._refresh_readonly)
+            self._readonly_refresh.start(interval=ttl / 2.0)
+
+    def _refresh_readonly(self):
+        try:
+            ds_db.refresh_readonly(db_api.get_session(),
+                                   cfg.CONF.MIDONET.readonly_cache_ttl)
+        except Exception:
+            # Keep the looping call running
+            LOG.exception(_LE("Failed to read the MidoNet data state"))
+
+    def _get_base_binding_dict(self):
+        return {
             portbindings.VIF_TYPE: portbindings.VIF_TYPE_MIDONET,
             portbindings.VNIC_TYPE: portbindings.VNIC_NORMAL,
             portbindings.VIF_DETAILS: {
                 # TODO(rkukura): Replace with new VIF security details
                 portbindings.CAP_PORT_FILTER:
                 'security-group' in self.supported_extension_aliases}}
-        self.network_scheduler = importutils.import_object(
-            cfg.CONF.network_scheduler_driver
-        )
 
     def _load_client(self):
         try:
@@ -92,6 +145,29 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
                 LOG.exception(_LE("Error loading midonet client '%(client)s'"),
                               {'client': self.client})
 
+    def _postcommit_failed(self, method, args, error):
+        """Rolls back the creation of a resource its postcommit failed for.
+
+        Called by the clients running the postcommit hooks asynchronously,
+        once the API request which created the resource has returned.
+        """
+        LOG.error(_LE("MidoNet %(method)s failed: args=%(args)r, "
+                      "error=%(err)r"),
+                  {'method': method, 'args': args, 'err': error})
+        context = n_context.get_admin_context()
+        if method == 'add_router_interface_postcommit':
+            self.remove_router_interface(context, *args)
+        elif method.startswith('create_'):
+            resource = method[len('create_'):-len('_postcommit')]
+            if resource.endswith('_bulk'):
+                resources = args[0]
+                resource = resource[:-len('_bulk')]
+            else:
+                resources = [args[0]]
+            delete = getattr(self, 'delete_%s' % resource)
+            for res in resources:
+                delete(context, res['id'])
+
     def setup_rpc(self):
         # RPC support
         self.topic = topics.PLUGIN
@@ -103,17 +179,45 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         # Consume from all consumers in a thread
         self.conn.consume_in_threads()
 
-    def create_network(self, context, network):
-        LOG.debug('MidonetMixin.create_network called: network=%r', network)
-
+    def _ensure_default_security_group(self, context, tenant_id):
+        # Cache the default security groups, which are looked up on every
+        # network, security group and port create.  Only the ones seen out
+        # of a transaction are cached, as a group created in a transaction
+        # would be gone if it rolls back.  The entries expire, as the group
+        # can be deleted through the other API workers.
+        cached = self._default_sg_ids.get(tenant_id)
+        if cached is not None and time.time() < cached[1]:
+            return cached[0]
+        sg_id = super(MidonetMixin, self)._ensure_default_security_group(
+            context, tenant_id)
+        ttl = cfg.CONF.MIDONET.default_security_group_cache_ttl
+        if ttl > 0 and context.session.transaction is None:
+            self._default_sg_ids[tenant_id] = (sg_id, time.time() + ttl)
+        else:
+            self._default_sg_ids.pop(tenant_id, None)
+        return sg_id
+
+    def _prepare_network(self, context, network):
         net_data = network['network']
         tenant_id = self._get_tenant_id_for_create(context, net_data)
         net_data['tenant_id'] = tenant_id
         self._ensure_default_security_group(context, tenant_id)
 
+    def _create_network_db(self, context, network):
+        net = super(MidonetMixin, self).create_network(context, network)
+        self._process_l3_create(context, net, network['network'])
+        # Set the defaults the extensions leave out, as the network is read
+        # back with them
+        net.setdefault(external_net.EXTERNAL, False)
+        return net
+
+    @check_writable
+    def create_network(self, context, network):
+        LOG.debug('MidonetMixin.create_network called: network=%r', network)
+
+        self._prepare_network(context, network)
         with context.session.begin(subtransactions=True):
-            net = super(MidonetMixin, self).create_network(context, network)
-            self._process_l3_create(context, net, net_data)
+            net = self._create_network_db(context, network)
             self.client.create_network_precommit(context, net)
 
         try:
@@ -127,6 +231,31 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         LOG.debug("MidonetMixin.create_network exiting: net=%r", net)
         return net
 
+    @check_writable
+    def create_network_bulk(self, context, networks):
+        LOG.debug('MidonetMixin.create_network_bulk called: networks=%r',
+                  networks)
+
+        for network in networks['networks']:
+            self._prepare_network(context, network)
+        with context.session.begin(subtransactions=True):
+            nets = [self._create_network_db(context, network)
+                    for network in networks['networks']]
+            self.client.create_network_bulk_precommit(context, nets)
+
+        try:
+            self.client.create_network_bulk_postcommit(nets)
+        except Exception as ex:
+            LOG.error(_LE("Failed to create bulk networks %(nets)s in "
+                          "Midonet: %(err)s"), {"nets": nets, "err": ex})
+            with excutils.save_and_reraise_exception():
+                for net in nets:
+                    self.delete_network(context, net['id'])
+
+        LOG.debug("MidonetMixin.create_network_bulk exiting: nets=%r", nets)
+        return nets
+
+    @check_writable
     def update_network(self, context, id, network):
         LOG.debug("MidonetMixin.update_network called: id=%(id)r, "
                   "network=%(network)r", {'id': id, 'network': network})
@@ -142,6 +271,7 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         LOG.debug("MidonetMixin.update_network exiting: net=%r", net)
         return net
 
+    @check_writable
     def delete_network(self, context, id):
         LOG.debug("MidonetMixin.delete_network called: id=%r", id)
 
@@ -154,11 +284,12 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
 
         LOG.debug("MidonetMixin.delete_network exiting: id=%r", id)
 
+    @check_writable
     def create_subnet(self, context, subnet):
         LOG.debug("MidonetMixin.create_subnet called: subnet=%r", subnet)
 
         with context.session.begin(subtransactions=True):
-            s = super(MidonetMixin, self).create_subnet(context, subnet)
+            s = self._create_subnet_db(context, subnet)
             self.client.create_subnet_precommit(context, s)
 
         try:
@@ -172,17 +303,45 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         LOG.debug("MidonetMixin.create_subnet exiting: subnet=%r", s)
         return s
 
+    def _create_subnet_db(self, context, subnet):
+        return super(MidonetMixin, self).create_subnet(context, subnet)
+
+    @check_writable
+    def create_subnet_bulk(self, context, subnets):
+        LOG.debug("MidonetMixin.create_subnet_bulk called: subnets=%r",
+                  subnets)
+
+        with context.session.begin(subtransactions=True):
+            ss = [self._create_subnet_db(context, subnet)
+                  for subnet in subnets['subnets']]
+            self.client.create_subnet_bulk_precommit(context, ss)
+
+        try:
+            self.client.create_subnet_bulk_postcommit(ss)
+        except Exception as ex:
+            LOG.error(_LE("Failed to create bulk subnets %(subnets)s in "
+                          "Midonet: %(err)s"), {"subnets": ss, "err": ex})
+            with excutils.save_and_reraise_exception():
+                for s in ss:
+                    self.delete_subnet(context, s['id'])
+
+        LOG.debug("MidonetMixin.create_subnet_bulk exiting: subnets=%r", ss)
+        return ss
+
+    @check_writable
     def delete_subnet(self, context, id):
         LOG.debug("MidonetMixin.delete_subnet called: id=%s", id)
 
         with context.session.begin(subtransactions=True):
+            network_id = self._get_subnet(context, id)['network_id']
             super(MidonetMixin, self).delete_subnet(context, id)
             self.client.delete_subnet_precommit(context, id)
 
-        self.client.delete_subnet_postcommit(id)
+        self.client.delete_subnet_postcommit(id, network_id=network_id)
 
         LOG.debug("MidonetMixin.delete_subnet exiting")
 
+    @check_writable
     def update_subnet(self, context, id, subnet):
         LOG.debug("MidonetMixin.update_subnet called: id=%s", id)
 
@@ -195,38 +354,44 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         LOG.debug("MidonetMixin.update_subnet exiting: subnet=%r", s)
         return s
 
-    def create_port(self, context, port):
-        LOG.debug("MidonetMixin.create_port called: port=%r", port)
-
+    def _create_port_db(self, context, port):
         port_data = port['port']
-        with context.session.begin(subtransactions=True):
-            # Create a Neutron port
-            new_port = super(MidonetMixin, self).create_port(context, port)
-            dhcp_opts = port['port'].get(edo_ext.EXTRADHCPOPTS, [])
 
-            # Make sure that the port created is valid
-            if "id" not in new_port:
-                raise n_exc.BadRequest(resource='port',
-                                       msg="Invalid port created")
+        # Create a Neutron port
+        new_port = super(MidonetMixin, self).create_port(context, port)
+        dhcp_opts = port['port'].get(edo_ext.EXTRADHCPOPTS, [])
 
-            # Update fields
-            port_data.update(new_port)
+        # Make sure that the port created is valid
+        if "id" not in new_port:
+            raise n_exc.BadRequest(resource='port',
+                                   msg="Invalid port created")
 
-            # Bind security groups to the port
-            self._ensure_default_security_group_on_port(context, port)
-            sg_ids = self._get_security_groups_on_port(context, port)
-            self._process_port_create_security_group(context, new_port, sg_ids)
+        # Update fields
+        port_data.update(new_port)
 
-            # Process port bindings
-            self._process_portbindings_create_and_update(context, port_data,
-                                                         new_port)
-            self._process_mido_portbindings_create_and_update(context,
-                                                              port_data,
-                                                              new_port)
+        # Bind security groups to the port
+        sg_ids = self._get_security_groups_on_port(context, port)
+        self._process_port_create_security_group(context, new_port, sg_ids)
 
-            self._process_port_create_extra_dhcp_opts(context, new_port,
-                                                      dhcp_opts)
+        # Process port bindings
+        self._process_portbindings_create_and_update(context, port_data,
+                                                     new_port)
+        self._process_mido_portbindings_create_and_update(context,
+                                                          port_data,
+                                                          new_port)
 
+        self._process_port_create_extra_dhcp_opts(context, new_port,
+                                                  dhcp_opts)
+        new_port.setdefault(edo_ext.EXTRADHCPOPTS, [])
+        return new_port
+
+    @check_writable
+    def create_port(self, context, port):
+        LOG.debug("MidonetMixin.create_port called: port=%r", port)
+
+        self._ensure_default_security_group_on_port(context, port)
+        with context.session.begin(subtransactions=True):
+            new_port = self._create_port_db(context, port)
             self.client.create_port_precommit(context, new_port)
 
         try:
@@ -240,6 +405,31 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         LOG.debug("MidonetMixin.create_port exiting: port=%r", new_port)
         return new_port
 
+    @check_writable
+    def create_port_bulk(self, context, ports):
+        LOG.debug("MidonetMixin.create_port_bulk called: ports=%r", ports)
+
+        for port in ports['ports']:
+            self._ensure_default_security_group_on_port(context, port)
+        with context.session.begin(subtransactions=True):
+            new_ports = [self._create_port_db(context, port)
+                         for port in ports['ports']]
+            self.client.create_port_bulk_precommit(context, new_ports)
+
+        try:
+            self.client.create_port_bulk_postcommit(new_ports)
+        except Exception as ex:
+            LOG.error(_LE("Failed to create bulk ports %(ports)s: %(err)s"),
+                      {"ports": new_ports, "err": ex})
+            with excutils.save_and_reraise_exception():
+                for new_port in new_ports:
+                    self.delete_port(context, new_port['id'])
+
+        LOG.debug("MidonetMixin.create_port_bulk exiting: ports=%r",
+                  new_ports)
+        return new_ports
+
+    @check_writable
     def delete_port(self, context, id, l3_port_check=True):
         LOG.debug("MidonetMixin.delete_port called: id=%(id)s "
                   "l3_port_check=%(l3_port_check)r",
@@ -251,15 +441,17 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
             self.prevent_l3_port_deletion(context, id)
 
         with context.session.begin(subtransactions=True):
+            network_id = self._get_port(context, id)['network_id']
             super(MidonetMixin, self).disassociate_floatingips(
                 context, id, do_notify=False)
             super(MidonetMixin, self).delete_port(context, id)
             self.client.delete_port_precommit(context, id)
 
-        self.client.delete_port_postcommit(id)
+        self.client.delete_port_postcommit(id, network_id=network_id)
 
         LOG.debug("MidonetMixin.delete_port exiting: id=%r", id)
 
+    @check_writable
     def update_port(self, context, id, port):
         LOG.debug("MidonetMixin.update_port called: id=%(id)s port=%(port)r",
                   {'id': id, 'port': port})
@@ -291,6 +483,7 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         LOG.debug("MidonetMixin.update_port exiting: p=%r", p)
         return p
 
+    @check_writable
     def create_router(self, context, router):
         LOG.debug("MidonetMixin.create_router called: router=%(router)s",
                   {"router": router})
@@ -311,6 +504,7 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
                   {"router": r})
         return r
 
+    @check_writable
     def update_router(self, context, id, router):
         LOG.debug("MidonetMixin.update_router called: id=%(id)s "
                   "router=%(router)r", {"id": id, "router": router})
@@ -324,6 +518,7 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         LOG.debug("MidonetMixin.update_router exiting: router=%r", r)
         return r
 
+    @check_writable
     def delete_router(self, context, id):
         LOG.debug("MidonetMixin.delete_router called: id=%s", id)
 
@@ -335,6 +530,7 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
 
         LOG.debug("MidonetMixin.delete_router exiting: id=%s", id)
 
+    @check_writable
     def add_router_interface(self, context, router_id, interface_info):
         LOG.debug("MidonetMixin.add_router_interface called: "
                   "router_id=%(router_id)s, interface_info=%(interface_info)r",
@@ -359,6 +555,7 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         LOG.debug("MidonetMixin.add_router_interface exiting: info=%r", info)
         return info
 
+    @check_writable
     def remove_router_interface(self, context, router_id, interface_info):
         LOG.debug("MidonetMixin.remove_router_interface called: "
                   "router_id=%(router_id)s, interface_info=%(interface_info)r",
@@ -376,6 +573,7 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
                   info)
         return info
 
+    @check_writable
     def create_floatingip(self, context, floatingip):
         LOG.debug("MidonetMixin.create_floatingip called: ip=%r", floatingip)
 
@@ -396,6 +594,7 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         LOG.debug("MidonetMixin.create_floatingip exiting: fip=%r", fip)
         return fip
 
+    @check_writable
     def delete_floatingip(self, context, id):
         LOG.debug("MidonetMixin.delete_floatingip called: id=%s", id)
 
@@ -407,6 +606,7 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
 
         LOG.debug("MidonetMixin.delete_floatingip exiting: id=%r", id)
 
+    @check_writable
     def update_floatingip(self, context, id, floatingip):
         LOG.debug("MidonetMixin.update_floatingip called: id=%(id)s "
                   "floatingip=%(floatingip)s ",
@@ -438,6 +638,9 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         sg = security_group.get('security_group')
         tenant_id = self._get_tenant_id_for_create(context, sg)
         if not default_sg:
+            # The default groups are created on the reads of the tenants
+            # without one, which go through while the data is read-only.
+            _check_writable(context)
             self._ensure_default_security_group(context, tenant_id)
 
         # Create the Neutron sg first
@@ -458,6 +661,36 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         LOG.debug("MidonetMixin.create_security_group exiting: sg=%r", sg)
         return sg
 
+    @check_writable
+    def create_security_group_bulk(self, context, security_groups):
+        LOG.debug("MidonetMixin.create_security_group_bulk called: "
+                  "security_groups=%(security_groups)r",
+                  {'security_groups': security_groups})
+
+        for security_group in security_groups['security_groups']:
+            tenant_id = self._get_tenant_id_for_create(
+                context, security_group['security_group'])
+            self._ensure_default_security_group(context, tenant_id)
+        with context.session.begin(subtransactions=True):
+            sgs = [super(MidonetMixin, self).create_security_group(
+                context, security_group)
+                for security_group in security_groups['security_groups']]
+            self.client.create_security_group_bulk_precommit(context, sgs)
+
+        try:
+            self.client.create_security_group_bulk_postcommit(sgs)
+        except Exception as ex:
+            LOG.error(_LE("Failed to create bulk security groups %(sgs)s, "
+                          "error: %(err)s"), {"sgs": sgs, "err": ex})
+            with excutils.save_and_reraise_exception():
+                for sg in sgs:
+                    self.delete_security_group(context, sg['id'])
+
+        LOG.debug("MidonetMixin.create_security_group_bulk exiting: "
+                  "sgs=%r", sgs)
+        return sgs
+
+    @check_writable
     def delete_security_group(self, context, id):
         LOG.debug("MidonetMixin.delete_security_group called: id=%s", id)
 
@@ -472,10 +705,15 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
             super(MidonetMixin, self).delete_security_group(context, id)
             self.client.delete_security_group_precommit(context, id)
 
+        cached = self._default_sg_ids.get(sg['tenant_id'])
+        if cached is not None and cached[0] == id:
+            del self._default_sg_ids[sg['tenant_id']]
+
         self.client.delete_security_group_postcommit(id)
 
         LOG.debug("MidonetMixin.delete_security_group exiting: id=%r", id)
 
+    @check_writable
     def create_security_group_rule(self, context, security_group_rule):
         LOG.debug("MidonetMixin.create_security_group_rule called: "
                   "security_group_rule=%(security_group_rule)r",
@@ -498,6 +736,7 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
                   rule)
         return rule
 
+    @check_writable
     def create_security_group_rule_bulk(self, context, rules):
         LOG.debug("MidonetMixin.create_security_group_rule_bulk called: "
                   "security_group_rules=%(security_group_rules)r",
@@ -523,21 +762,26 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
                   "rules=%r", rules)
         return rules
 
+    @check_writable
     def delete_security_group_rule(self, context, sg_rule_id):
         LOG.debug("MidonetMixin.delete_security_group_rule called: "
                   "sg_rule_id=%s", sg_rule_id)
 
         with context.session.begin(subtransactions=True):
+            sg_id = self._get_security_group_rule(
+                context, sg_rule_id)['security_group_id']
             super(MidonetMixin, self).delete_security_group_rule(context,
                                                                  sg_rule_id)
             self.client.delete_security_group_rule_precommit(context,
                                                              sg_rule_id)
 
-        self.client.delete_security_group_rule_postcommit(sg_rule_id)
+        self.client.delete_security_group_rule_postcommit(
+            sg_rule_id, security_group_id=sg_id)
 
         LOG.debug("MidonetMixin.delete_security_group_rule exiting: id=%r",
                   id)
 
+    @check_writable
     def create_agent_membership(self, context, agent_membership):
         LOG.debug("MidonetMixin.create_agent_membership called: "
                   " %(agent_membership)r",
@@ -584,6 +828,7 @@ class MidonetMixin(agentschedulers_db.DhcpAgentSchedulerDbMixin,
         LOG.debug("MidonetMixin.get_agent_memberships exiting")
         return ams
 
+    @check_writable
     def delete_agent_membership(self, context, id):
         LOG.debug("MidonetMixin.delete_agent_membership called: %(id)r",
                   {'id': id})
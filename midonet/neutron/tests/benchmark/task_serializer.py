@@ -0,0 +1,106 @@
+# Copyright (C) 2015 Midokura SARL.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Micro-benchmark of the task data serializers.
+
+Serializes and encodes port and router dicts shaped like the ones written by
+the plugin with every registered serializer, optionally followed by zlib,
+and reports the time per operation and the size stored in the tasks table.
+
+    python -m midonet.neutron.tests.benchmark.task_serializer [iterations]
+"""
+
+import sys
+import timeit
+import uuid
+
+from midonet.neutron.db import task_db
+
+
+def _uuid():
+    return str(uuid.uuid4())
+
+
+def make_port(fixed_ips=8, dhcp_opts=8, security_groups=4):
+    return {
+        'id': _uuid(),
+        'name': 'port-name',
+        'network_id': _uuid(),
+        'tenant_id': uuid.uuid4().hex,
+        'mac_address': 'fa:16:3e:12:34:56',
+        'admin_state_up': True,
+        'status': 'ACTIVE',
+        'device_id': _uuid(),
+        'device_owner': 'compute:nova',
+        'fixed_ips': [{'subnet_id': _uuid(), 'ip_address': '10.0.%d.3' % i}
+                      for i in range(fixed_ips)],
+        'allowed_address_pairs': [],
+        'extra_dhcp_opts': [{'opt_name': 'opt-%d' % i,
+                             'opt_value': '10.0.0.%d' % i}
+                            for i in range(dhcp_opts)],
+        'security_groups': [_uuid() for i in range(security_groups)],
+        'binding:host_id': 'compute-host-1',
+        'binding:vif_type': 'midonet',
+        'binding:vnic_type': 'normal',
+        'binding:vif_details': {'port_filter': True},
+        'binding:profile': {'interface_name': 'tap1234567890a'},
+    }
+
+
+def make_router(routes=32):
+    return {
+        'id': _uuid(),
+        'name': 'router-name',
+        'tenant_id': uuid.uuid4().hex,
+        'admin_state_up': True,
+        'status': 'ACTIVE',
+        'external_gateway_info': {
+            'network_id': _uuid(),
+            'enable_snat': True,
+            'external_fixed_ips': [{'subnet_id': _uuid(),
+                                    'ip_address': '200.0.0.10'}]},
+        'routes': [{'destination': '192.168.%d.0/24' % i,
+                    'nexthop': '10.0.0.%d' % (i + 2)}
+                   for i in range(routes)],
+        'gw_port_id': _uuid(),
+    }
+
+
+def run(iterations=10000, out=sys.stdout):
+    payloads = [('port', make_port()), ('router', make_router())]
+    line = "%-8s%-10s%-8s%12s%12s%10s\n"
+    out.write(line % ("payload", "serializer", "codec", "dumps (us)",
+                      "loads (us)", "bytes"))
+    for payload_name, payload in payloads:
+        for name in sorted(task_db._SERIALIZERS):
+            for codec in (None, 'zlib'):
+                def dumps():
+                    data, codecs = task_db.serialize_task_data(payload, name)
+                    codecs = '+'.join(c for c in (codecs, codec) if c) or None
+                    return task_db.encode_task_data(data, codecs), codecs
+                data, codecs = dumps()
+
+                def loads():
+                    return task_db.load_task_data(data, codecs)
+                dumps_us = timeit.timeit(dumps, number=iterations)
+                loads_us = timeit.timeit(loads, number=iterations)
+                out.write(line % (payload_name, name, codec or '-',
+                                  '%.1f' % (dumps_us * 1e6 / iterations),
+                                  '%.1f' % (loads_us * 1e6 / iterations),
+                                  len(data)))
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
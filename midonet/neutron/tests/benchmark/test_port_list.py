@@ -0,0 +1,116 @@
+# Copyright (C) 2015 Midokura SARL.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmark of the port listing with MidoNet port bindings.
+
+Lists the ports of a tenant whose ports are all bound to an interface, and
+reports the number of SQL statements and the time taken as the number of
+ports grows.  The statement count is expected not to depend on the number of
+ports.  The scale is set with environment variables:
+
+    MIDONET_BENCHMARK_PORTS: number of ports, 1000 by default
+    MIDONET_BENCHMARK_DB: SQLAlchemy URL of the database to run against,
+        in-memory SQLite by default.
+
+Run with 'tox -e benchmark'.
+"""
+
+import os
+import sys
+import time
+
+from midonet.neutron.tests.unit import test_midonet_plugin as test_mn
+
+from neutron.api.v2 import attributes
+from neutron import context
+from neutron.extensions import portbindings
+from neutron import manager
+
+from oslo_config import cfg
+import sqlalchemy as sa
+
+NOT_SET = attributes.ATTR_NOT_SPECIFIED
+
+BATCH_SIZE = 100
+
+
+class PortListBenchmark(test_mn.MidonetPluginV2TestCase):
+
+    def setUp(self):
+        db_url = os.environ.get('MIDONET_BENCHMARK_DB')
+        if db_url:
+            cfg.CONF.set_override('connection', db_url, group='database')
+        super(PortListBenchmark, self).setUp()
+        self.plugin = manager.NeutronManager.get_plugin()
+        self.ctx = context.get_admin_context()
+        self.ports = int(os.environ.get('MIDONET_BENCHMARK_PORTS', 1000))
+
+    def _port(self, i, network_id):
+        profile = {'interface_name': 'if%d' % i}
+        return {'port': {'name': 'port%d' % i,
+                         'network_id': network_id,
+                         'tenant_id': self._tenant_id,
+                         'admin_state_up': True,
+                         'mac_address': NOT_SET,
+                         'fixed_ips': [],
+                         'device_id': 'device%d' % i,
+                         'device_owner': 'compute:nova',
+                         portbindings.HOST_ID: 'host%d' % (i % 10),
+                         portbindings.PROFILE: profile}}
+
+    def _create_ports(self, network_id, start, end):
+        for i in range(start, end, BATCH_SIZE):
+            ports = [self._port(j, network_id)
+                     for j in range(i, min(end, i + BATCH_SIZE))]
+            self.plugin.create_port_bulk(self.ctx, {'ports': ports})
+
+    def _list_ports(self):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+        engine = self.ctx.session.get_bind()
+        sa.event.listen(engine, 'before_cursor_execute', count)
+        try:
+            start = time.time()
+            ports = self.plugin.get_ports(
+                self.ctx, filters={'tenant_id': [self._tenant_id]})
+            elapsed = time.time() - start
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute', count)
+        self.assertTrue(all(p[portbindings.PROFILE] for p in ports))
+        return len(ports), len(statements), elapsed
+
+    def test_port_list(self):
+        net = self.plugin.create_network(
+            self.ctx, {'network': {'name': 'net',
+                                   'admin_state_up': True,
+                                   'shared': False,
+                                   'tenant_id': self._tenant_id}})
+        results = []
+        created = 0
+        for count in (10, self.ports):
+            self._create_ports(net['id'], created, count)
+            created = count
+            results.append(self._list_ports())
+
+        out = sys.stdout
+        out.write("\nPort listing on %s\n" %
+                  self.ctx.session.get_bind().dialect.name)
+        line = "%8s%12s%10s\n"
+        out.write(line % ("ports", "statements", "ms"))
+        for ports, statements, elapsed in results:
+            out.write(line % (ports, statements, '%.1f' % (elapsed * 1000)))
+        self.assertEqual(results[0][1], results[-1][1])
@@ -0,0 +1,109 @@
+# Copyright (C) 2015 Midokura SARL.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+from midonet.neutron.client import executor
+
+from neutron.tests import base
+
+TIMEOUT = 5
+
+
+class TestOrderedExecutor(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestOrderedExecutor, self).setUp()
+        self.failures = []
+        self.executor = executor.OrderedExecutor(
+            4, 10, failure_handler=self._failed)
+        self.addCleanup(self.executor.shutdown)
+        self.calls = []
+
+    def _failed(self, name, args, error):
+        self.failures.append((name, args))
+
+    def _op(self, name, wait=None):
+        done = threading.Event()
+
+        def func(*args):
+            if wait is not None:
+                wait.wait(TIMEOUT)
+            self.calls.append(name)
+            done.set()
+        return func, done
+
+    def test_same_key_in_order(self):
+        release = threading.Event()
+        net, net_done = self._op('net', wait=release)
+        port, port_done = self._op('port')
+        self.executor.submit(['n1'], 'net', net)
+        self.executor.submit(['p1', 'n1'], 'port', port)
+        self.assertFalse(port_done.wait(0.1))
+        release.set()
+        self.assertTrue(port_done.wait(TIMEOUT))
+        self.assertEqual(['net', 'port'], self.calls)
+
+    def test_other_keys_concurrent(self):
+        release = threading.Event()
+        net1, net1_done = self._op('net1', wait=release)
+        net2, net2_done = self._op('net2')
+        self.executor.submit(['n1'], 'net1', net1)
+        self.executor.submit(['n2'], 'net2', net2)
+        self.assertTrue(net2_done.wait(TIMEOUT))
+        release.set()
+        self.assertTrue(net1_done.wait(TIMEOUT))
+        self.assertEqual(['net2', 'net1'], self.calls)
+
+    def test_failure_handler(self):
+        def fail(*args):
+            raise ValueError()
+        after, after_done = self._op('after')
+        self.executor.submit(['n1'], 'create_network_postcommit', fail,
+                             {'id': 'n1'})
+        self.executor.submit(['n1'], 'after', after)
+        self.assertTrue(after_done.wait(TIMEOUT))
+        self.assertEqual(
+            [('create_network_postcommit', ({'id': 'n1'},))], self.failures)
+
+    def test_backpressure(self):
+        self.executor = executor.OrderedExecutor(1, 1)
+        self.addCleanup(self.executor.shutdown)
+        release = threading.Event()
+        submitted = threading.Event()
+        net1, net1_done = self._op('net1', wait=release)
+        net2, net2_done = self._op('net2')
+        self.executor.submit(['n1'], 'net1', net1)
+
+        def submit():
+            self.executor.submit(['n2'], 'net2', net2)
+            submitted.set()
+        threading.Thread(target=submit).start()
+        self.assertFalse(submitted.wait(0.1))
+        release.set()
+        self.assertTrue(submitted.wait(TIMEOUT))
+        self.assertTrue(net2_done.wait(TIMEOUT))
+
+    def test_shutdown_waits_for_operations(self):
+        release = threading.Event()
+        net, net_done = self._op('net', wait=release)
+        port, port_done = self._op('port')
+        self.executor.submit(['n1'], 'net', net)
+        self.executor.submit(['n1'], 'port', port)
+        threading.Timer(0.1, release.set).start()
+        threads = list(self.executor._threads)
+        self.executor.shutdown()
+        self.assertEqual(['net', 'port'], self.calls)
+        self.assertFalse(any(t.is_alive() for t in threads))
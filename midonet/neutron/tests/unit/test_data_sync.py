@@ -0,0 +1,298 @@
+# Copyright (C) 2015 Midokura SARL.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import mock
+
+from midonet.neutron.client import cluster
+from midonet.neutron.common import exceptions as exc
+from midonet.neutron.db import data_state_db
+from midonet.neutron.db import data_sync
+from midonet.neutron.db import data_version_db as dv_db
+from midonet.neutron.db import task_db
+from midonet.neutron.tests.unit import test_midonet_plugin as test_mn
+
+from neutron import context
+from neutron.db import api as db_api
+from neutron.db import models_v2
+from neutron.db import securitygroups_db as sg_db
+from neutron import manager
+from neutron.tests.unit.extensions import test_securitygroup as test_sg
+
+
+class DataSyncTestCase(test_mn.MidonetPluginV2TestCase,
+                       test_sg.SecurityGroupsTestCase):
+
+    def setUp(self):
+        super(DataSyncTestCase, self).setUp()
+        self.session = db_api.get_session(autocommit=True)
+        with self.session.begin():
+            self.session.add(data_state_db.DataState(
+                updated_at=datetime.datetime.utcnow(), readonly=False))
+
+    def _set_readonly(self):
+        # The API rejects the writes from here on
+        with self.session.begin():
+            self.session.query(data_state_db.DataState).update(
+                {'readonly': True})
+
+    def _get_tasks(self):
+        return self.session.query(task_db.Task).order_by(
+            task_db.Task.id).all()
+
+
+class TestDataVersionSync(DataSyncTestCase):
+
+    def test_sync(self):
+        with self.port() as port:
+            self._set_readonly()
+            counts = {}
+
+            def progress(data_type, count):
+                counts[data_type] = counts.get(data_type, 0) + count
+            version_id = data_sync.sync_data_version(self.session,
+                                                     batch_size=1,
+                                                     progress=progress)
+
+        tasks = self._get_tasks()
+        self.assertEqual((task_db.DATA_VERSION_SYNC, str(version_id)),
+                         (tasks[0].type, tasks[0].resource_id))
+        self.assertEqual((task_db.DATA_VERSION_ACTIVATE, str(version_id)),
+                         (tasks[-1].type, tasks[-1].resource_id))
+        self.assertEqual([task_db.NETWORK, task_db.SUBNET, task_db.PORT],
+                         [t.data_type for t in tasks[1:-1]
+                          if t.data_type != task_db.SECURITY_GROUP])
+        self.assertEqual({task_db.NETWORK: 1, task_db.SUBNET: 1,
+                          task_db.SECURITY_GROUP: 1, task_db.PORT: 1},
+                         counts)
+
+        port_task = [t for t in tasks if t.data_type == task_db.PORT][0]
+        data = task_db.load_task_data(port_task.data, port_task.codec)
+        self.assertEqual(port['port']['id'], data['id'])
+        self.assertEqual(port['port']['fixed_ips'], data['fixed_ips'])
+        self.assertIn('binding:vif_type', data)
+
+        version = dv_db.get_version(self.session, version_id)
+        self.assertEqual(dv_db.COMPLETED, version.sync_tasks_status)
+        self.assertTrue(version.sync_started_at <= version.sync_finished_at)
+
+    def test_rebuild_snapshots_after_sync(self):
+        with self.port() as port:
+            self._set_readonly()
+            data_sync.sync_data_version(self.session)
+
+            resources = list(task_db.iter_current_task_data(self.session,
+                                                            batch_size=1))
+            count = task_db.rebuild_resource_snapshots(self.session)
+
+        self.assertEqual(4, len(resources))
+        self.assertNotIn(None, [r[0] for r in resources])
+        self.assertIn((task_db.PORT, port['port']['id']),
+                      [r[:2] for r in resources])
+        # The rules of the security group get snapshots of their own
+        rules = set((task_db.SECURITY_GROUP_RULE, rule['id'])
+                    for r in resources if r[0] == task_db.SECURITY_GROUP
+                    for rule in r[2]['security_group_rules'])
+        self.assertTrue(rules)
+        snapshots = task_db.get_resource_snapshots(self.session)
+        self.assertEqual(4 + len(rules), count)
+        self.assertEqual(set(r[:2] for r in resources) | rules,
+                         set((s.data_type, s.resource_id) for s in snapshots))
+
+    def test_sync_requires_readonly(self):
+        self.assertRaises(exc.MidonetDataSyncError,
+                          data_sync.sync_data_version, self.session)
+
+    def test_sync_requires_processed_tasks(self):
+        task_db.create_task(context.get_admin_context(), task_db.CREATE,
+                            data_type=task_db.PORT, resource_id='p1',
+                            data={'id': 'p1'})
+        self._set_readonly()
+        self.assertRaises(exc.MidonetDataSyncError,
+                          data_sync.sync_data_version, self.session)
+
+    def test_resume(self):
+        insert = task_db.insert_resource_tasks
+        calls = []
+
+        def fail_second_batch(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise ValueError()
+            insert(*args)
+
+        with self.port():
+            self._set_readonly()
+            with mock.patch.object(task_db, 'insert_resource_tasks',
+                                   side_effect=fail_second_batch):
+                self.assertRaises(ValueError, data_sync.sync_data_version,
+                                  self.session, batch_size=1)
+            version = dv_db.get_last_version(self.session)
+            self.assertEqual(dv_db.ERROR, version.sync_tasks_status)
+            self.assertIsNone(version.sync_finished_at)
+
+            version_id = data_sync.sync_data_version(self.session,
+                                                     batch_size=1,
+                                                     resume=True)
+
+        data_types = [t.data_type for t in self._get_tasks()[1:-1]]
+        self.assertEqual(len(set(data_types)), len(data_types))
+        self.assertIn(task_db.PORT, data_types)
+        self.assertEqual(dv_db.COMPLETED, dv_db.get_version(
+            self.session, version_id).sync_tasks_status)
+
+    def test_resume_without_sync(self):
+        self._set_readonly()
+        self.assertRaises(exc.MidonetDataSyncError,
+                          data_sync.sync_data_version, self.session,
+                          resume=True)
+
+    def test_activate(self):
+        self._set_readonly()
+        version_id = data_sync.sync_data_version(self.session)
+        data_sync.activate_data_version(self.session, version_id)
+
+        task = self._get_tasks()[-1]
+        self.assertEqual((task_db.DATA_VERSION_ACTIVATE, str(version_id)),
+                         (task.type, task.resource_id))
+        self.assertEqual(dv_db.STARTED, dv_db.get_version(
+            self.session, version_id).sync_status)
+
+
+class TestIncrementalSync(DataSyncTestCase):
+
+    def _sync(self):
+        self._set_readonly()
+        data_sync.sync_data_version(self.session)
+        return self._get_tasks()[-1].id
+
+    def _get_tasks_after(self, task_id):
+        return [(t.type, t.data_type, t.resource_id)
+                for t in self._get_tasks() if t.id > task_id]
+
+    def test_no_changes(self):
+        with self.port():
+            self._sync()
+            self.assertEqual(
+                0, data_sync.sync_data_incremental(self.session))
+
+    def test_changes(self):
+        with self.network() as net:
+            with self.port() as port:
+                last_id = self._sync()
+                net_id = net['network']['id']
+                port_id = port['port']['id']
+                with self.session.begin():
+                    self.session.query(models_v2.Network).filter_by(
+                        id=net_id).update({'name': 'changed'})
+                    self.session.query(models_v2.Port).filter_by(
+                        id=port_id).delete()
+                counts = {}
+
+                def progress(data_type, created, updated, deleted):
+                    counts[data_type] = (created, updated, deleted)
+                self.assertEqual(2, data_sync.sync_data_incremental(
+                    self.session, batch_size=1, progress=progress))
+
+        self.assertEqual([(task_db.UPDATE, task_db.NETWORK, net_id),
+                          (task_db.DELETE, task_db.PORT, port_id)],
+                         self._get_tasks_after(last_id))
+        self.assertEqual((0, 1, 0), counts[task_db.NETWORK])
+        self.assertEqual((0, 0, 1), counts[task_db.PORT])
+
+    def test_create_without_snapshot(self):
+        with self.network() as net:
+            with self.session.begin():
+                self.session.query(task_db.ResourceSnapshot).delete()
+            self._set_readonly()
+            self.assertEqual(
+                2, data_sync.sync_data_incremental(self.session))
+            sg_id = self.session.query(sg_db.SecurityGroup.id).scalar()
+
+        # The rules are created along with the default security group
+        self.assertEqual(
+            [(task_db.CREATE, task_db.NETWORK, net['network']['id']),
+             (task_db.CREATE, task_db.SECURITY_GROUP, sg_id)],
+            self._get_tasks_after(0))
+
+    def test_rule_changes(self):
+        sg = self._make_security_group(self.fmt, 'sg', 'sg')
+        sg_id = sg['security_group']['id']
+        rule_ids = [r['id'] for r in sg['security_group'][
+            'security_group_rules']]
+        last_id = self._sync()
+        with self.session.begin():
+            self.session.query(sg_db.SecurityGroup).filter_by(
+                id=sg_id).update({'name': 'changed'})
+            self.session.query(sg_db.SecurityGroupRule).filter_by(
+                id=rule_ids[0]).delete()
+        self.assertEqual(1, data_sync.sync_data_incremental(self.session))
+
+        # The security groups are not updated in MidoNet
+        self.assertEqual(
+            [(task_db.DELETE, task_db.SECURITY_GROUP_RULE, rule_ids[0])],
+            self._get_tasks_after(last_id))
+        self.assertEqual(0, data_sync.sync_data_incremental(self.session))
+
+    def test_rules_deleted_with_group(self):
+        sg = self._make_security_group(self.fmt, 'sg', 'sg')
+        sg_id = sg['security_group']['id']
+        last_id = self._sync()
+        with self.session.begin():
+            self.session.query(sg_db.SecurityGroupRule).filter_by(
+                security_group_id=sg_id).delete()
+            self.session.query(sg_db.SecurityGroup).filter_by(
+                id=sg_id).delete()
+        self.assertEqual(1, data_sync.sync_data_incremental(self.session))
+
+        self.assertEqual(
+            [(task_db.DELETE, task_db.SECURITY_GROUP, sg_id)],
+            self._get_tasks_after(last_id))
+        self.assertEqual(0, data_sync.sync_data_incremental(self.session))
+
+    def test_incremental_requires_readonly(self):
+        self.assertRaises(exc.MidonetDataSyncError,
+                          data_sync.sync_data_incremental, self.session)
+
+
+class TestIncrementalSyncAfterApi(DataSyncTestCase):
+    """Compares the resources written by the API with the imported ones."""
+
+    def setUp(self):
+        super(TestIncrementalSyncAfterApi, self).setUp()
+        # Write the tasks of the API requests, as the cluster client does
+        plugin = manager.NeutronManager.get_plugin()
+        plugin.client = cluster.MidonetClusterClient()
+
+    def test_no_changes_after_api_writes(self):
+        with self.port(device_owner='compute:nova'):
+            sg = self._make_security_group(self.fmt, 'sg1', 'sg1')
+            sg_id = sg['security_group']['id']
+            rule = self._build_security_group_rule(sg_id, 'ingress', 'tcp',
+                                                   '22', '22')
+            rule = self._make_security_group_rule(self.fmt, rule)
+            self._delete('security-group-rules',
+                         rule['security_group_rule']['id'])
+            self._delete('security-group-rules',
+                         sg['security_group']['security_group_rules'][0][
+                             'id'])
+            rule = self._build_security_group_rule(sg_id, 'ingress', 'udp',
+                                                   '53', '53')
+            self._make_security_group_rule(self.fmt, rule)
+            sg = self._make_security_group(self.fmt, 'sg2', 'sg2')
+            self._delete('security-groups', sg['security_group']['id'])
+            self._set_readonly()
+            self.assertEqual(
+                0, data_sync.sync_data_incremental(self.session))
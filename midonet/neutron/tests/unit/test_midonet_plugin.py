@@ -20,8 +20,10 @@ import datetime
 import functools
 import mock
 from sqlalchemy.orm import sessionmaker
+import time
 from webob import exc
 
+from midonet.neutron.client import api as client_api
 from midonet.neutron.client import base as cli_base
 from midonet.neutron.common import config  # noqa
 from midonet.neutron.db import data_state_db
@@ -30,7 +32,9 @@ from midonet.neutron.db import task_db  # noqa
 
 from neutron import context
 from neutron.db import api as db_api
+from neutron.db import securitygroups_db
 from neutron.extensions import portbindings
+from neutron import manager
 from neutron.tests.unit import _test_extension_portbindings as test_bindings
 from neutron.tests.unit.api import test_extensions
 from neutron.tests.unit.db import test_db_base_plugin_v2 as test_plugin
@@ -66,6 +70,8 @@ class MidonetPluginConf(object):
     def setUp(test_case, parent_setup=None):
         """Perform additional configuration around the parent's setUp."""
         cfg.CONF.set_override('client', TEST_MN_CLIENT, group='MIDONET')
+        # Read the data state on each write, as the tests toggle it
+        cfg.CONF.set_override('readonly_cache_ttl', 0, group='MIDONET')
         if parent_setup:
             parent_setup()
 
@@ -103,6 +109,59 @@ class TestMidonetSecurityGroup(test_sg.TestSecurityGroups,
     pass
 
 
+class TestMidonetDefaultSecurityGroup(MidonetPluginV2TestCase):
+
+    def setUp(self):
+        super(TestMidonetDefaultSecurityGroup, self).setUp()
+        self.plugin = manager.NeutronManager.get_plugin()
+
+    def test_default_security_group_cached(self):
+        with self.network() as net:
+            with mock.patch.object(
+                    securitygroups_db.SecurityGroupDbMixin,
+                    '_ensure_default_security_group') as ensure:
+                ensure.return_value = 'sg-id'
+                with self.port(network=net):
+                    with self.port(network=net):
+                        pass
+                self.assertFalse(ensure.called)
+
+    def test_default_security_group_delete(self):
+        with self.port() as port:
+            tenant_id = port['port']['tenant_id']
+            sg_id = self.plugin._default_sg_ids[tenant_id][0]
+            self.assertEqual([sg_id], port['port']['security_groups'])
+            self._delete('ports', port['port']['id'])
+            self._delete('security-groups', sg_id)
+            self.assertNotIn(tenant_id, self.plugin._default_sg_ids)
+
+    def test_default_security_group_deleted_by_other_worker(self):
+        with self.network() as net:
+            with self.port(network=net) as port:
+                sg_id = port['port']['security_groups'][0]
+            self._delete('ports', port['port']['id'])
+
+            # Another API worker deletes the group, which this one still
+            # has in its cache until the entry expires.
+            other = type(self.plugin)()
+            other.delete_security_group(context.get_admin_context(), sg_id)
+            tenant_id = port['port']['tenant_id']
+            self.assertEqual(sg_id, self.plugin._default_sg_ids[tenant_id][0])
+            ttl = cfg.CONF.MIDONET.default_security_group_cache_ttl
+            with mock.patch('time.time', return_value=time.time() + ttl):
+                with self.port(network=net) as port:
+                    new_sg_id = port['port']['security_groups'][0]
+            self.assertNotEqual(sg_id, new_sg_id)
+            self.assertEqual(new_sg_id,
+                             self.plugin._default_sg_ids[tenant_id][0])
+
+    def test_default_security_group_cache_disabled(self):
+        cfg.CONF.set_override('default_security_group_cache_ttl', 0,
+                              group='MIDONET')
+        with self.port():
+            self.assertEqual({}, self.plugin._default_sg_ids)
+
+
 class TestMidonetSubnetsV2(MidonetPluginV2TestCase,
                            test_plugin.TestSubnetsV2):
     pass
@@ -113,6 +172,86 @@ class TestMidonetPortsV2(MidonetPluginV2TestCase,
     pass
 
 
+class TestMidonetBulk(MidonetPluginV2TestCase):
+
+    def test_create_ports_bulk(self):
+        with self.network() as net:
+            res = self._create_port_bulk(self.fmt, 3, net['network']['id'],
+                                         'test', True)
+            self.assertEqual(201, res.status_int)
+
+        ports = self.client_mock.create_port_bulk_precommit.call_args[0][1]
+        self.assertEqual(3, len(ports))
+        self.client_mock.create_port_bulk_postcommit.assert_called_once_with(
+            ports)
+        self.assertFalse(self.client_mock.create_port_precommit.called)
+
+    def test_create_ports_bulk_postcommit_failure(self):
+        self.client_mock.create_port_bulk_postcommit.side_effect = (
+            Exception())
+        with self.network() as net:
+            res = self._create_port_bulk(self.fmt, 2, net['network']['id'],
+                                         'test', True)
+            self.assertEqual(exc.HTTPServerError.code, res.status_int)
+            self.assertEqual(
+                2, self.client_mock.delete_port_precommit.call_count)
+            self.assertEqual([], self._list('ports')['ports'])
+
+    def test_create_networks_bulk(self):
+        res = self._create_network_bulk(self.fmt, 2, 'test', True)
+        self.assertEqual(201, res.status_int)
+        nets = self.client_mock.create_network_bulk_precommit.call_args[0][1]
+        self.assertEqual(2, len(nets))
+
+    def test_create_security_groups_bulk(self):
+        data = {'security_groups': [{'name': 'sg%d' % i,
+                                     'description': 'sg',
+                                     'tenant_id': self._tenant_id}
+                                    for i in range(2)]}
+        req = self.new_create_request('security-groups', data, self.fmt)
+        res = req.get_response(self.ext_api)
+        self.assertEqual(201, res.status_int)
+
+        client = self.client_mock
+        sgs = client.create_security_group_bulk_precommit.call_args[0][1]
+        self.assertEqual(['sg0', 'sg1'], [sg['name'] for sg in sgs])
+        client.create_security_group_bulk_postcommit.assert_called_once_with(
+            sgs)
+        # Only the default security group is created on its own, before
+        # the transaction of the groups.
+        self.assertEqual(1,
+                         client.create_security_group_precommit.call_count)
+        self.assertEqual(1,
+                         client.create_security_group_postcommit.call_count)
+
+
+class TestMidonetApiClientAsync(MidonetPluginV2TestCase):
+
+    def setUp(self):
+        super(TestMidonetApiClientAsync, self).setUp()
+        cfg.CONF.set_override('api_async_workers', 1, group='MIDONET')
+        self.api_cli = mock.MagicMock()
+        with mock.patch.object(client_api.client, 'MidonetClient',
+                               return_value=self.api_cli):
+            self.client = client_api.MidonetApiClient()
+        self.addCleanup(self.client._executor.shutdown)
+        plugin = manager.NeutronManager.get_plugin()
+        self.client.set_postcommit_failure_handler(plugin._postcommit_failed)
+        plugin.client = self.client
+
+    def test_create_failure_deletes_resource(self):
+        self.api_cli.create_network.side_effect = Exception()
+        res = self._create_network(self.fmt, 'net', True)
+        # The request returns before the MidoNet API call is made
+        self.assertEqual(exc.HTTPCreated.code, res.status_int)
+        net_id = self.deserialize(self.fmt, res)['network']['id']
+
+        self.client._executor.shutdown()
+        self.api_cli.delete_network.assert_called_once_with(net_id)
+        self._show('networks', net_id,
+                   expected_code=exc.HTTPNotFound.code)
+
+
 class TestMidonetPortBinding(MidonetPluginV2TestCase,
                              test_bindings.PortBindingsTestCase):
 
@@ -137,6 +276,13 @@ class TestMidonetPortBinding(MidonetPluginV2TestCase,
             for k, v in keys:
                 self.assertEqual(port['port'][k], v)
 
+    def test_list_mido_portbinding(self):
+        with self.port_with_binding_profile() as port:
+            res = self._list('ports')
+            ports = dict((p['id'], p) for p in res['ports'])
+            self.assertEqual({'interface_name': 'if_name'},
+                             ports[port['port']['id']][portbindings.PROFILE])
+
     def test_create_mido_portbinding_no_profile_specified(self):
         with self.port() as port:
             self.assertIsNone(port['port'][portbindings.PROFILE])
@@ -307,6 +453,69 @@ class TestMidonetDataState(testlib_api.SqlTestCase):
         self.assertTrue(not ds.readonly)
 
 
+class TestMidonetReadOnly(MidonetPluginV2TestCase):
+
+    def setUp(self):
+        super(TestMidonetReadOnly, self).setUp()
+        self.session = db_api.get_session()
+        with self.session.begin():
+            self.session.add(data_state_db.DataState(
+                updated_at=datetime.datetime.utcnow(), readonly=False))
+
+    def _set_readonly(self, readonly):
+        with self.session.begin():
+            self.session.query(data_state_db.DataState).update(
+                {'readonly': readonly})
+
+    def _assert_create_network(self, status):
+        res = self._create_network(self.fmt, 'net', True)
+        self.assertEqual(status, res.status_int)
+
+    def test_write_when_readonly(self):
+        self._set_readonly(True)
+        self._assert_create_network(exc.HTTPServiceUnavailable.code)
+        self.assertFalse(self.client_mock.create_network_precommit.called)
+
+    def test_read_when_readonly(self):
+        with self.network() as net:
+            self._set_readonly(True)
+            self._show('networks', net['network']['id'])
+            self._set_readonly(False)
+
+    def test_list_security_groups_of_new_tenant_when_readonly(self):
+        self._set_readonly(True)
+        ctx = context.Context('', 'new-tenant')
+        sgs = self._list('security-groups', neutron_context=ctx)
+        self.assertEqual(['default'],
+                         [sg['name'] for sg in sgs['security_groups']])
+        self._set_readonly(False)
+
+    def test_create_security_group_when_readonly(self):
+        self._set_readonly(True)
+        data = {'security_group': {'name': 'sg', 'description': 'sg',
+                                   'tenant_id': self._tenant_id}}
+        req = self.new_create_request('security-groups', data, self.fmt)
+        res = req.get_response(self.ext_api)
+        self.assertEqual(exc.HTTPServiceUnavailable.code, res.status_int)
+        self._set_readonly(False)
+
+    def test_readonly_cached(self):
+        cfg.CONF.set_override('readonly_cache_ttl', 60, group='MIDONET')
+        self._assert_create_network(exc.HTTPCreated.code)
+        self._set_readonly(True)
+        # The writes go through until the cached flag is refreshed
+        self._assert_create_network(exc.HTTPCreated.code)
+        data_state_db.refresh_readonly(self.session, 60)
+        self._assert_create_network(exc.HTTPServiceUnavailable.code)
+        data_state_db.set_readwrite(db_api.get_session(autocommit=False))
+        self._assert_create_network(exc.HTTPCreated.code)
+
+    def test_missing_data_state(self):
+        with self.session.begin():
+            self.session.query(data_state_db.DataState).delete()
+        self._assert_create_network(exc.HTTPCreated.code)
+
+
 class TestMidonetAgent(MidonetPluginV2TestCase,
                        test_agent.AgentDBTestMixIn):
 
@@ -0,0 +1,106 @@
+# Copyright (C) 2015 Midokura SARL.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import mock
+import os
+import socket
+import tempfile
+
+from midonet.neutron.db import data_state_db
+from midonet.neutron.db import task_consumer
+from midonet.neutron.db import task_db
+
+from neutron import context
+from neutron.tests import base
+from neutron.tests.unit import testlib_api
+
+
+class TestTaskConsumer(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TestTaskConsumer, self).setUp()
+        self.ctx = context.get_admin_context()
+        self.ctx.session.add(data_state_db.DataState(
+            updated_at=datetime.datetime.utcnow(), readonly=False))
+        self.consumer = task_consumer.TaskConsumer(self.ctx.session,
+                                                   batch_size=2)
+
+    def _create_task(self, type, resource_id, **data):
+        data = dict(data, id=resource_id) if type != task_db.DELETE else None
+        task_db.create_task(self.ctx, type, data_type=task_db.PORT,
+                            resource_id=resource_id, data=data)
+
+    def test_consume_in_batches(self):
+        self._create_task(task_db.CREATE, 'p1', name='a')
+        self._create_task(task_db.CREATE, 'p2', name='a')
+        self._create_task(task_db.UPDATE, 'p1', name='b')
+        self._create_task(task_db.DELETE, 'p2')
+
+        self.assertEqual(2, self.consumer.consume())
+        self.assertEqual(2, self.consumer.consume())
+        self.assertEqual(0, self.consumer.consume())
+
+        self.assertEqual({'p1': {'id': 'p1', 'name': 'b'}},
+                         self.consumer.model[task_db.PORT])
+        last_id = max(t.id for t in self.ctx.session.query(task_db.Task))
+        self.assertEqual(last_id, data_state_db.get_data_state(
+            self.ctx.session).last_processed_task_id)
+
+        stats = self.consumer.report()
+        self.assertEqual(4, stats['processed'])
+        self.assertEqual(1, stats['resources'])
+        self.assertEqual(0, self.consumer.report()['processed'])
+
+
+    def test_report_without_tasks(self):
+        self.assertEqual(0, self.consumer.consume())
+
+        stats = self.consumer.report()
+        self.assertEqual(0, stats['processed'])
+        self.assertEqual(0, stats['latency_p50'])
+        self.assertEqual(0, stats['latency_p99'])
+
+    def test_control_tasks_not_in_model(self):
+        task_db.create_config_task(self.ctx.session, {'tunnel_protocol': 1})
+        task_db.insert_tasks(self.ctx.session, [
+            {'type': task_db.DATA_VERSION_ACTIVATE, 'data_type': None,
+             'resource_id': '1', 'data': '{}', 'transaction_id': 't'}])
+        self._create_task(task_db.CREATE, 'p1')
+
+        while self.consumer.consume():
+            pass
+
+        self.assertEqual({task_db.PORT: {'p1': {'id': 'p1'}}},
+                         dict(self.consumer.model))
+        self.assertEqual(1, self.consumer.config['tunnel_protocol'])
+        self.assertEqual('1', self.consumer.active_version)
+
+
+class TestTaskConsumerMain(base.BaseTestCase):
+
+    def test_stale_socket_replaced(self):
+        path = tempfile.mktemp()
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        stale.bind(path)
+        stale.close()
+
+        with mock.patch.object(task_consumer, 'cfg') as cfg:
+            cfg.CONF.notification_socket = path
+            with mock.patch.object(task_consumer, '_run') as run:
+                task_consumer.main()
+
+        self.assertTrue(run.called)
+        self.assertFalse(os.path.exists(path))
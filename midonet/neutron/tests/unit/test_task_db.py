@@ -0,0 +1,793 @@
+# Copyright (C) 2015 Midokura SARL.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+
+from midonet.neutron.db import data_state_db
+from midonet.neutron.db import task_db
+from midonet.neutron.db import task_notifier
+
+from neutron import context
+from neutron.db import api as db_api
+from neutron.tests.unit import testlib_api
+from oslo_config import cfg
+from oslo_serialization import jsonutils
+import socket
+from sqlalchemy import event
+import tempfile
+
+
+class RecordingTaskNotifier(task_notifier.TaskNotifierBase):
+
+    notified = []
+
+    def notify(self, session, task_id):
+        self.notified.append(task_id)
+
+
+class TaskDbTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TaskDbTestCase, self).setUp()
+        self.ctx = context.get_admin_context()
+
+    def _create_task(self, type, resource_id, data_type=task_db.PORT,
+                     **data):
+        if type != task_db.DELETE:
+            data['id'] = resource_id
+        else:
+            data = None
+        task_db.create_task(self.ctx, type, data_type=data_type,
+                            resource_id=resource_id, data=data)
+
+    def _get_tasks(self):
+        return self.ctx.session.query(task_db.Task).order_by(
+            task_db.Task.id).all()
+
+    def _get_current_task_data(self, batch_size=1000):
+        return dict((data_type, dict(resources)) for data_type, resources
+                    in task_db.get_current_task_data(self.ctx.session,
+                                                     batch_size))
+
+
+class TestTaskCoalescing(TaskDbTestCase):
+
+    def test_create_update_merged_into_create(self):
+        with self.ctx.session.begin(subtransactions=True):
+            self._create_task(task_db.CREATE, 'p1', name='a')
+            self._create_task(task_db.UPDATE, 'p1', name='b')
+
+        tasks = self._get_tasks()
+        self.assertEqual(1, len(tasks))
+        self.assertEqual(task_db.CREATE, tasks[0].type)
+        self.assertEqual('b', jsonutils.loads(tasks[0].data)['name'])
+
+    def test_create_keeps_position_of_first_task(self):
+        with self.ctx.session.begin(subtransactions=True):
+            self._create_task(task_db.CREATE, 'n1', data_type=task_db.NETWORK)
+            self._create_task(task_db.CREATE, 'p1')
+            self._create_task(task_db.UPDATE, 'n1', data_type=task_db.NETWORK)
+
+        tasks = self._get_tasks()
+        self.assertEqual(['n1', 'p1'], [t.resource_id for t in tasks])
+
+    def test_update_update_merged_into_update(self):
+        with self.ctx.session.begin(subtransactions=True):
+            self._create_task(task_db.UPDATE, 'p1', name='a')
+            self._create_task(task_db.UPDATE, 'p1', name='b')
+
+        tasks = self._get_tasks()
+        self.assertEqual(1, len(tasks))
+        self.assertEqual(task_db.UPDATE, tasks[0].type)
+        self.assertEqual('b', jsonutils.loads(tasks[0].data)['name'])
+
+    def test_update_keeps_position_of_first_task(self):
+        with self.ctx.session.begin(subtransactions=True):
+            self._create_task(task_db.UPDATE, 'n1', data_type=task_db.NETWORK)
+            self._create_task(task_db.UPDATE, 'r1', data_type=task_db.ROUTER)
+            self._create_task(task_db.UPDATE, 'n1', data_type=task_db.NETWORK)
+
+        tasks = self._get_tasks()
+        self.assertEqual(['n1', 'r1'], [t.resource_id for t in tasks])
+
+    def test_create_delete_cancelled(self):
+        with self.ctx.session.begin(subtransactions=True):
+            self._create_task(task_db.CREATE, 'p1')
+            self._create_task(task_db.UPDATE, 'p1')
+            self._create_task(task_db.DELETE, 'p1')
+
+        self.assertEqual([], self._get_tasks())
+
+    def test_update_delete_merged_into_delete(self):
+        with self.ctx.session.begin(subtransactions=True):
+            self._create_task(task_db.UPDATE, 'n1', data_type=task_db.NETWORK)
+            self._create_task(task_db.DELETE, 'p1')
+            self._create_task(task_db.DELETE, 'n1', data_type=task_db.NETWORK)
+
+        tasks = self._get_tasks()
+        self.assertEqual([(task_db.DELETE, 'p1'), (task_db.DELETE, 'n1')],
+                         [(t.type, t.resource_id) for t in tasks])
+
+    def test_delete_create_not_merged(self):
+        with self.ctx.session.begin(subtransactions=True):
+            self._create_task(task_db.DELETE, 'p1')
+            self._create_task(task_db.CREATE, 'p1')
+
+        tasks = self._get_tasks()
+        self.assertEqual([task_db.DELETE, task_db.CREATE],
+                         [t.type for t in tasks])
+
+    def test_separate_transactions_not_merged(self):
+        self._create_task(task_db.CREATE, 'p1')
+        self._create_task(task_db.UPDATE, 'p1')
+
+        self.assertEqual(2, len(self._get_tasks()))
+
+    def test_rollback_drops_pending_tasks(self):
+        try:
+            with self.ctx.session.begin(subtransactions=True):
+                self._create_task(task_db.CREATE, 'p1')
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self._create_task(task_db.CREATE, 'p2')
+        tasks = self._get_tasks()
+        self.assertEqual(['p2'], [t.resource_id for t in tasks])
+
+
+class TestTaskBatching(TaskDbTestCase):
+
+    def setUp(self):
+        super(TestTaskBatching, self).setUp()
+        self.statements = []
+        engine = db_api.get_engine()
+        event.listen(engine, 'before_cursor_execute', self._record)
+        self.addCleanup(event.remove, engine, 'before_cursor_execute',
+                        self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context,
+                executemany):
+        if statement.startswith('INSERT INTO midonet_tasks'):
+            self.statements.append(executemany)
+
+    def test_tasks_inserted_with_single_statement(self):
+        with self.ctx.session.begin(subtransactions=True):
+            for i in range(50):
+                self._create_task(task_db.CREATE, 'p%d' % i)
+
+        self.assertEqual([True], self.statements)
+        tasks = self._get_tasks()
+        self.assertEqual(['p%d' % i for i in range(50)],
+                         [t.resource_id for t in tasks])
+        self.assertTrue(all(t.created_at is not None for t in tasks))
+
+    def test_no_statement_without_tasks(self):
+        with self.ctx.session.begin(subtransactions=True):
+            pass
+
+        self.assertEqual([], self.statements)
+
+
+class TestTaskCodec(TaskDbTestCase):
+
+    def test_plain_json_by_default(self):
+        self._create_task(task_db.CREATE, 'p1', name='a')
+
+        task = self._get_tasks()[0]
+        self.assertIsNone(task.codec)
+        self.assertEqual('a', jsonutils.loads(task.data)['name'])
+
+    def test_zlib_codec(self):
+        cfg.CONF.set_override('task_codec', 'zlib', group='MIDONET')
+        self._create_task(task_db.CREATE, 'p1', name='a' * 1000)
+        self._create_task(task_db.DELETE, 'p2')
+
+        tasks = self._get_tasks()
+        self.assertEqual('zlib', tasks[0].codec)
+        self.assertTrue(len(tasks[0].data) < 1000)
+        data = task_db.load_task_data(tasks[0].data, tasks[0].codec)
+        self.assertEqual('a' * 1000, data['name'])
+        self.assertIsNone(tasks[1].codec)
+        self.assertIsNone(tasks[1].data)
+
+    def test_current_task_data_decoded(self):
+        cfg.CONF.set_override('task_codec', 'zlib', group='MIDONET')
+        self._create_task(task_db.CREATE, 'p1', name='a')
+
+        data = self._get_current_task_data()
+        self.assertEqual('a', data[task_db.PORT]['p1']['name'])
+
+    def test_unknown_codec_rejected(self):
+        cfg.CONF.set_override('task_codec', 'zlib+zlip', group='MIDONET')
+        self.assertRaises(ValueError, task_db.check_task_config)
+        self.assertRaises(ValueError, task_db.encode_task_data, '{}',
+                          'zlib+zlip')
+        self.assertRaises(ValueError, task_db.load_task_data, 'e30=',
+                          'zlip')
+
+    def test_unknown_serializer_rejected(self):
+        cfg.CONF.set_override('task_serializer', 'jsno', group='MIDONET')
+        self.assertRaises(ValueError, task_db.check_task_config)
+
+
+class TestTaskSerializer(TaskDbTestCase):
+
+    def _test_serializer(self, name, codec=None):
+        cfg.CONF.set_override('task_serializer', name, group='MIDONET')
+        self._create_task(task_db.CREATE, 'p1', name='a', fixed_ips=[
+            {'subnet_id': 's1', 'ip_address': '10.0.0.3'}])
+
+        task = self._get_tasks()[0]
+        self.assertEqual(codec, task.codec)
+        self.assertEqual({'id': 'p1', 'name': 'a', 'fixed_ips': [
+            {'subnet_id': 's1', 'ip_address': '10.0.0.3'}]},
+            task_db.load_task_data(task.data, task.codec))
+        return task
+
+    def test_json_serializer(self):
+        self._test_serializer('json')
+
+    def test_compact_serializer(self):
+        task = self._test_serializer('compact')
+        self.assertNotIn(' ', task.data)
+
+    def test_fast_serializer(self):
+        task = self._test_serializer('fast')
+        self.assertNotIn(' ', task.data)
+
+    def test_fast_serializer_non_native_types(self):
+        data = {'created_at': datetime.datetime(2015, 5, 1)}
+        self.assertEqual(task_db.serialize_task_data(data, 'json')[0],
+                         jsonutils.dumps(data))
+        self.assertEqual(
+            jsonutils.loads(task_db.serialize_task_data(data, 'fast')[0]),
+            jsonutils.loads(jsonutils.dumps(data)))
+
+    def test_binary_serializer_recorded_as_codec(self):
+        if 'msgpack' not in task_db._SERIALIZERS:
+            self.skipTest('msgpack is not available')
+        self._test_serializer('msgpack', codec='msgpack')
+
+    def test_binary_serializer_with_codec(self):
+        if 'msgpack' not in task_db._SERIALIZERS:
+            self.skipTest('msgpack is not available')
+        cfg.CONF.set_override('task_codec', 'zlib', group='MIDONET')
+        self._test_serializer('msgpack', codec='msgpack+zlib')
+
+
+class TestTaskUpdateDelta(TaskDbTestCase):
+
+    def setUp(self):
+        super(TestTaskUpdateDelta, self).setUp()
+        cfg.CONF.set_override('task_update_delta', True, group='MIDONET')
+        cfg.CONF.set_override('task_delta_snapshot_interval', 3,
+                              group='MIDONET')
+
+    def test_update_written_as_delta(self):
+        self._create_task(task_db.CREATE, 'p1', name='a', fixed_ips=[1, 2])
+        self._create_task(task_db.UPDATE, 'p1', name='b', fixed_ips=[1, 2])
+
+        tasks = self._get_tasks()
+        self.assertEqual(task_db.UPDATE_DELTA, tasks[1].type)
+        self.assertEqual({'set': {'name': 'b'}, 'unset': []},
+                         jsonutils.loads(tasks[1].data))
+
+    def test_removed_keys_unset(self):
+        self._create_task(task_db.CREATE, 'p1', name='a')
+        self._create_task(task_db.UPDATE, 'p1')
+
+        delta = jsonutils.loads(self._get_tasks()[1].data)
+        self.assertEqual({'set': {}, 'unset': ['name']}, delta)
+
+    def test_full_update_every_interval(self):
+        self._create_task(task_db.CREATE, 'p1', name='a')
+        for name in ('b', 'c', 'd', 'e'):
+            self._create_task(task_db.UPDATE, 'p1', name=name)
+
+        self.assertEqual([task_db.CREATE, task_db.UPDATE_DELTA,
+                          task_db.UPDATE_DELTA, task_db.UPDATE,
+                          task_db.UPDATE_DELTA],
+                         [t.type for t in self._get_tasks()])
+
+    def test_full_update_without_previous_task(self):
+        self._create_task(task_db.UPDATE, 'p1', name='a')
+
+        self.assertEqual(task_db.UPDATE, self._get_tasks()[0].type)
+
+    def test_full_update_after_delete(self):
+        self._create_task(task_db.CREATE, 'p1', name='a')
+        self._create_task(task_db.DELETE, 'p1')
+        self._create_task(task_db.UPDATE, 'p1', name='b')
+
+        self.assertEqual(task_db.UPDATE, self._get_tasks()[2].type)
+
+    def test_current_task_data_applies_deltas(self):
+        self._create_task(task_db.CREATE, 'p1', name='a', status='DOWN')
+        self._create_task(task_db.UPDATE, 'p1', name='b', status='DOWN')
+        self._create_task(task_db.UPDATE, 'p1', name='b')
+
+        data = self._get_current_task_data()
+        self.assertEqual({'id': 'p1', 'name': 'b'}, data[task_db.PORT]['p1'])
+
+
+class TestCurrentTaskData(TaskDbTestCase):
+
+    def test_latest_data_by_type(self):
+        self._create_task(task_db.CREATE, 'n1', data_type=task_db.NETWORK,
+                          name='a')
+        self._create_task(task_db.CREATE, 'p1', name='a')
+        self._create_task(task_db.CREATE, 'p2', name='a')
+        self._create_task(task_db.UPDATE, 'p1', name='b')
+        self._create_task(task_db.DELETE, 'p2')
+        self._create_task(task_db.CREATE, 'p3', name='a')
+
+        self.assertEqual(
+            {task_db.NETWORK: {'n1': {'id': 'n1', 'name': 'a'}},
+             task_db.PORT: {'p1': {'id': 'p1', 'name': 'b'},
+                            'p3': {'id': 'p3', 'name': 'a'}}},
+            self._get_current_task_data(batch_size=1))
+
+    def test_only_deleted_resources(self):
+        self._create_task(task_db.CREATE, 'p1', name='a')
+        self._create_task(task_db.DELETE, 'p1')
+
+        self.assertEqual({}, self._get_current_task_data())
+
+    def test_ordered_by_type_and_id(self):
+        for resource_id in ('p3', 'p1', 'p2'):
+            self._create_task(task_db.CREATE, resource_id)
+
+        rows = task_db.iter_current_task_data(self.ctx.session, 2)
+        self.assertEqual(['p1', 'p2', 'p3'], [r[1] for r in rows])
+
+
+class TestResourceHash(TaskDbTestCase):
+
+    def _assert_same_hash(self, a, b):
+        self.assertEqual(task_db.hash_resource(a), task_db.hash_resource(b))
+
+    def _assert_other_hash(self, a, b):
+        self.assertNotEqual(task_db.hash_resource(a),
+                            task_db.hash_resource(b))
+
+    def test_none_ignored(self):
+        self._assert_same_hash({'id': 'p1', 'name': None}, {'id': 'p1'})
+
+    def test_false_not_ignored(self):
+        self._assert_other_hash({'id': 'p1', 'admin_state_up': False},
+                                {'id': 'p1'})
+        self._assert_other_hash({'id': 'p1', 'admin_state_up': False},
+                                {'id': 'p1', 'admin_state_up': True})
+
+    def test_ordered_list(self):
+        self._assert_other_hash({'dns_nameservers': ['1.1.1.1', '2.2.2.2']},
+                                {'dns_nameservers': ['2.2.2.2', '1.1.1.1']})
+
+    def test_unordered_list(self):
+        self._assert_same_hash({'security_groups': ['sg1', 'sg2']},
+                               {'security_groups': ['sg2', 'sg1']})
+
+
+class TestTaskQueryPlans(TaskDbTestCase):
+    """Checks that the hot queries on the tasks table use its indexes."""
+
+    def _explain(self, query):
+        session = self.ctx.session
+        dialect = session.bind.dialect
+        compiled = query.statement.compile(dialect=dialect)
+        params = [compiled.params[k] for k in compiled.positiontup]
+        if dialect.name == 'mysql':
+            rows = session.connection().execute('EXPLAIN ' + str(compiled),
+                                                *params)
+            return ' '.join(str(row['key']) for row in rows)
+        rows = session.connection().execute(
+            'EXPLAIN QUERY PLAN ' + str(compiled), *params)
+        return ' '.join(str(row[-1]) for row in rows)
+
+    def _query(self):
+        return self.ctx.session.query(task_db.Task)
+
+    def test_resource_lookup_uses_index(self):
+        query = self._query().filter(
+            task_db.Task.data_type == task_db.PORT,
+            task_db.Task.resource_id == 'p1').order_by(
+            task_db.Task.id.desc()).limit(10)
+        self.assertIn('ix_midonet_tasks_resource', self._explain(query))
+
+    def test_transaction_lookup_uses_index(self):
+        query = self._query().filter(task_db.Task.transaction_id == 'req')
+        self.assertIn('ix_midonet_tasks_transaction_id', self._explain(query))
+
+    def test_created_at_range_uses_index(self):
+        query = self._query().filter(
+            task_db.Task.created_at < datetime.datetime.utcnow())
+        self.assertIn('ix_midonet_tasks_created_at', self._explain(query))
+
+    def test_latest_tasks_use_index(self):
+        query = task_db._get_latest_task_ids(self.ctx.session,
+                                             (task_db.PORT, 'p1')).limit(10)
+        self.assertIn('ix_midonet_tasks_resource', self._explain(query))
+
+    def test_unprocessed_tasks_use_primary_key(self):
+        query = self._query().filter(task_db.Task.id > 10)
+        self.assertIn('PRIMARY', self._explain(query).upper())
+
+
+class TestTaskList(TaskDbTestCase):
+
+    def setUp(self):
+        super(TestTaskList, self).setUp()
+        for i in range(5):
+            self._create_task(task_db.CREATE, 'p%d' % i)
+        self.ids = [t.id for t in self._get_tasks()]
+
+    def _list(self, *args, **kwargs):
+        return [t.id for t in task_db.get_task_list(self.ctx.session, *args,
+                                                    **kwargs)]
+
+    def test_list_all(self):
+        self.assertEqual(self.ids, self._list(batch_size=2))
+
+    def test_list_since_id_with_limit(self):
+        self.assertEqual(self.ids[2:4], self._list(since_id=self.ids[1],
+                                                   limit=2))
+
+    def test_list_tail(self):
+        self.assertEqual(self.ids[3:], self._list(tail=2))
+        self.assertEqual(self.ids, self._list(tail=10))
+
+    def test_list_unprocessed(self):
+        self.ctx.session.add(data_state_db.DataState(
+            last_processed_task_id=self.ids[2],
+            updated_at=datetime.datetime.utcnow(),
+            readonly=False))
+        self.assertEqual(self.ids[3:], self._list(True))
+        self.assertEqual(self.ids[4:], self._list(True, since_id=self.ids[3]))
+
+    def test_list_without_data(self):
+        tasks = list(task_db.get_task_list(self.ctx.session))
+        self.assertNotIn('data', tasks[0].__dict__)
+
+
+class TestResourceSnapshot(TaskDbTestCase):
+
+    def _get_snapshots(self):
+        return dict((s.resource_id, task_db.load_task_data(s.data, s.codec))
+                    for s in task_db.get_resource_snapshots(self.ctx.session))
+
+    def test_snapshot_follows_tasks(self):
+        self._create_task(task_db.CREATE, 'p1', name='a')
+        self._create_task(task_db.CREATE, 'p2', name='a')
+        self._create_task(task_db.UPDATE, 'p1', name='b')
+        self._create_task(task_db.DELETE, 'p2')
+
+        self.assertEqual({'p1': {'id': 'p1', 'name': 'b'}},
+                         self._get_snapshots())
+
+    def test_snapshot_only_deleted_with_resource(self):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+        engine = self.ctx.session.get_bind()
+        event.listen(engine, 'before_cursor_execute', record)
+        self.addCleanup(event.remove, engine, 'before_cursor_execute',
+                        record)
+        self._create_task(task_db.CREATE, 'p1', name='a')
+        self._create_task(task_db.UPDATE, 'p1', name='b')
+
+        self.assertFalse([s for s in statements
+                          if s.lstrip().upper().startswith('DELETE')])
+        self.assertEqual({'p1': {'id': 'p1', 'name': 'b'}},
+                         self._get_snapshots())
+
+    def test_snapshot_of_update_inserted_if_missing(self):
+        self._create_task(task_db.CREATE, 'p1', name='a')
+        self.ctx.session.query(task_db.ResourceSnapshot).delete()
+        self._create_task(task_db.UPDATE, 'p1', name='b')
+
+        self.assertEqual({'p1': {'id': 'p1', 'name': 'b'}},
+                         self._get_snapshots())
+
+    def test_snapshot_of_config_written_on_each_start(self):
+        task_db.create_config_task(self.ctx.session, {'tunnel_protocol': 1})
+        task_db.create_config_task(self.ctx.session, {'tunnel_protocol': 2})
+
+        snapshots = list(task_db.get_resource_snapshots(
+            self.ctx.session, data_types=[task_db.CONFIG]))
+        self.assertEqual(1, len(snapshots))
+        self.assertEqual(2, task_db.load_task_data(
+            snapshots[0].data, snapshots[0].codec)['tunnel_protocol'])
+
+    def test_snapshot_of_create_replaces_existing(self):
+        self._create_task(task_db.CREATE, 'p1', name='a')
+        self._create_task(task_db.CREATE, 'p1', name='b')
+
+        self.assertEqual({'p1': {'id': 'p1', 'name': 'b'}},
+                         self._get_snapshots())
+
+    def test_snapshot_of_rules_created_with_group(self):
+        rule = {'id': 'r1', 'security_group_id': 'sg1'}
+        self._create_task(task_db.CREATE, 'sg1',
+                          data_type=task_db.SECURITY_GROUP,
+                          security_group_rules=[rule])
+        self._create_task(task_db.CREATE, 'r2',
+                          data_type=task_db.SECURITY_GROUP_RULE,
+                          security_group_id='sg1')
+        self._create_task(task_db.DELETE, 'r1',
+                          data_type=task_db.SECURITY_GROUP_RULE)
+
+        self.assertEqual({'sg1': {'id': 'sg1',
+                                  'security_group_rules': [rule]},
+                          'r2': {'id': 'r2', 'security_group_id': 'sg1'}},
+                         self._get_snapshots())
+        task_db.rebuild_resource_snapshots(self.ctx.session)
+        self.assertEqual(['r2', 'sg1'], sorted(self._get_snapshots()))
+
+    def test_snapshot_rolled_back_with_tasks(self):
+        self._create_task(task_db.CREATE, 'p1', name='a')
+        try:
+            with self.ctx.session.begin(subtransactions=True):
+                self._create_task(task_db.UPDATE, 'p1', name='b')
+                self.ctx.session.flush()
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual({'p1': {'id': 'p1', 'name': 'a'}},
+                         self._get_snapshots())
+
+    def test_snapshot_has_full_data_of_deltas(self):
+        cfg.CONF.set_override('task_update_delta', True, group='MIDONET')
+        cfg.CONF.set_override('task_codec', 'zlib', group='MIDONET')
+        self._create_task(task_db.CREATE, 'p1', name='a', status='DOWN')
+        self._create_task(task_db.UPDATE, 'p1', name='b', status='DOWN')
+
+        self.assertEqual(task_db.UPDATE_DELTA, self._get_tasks()[1].type)
+        self.assertEqual({'p1': {'id': 'p1', 'name': 'b', 'status': 'DOWN'}},
+                         self._get_snapshots())
+
+    def test_snapshot_filters(self):
+        self._create_task(task_db.CREATE, 'p1')
+        self._create_task(task_db.CREATE, 'p2')
+        self._create_task(task_db.CREATE, 'n1', data_type=task_db.NETWORK)
+
+        def _ids(**kwargs):
+            return [s.resource_id for s in task_db.get_resource_snapshots(
+                self.ctx.session, **kwargs)]
+        self.assertEqual(['p1', 'p2'], _ids(data_types=[task_db.PORT]))
+        self.assertEqual(['n1', 'p2'], _ids(resource_ids=['p2', 'n1']))
+        self.assertEqual([], _ids(tenant_ids=['other']))
+
+    def test_rebuild_snapshots(self):
+        self._create_task(task_db.CREATE, 'p1', name='a')
+        self._create_task(task_db.CREATE, 'p2', name='a')
+        self.ctx.session.query(task_db.ResourceSnapshot).delete()
+
+        self.assertEqual(2, task_db.rebuild_resource_snapshots(
+            self.ctx.session))
+        self.assertEqual({'p1': {'id': 'p1', 'name': 'a'},
+                          'p2': {'id': 'p2', 'name': 'a'}},
+                         self._get_snapshots())
+
+
+class TestTaskStats(TaskDbTestCase):
+
+    def test_stats(self):
+        for i in range(4):
+            self._create_task(task_db.CREATE, 'p%d' % i)
+        self._create_task(task_db.CREATE, 'n1', data_type=task_db.NETWORK)
+        ids = [t.id for t in self._get_tasks()]
+        self.ctx.session.add(data_state_db.DataState(
+            last_processed_task_id=ids[2],
+            updated_at=datetime.datetime.utcnow(),
+            readonly=False))
+
+        stats = task_db.get_task_stats(self.ctx.session, window=120)
+        self.assertEqual(5, stats['total'])
+        self.assertEqual(2, stats['unprocessed'])
+        self.assertEqual(ids[-1], stats['max_id'])
+        self.assertEqual(ids[2], stats['last_processed_task_id'])
+        self.assertTrue(stats['oldest_unprocessed_age'] >= 0)
+        self.assertEqual([task_db.NETWORK, task_db.PORT],
+                         [t[0] for t in stats['by_type']])
+        self.assertEqual([1, 4], [t[1] for t in stats['by_type']])
+        self.assertEqual(2, len(stats['buckets']))
+        self.assertEqual(5, sum(b[1] for b in stats['buckets']))
+        self.assertEqual(3, sum(b[2] for b in stats['buckets']))
+
+    def test_stats_of_a_day(self):
+        self._create_task(task_db.CREATE, 'p1')
+        self.ctx.session.add(data_state_db.DataState(
+            updated_at=datetime.datetime.utcnow(), readonly=False))
+
+        stats = task_db.get_task_stats(self.ctx.session, window=86400)
+        self.assertEqual(1440, len(stats['buckets']))
+        self.assertEqual((1, 0), stats['buckets'][-1][1:])
+        self.assertEqual(1, sum(b[1] for b in stats['buckets']))
+
+    def test_stats_of_window_only(self):
+        self._create_task(task_db.CREATE, 'p1')
+        self._create_task(task_db.CREATE, 'p2')
+        self.ctx.session.query(task_db.Task).filter_by(
+            resource_id='p1').update({'created_at': datetime.datetime(
+                2000, 1, 1)})
+        self.ctx.session.add(data_state_db.DataState(
+            updated_at=datetime.datetime.utcnow(), readonly=False))
+
+        stats = task_db.get_task_stats(self.ctx.session)
+        self.assertEqual(1, stats['total'])
+        self.assertEqual([(task_db.PORT, 1)],
+                         [t[:2] for t in stats['by_type']])
+        self.assertEqual(2, stats['unprocessed'])
+
+    def test_stats_without_tasks(self):
+        self.ctx.session.add(data_state_db.DataState(
+            updated_at=datetime.datetime.utcnow(), readonly=False))
+
+        stats = task_db.get_task_stats(self.ctx.session)
+        self.assertEqual(0, stats['total'])
+        self.assertEqual([], stats['by_type'])
+        self.assertEqual(0, sum(b[1] for b in stats['buckets']))
+
+    def test_stats_without_processed_tasks(self):
+        self._create_task(task_db.CREATE, 'p1')
+        self.ctx.session.add(data_state_db.DataState(
+            updated_at=datetime.datetime.utcnow(), readonly=False))
+
+        stats = task_db.get_task_stats(self.ctx.session)
+        self.assertEqual(1, stats['unprocessed'])
+        self.assertEqual(0, sum(b[2] for b in stats['buckets']))
+
+
+class TestTaskGc(TaskDbTestCase):
+
+    def _set_last_processed(self, task_id):
+        self.ctx.session.add(data_state_db.DataState(
+            last_processed_task_id=task_id,
+            updated_at=datetime.datetime.utcnow(),
+            readonly=False))
+
+    def _create_tasks(self, count):
+        for i in range(count):
+            self._create_task(task_db.CREATE, 'p%d' % i)
+        return [t.id for t in self._get_tasks()]
+
+    def test_gc_deletes_processed_tasks_in_chunks(self):
+        ids = self._create_tasks(10)
+        self._set_last_processed(ids[6])
+
+        self.assertEqual(6, task_db.task_gc(self.ctx.session, 0, 4))
+        self.assertEqual(ids[6:], [t.id for t in self._get_tasks()])
+
+    def test_gc_keeps_tasks_within_retention(self):
+        ids = self._create_tasks(3)
+        self._set_last_processed(ids[2])
+
+        self.assertEqual(0, task_db.task_gc(self.ctx.session, 3600, 10))
+        self.assertEqual(ids, [t.id for t in self._get_tasks()])
+
+    def test_gc_without_processed_tasks(self):
+        ids = self._create_tasks(3)
+        self._set_last_processed(None)
+
+        self.assertEqual(0, task_db.task_gc(self.ctx.session, 0, 10))
+        self.assertEqual(ids, [t.id for t in self._get_tasks()])
+
+    def test_gc_archives_processed_tasks(self):
+        ids = self._create_tasks(5)
+        self._set_last_processed(ids[3])
+
+        self.assertEqual(3, task_db.task_gc(self.ctx.session, 0, 2,
+                                            archive=True))
+        self.assertEqual(ids[3:], [t.id for t in self._get_tasks()])
+        archived = self.ctx.session.query(task_db.TaskArchive).order_by(
+            task_db.TaskArchive.id).all()
+        self.assertEqual(ids[:3], [t.id for t in archived])
+        self.assertEqual(['p0', 'p1', 'p2'],
+                         [t.resource_id for t in archived])
+
+
+class TestTaskNotifier(TaskDbTestCase):
+
+    def _set_notifier(self, notifier):
+        cfg.CONF.set_override('task_notifier', notifier, group='MIDONET')
+        self.addCleanup(setattr, task_db, '_notifier', (None, None))
+
+    def setUp(self):
+        super(TestTaskNotifier, self).setUp()
+        del RecordingTaskNotifier.notified[:]
+        self._set_notifier(__name__ + '.RecordingTaskNotifier')
+
+    def test_notified_after_commit(self):
+        with self.ctx.session.begin(subtransactions=True):
+            self._create_task(task_db.CREATE, 'p1')
+            self._create_task(task_db.CREATE, 'p2')
+            self.assertEqual([], RecordingTaskNotifier.notified)
+
+        self.assertEqual([self._get_tasks()[-1].id],
+                         RecordingTaskNotifier.notified)
+
+    def test_notified_of_own_tasks_only(self):
+        with self.ctx.session.begin(subtransactions=True):
+            # Stands for a task of another transaction
+            task_db.insert_tasks(self.ctx.session, [
+                {'id': 100, 'type': task_db.CREATE,
+                 'data_type': task_db.PORT, 'resource_id': 'p0'}])
+            task_db.create_task(self.ctx, task_db.CREATE, task_id=1,
+                                data_type=task_db.PORT, resource_id='p1',
+                                data={'id': 'p1'})
+
+        self.assertEqual([1], RecordingTaskNotifier.notified)
+
+    def test_notified_once_after_savepoint(self):
+        with self.ctx.session.begin(subtransactions=True):
+            with self.ctx.session.begin_nested():
+                self._create_task(task_db.CREATE, 'p1')
+            self.assertEqual([], RecordingTaskNotifier.notified)
+            self._create_task(task_db.CREATE, 'p2')
+
+        self.assertEqual([self._get_tasks()[-1].id],
+                         RecordingTaskNotifier.notified)
+
+    def test_not_notified_on_rollback(self):
+        try:
+            with self.ctx.session.begin(subtransactions=True):
+                with self.ctx.session.begin_nested():
+                    self._create_task(task_db.CREATE, 'p1')
+                raise ValueError()
+        except ValueError:
+            pass
+
+        self.assertEqual([], RecordingTaskNotifier.notified)
+
+    def test_not_notified_without_tasks(self):
+        with self.ctx.session.begin(subtransactions=True):
+            self.ctx.session.add(task_db.TaskWatermark(id=1, task_id=0))
+
+        self.assertEqual([], RecordingTaskNotifier.notified)
+
+    def test_watermark_notifier(self):
+        self._set_notifier('midonet.neutron.db.task_notifier.'
+                           'WatermarkTaskNotifier')
+        with self.ctx.session.begin(subtransactions=True):
+            self.ctx.session.add(task_db.TaskWatermark(id=1, task_id=0))
+        self._create_task(task_db.CREATE, 'p1')
+        self._create_task(task_db.CREATE, 'p2')
+
+        self.assertEqual(self._get_tasks()[-1].id,
+                         task_db.get_task_watermark(self.ctx.session))
+
+    def test_watermark_never_decreases(self):
+        with self.ctx.session.begin(subtransactions=True):
+            self.ctx.session.add(task_db.TaskWatermark(id=1, task_id=10))
+        task_notifier.WatermarkTaskNotifier().notify(self.ctx.session, 5)
+
+        self.assertEqual(10, task_db.get_task_watermark(self.ctx.session))
+
+    def test_unix_socket_notifier(self):
+        path = tempfile.mktemp()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.bind(path)
+        self.addCleanup(sock.close)
+        notifier = task_notifier.UnixSocketTaskNotifier(path)
+
+        notifier.notify(self.ctx.session, 42)
+        self.assertEqual(b'42', sock.recv(64))
+
+    def test_unix_socket_notifier_without_listener(self):
+        notifier = task_notifier.UnixSocketTaskNotifier(tempfile.mktemp())
+        notifier.notify(self.ctx.session, 42)
@@ -0,0 +1,75 @@
+# Copyright (C) 2015 Midokura SARL.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import os
+import tempfile
+
+from midonet.neutron.db import data_state_db
+from midonet.neutron.db import task_db
+from midonet.neutron.db import task_metrics
+
+from neutron import context
+from neutron.tests.unit import testlib_api
+
+
+class RecordingTaskMetricsSink(task_metrics.TaskMetricsSinkBase):
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, metrics):
+        self.published.append(metrics)
+
+
+class TestTaskMetrics(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(TestTaskMetrics, self).setUp()
+        self.ctx = context.get_admin_context()
+        for i in range(3):
+            task_db.create_task(self.ctx, task_db.CREATE,
+                                data_type=task_db.PORT,
+                                resource_id='p%d' % i, data={'id': 'p%d' % i})
+        self.ids = [t.id for t in self.ctx.session.query(task_db.Task)]
+        self.ctx.session.add(data_state_db.DataState(
+            last_processed_task_id=self.ids[0],
+            updated_at=datetime.datetime.utcnow(),
+            readonly=False))
+
+    def test_collect(self):
+        sink = RecordingTaskMetricsSink()
+        collector = task_metrics.TaskMetricsCollector(sink)
+
+        metrics = collector.collect(self.ctx.session)
+        self.assertEqual([metrics], sink.published)
+        self.assertEqual(self.ids[-1], metrics['max_task_id'])
+        self.assertEqual(self.ids[0], metrics['last_processed_task_id'])
+        self.assertEqual(2, metrics['lag_tasks'])
+        self.assertNotIn('insert_rate', metrics)
+
+        metrics = collector.collect(self.ctx.session)
+        self.assertEqual(0, metrics['insert_rate'])
+        self.assertEqual(0, metrics['process_rate'])
+
+    def test_prometheus_file_sink(self):
+        path = os.path.join(tempfile.mkdtemp(), 'tasks.prom')
+        sink = task_metrics.PrometheusFileTaskMetricsSink(path)
+        task_metrics.TaskMetricsCollector(sink).collect(self.ctx.session)
+
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertIn('midonet_tasks_lag_tasks 2', lines)
+        self.assertIn('# TYPE midonet_tasks_lag_tasks gauge', lines)